@@ -0,0 +1,475 @@
+"""Load and soak tests for the streaming pipeline using local stand-ins.
+
+A local HTTP server serves a generated MP3 in place of the Qurango.net
+stations and each channel writes FLV to a file instead of an RTMP ingest (or,
+with --rtmp, publishes to a local FFmpeg listening as an RTMP server), so the
+numbers only reflect this process and its FFmpeg children.
+
+    python bench.py channels --steps 1,5,10,20,40
+    python bench.py channels --steps 1,5,10 --mode direct --profile passthrough
+    python bench.py soak --channels 8 --cycles 2000
+    python bench.py dsp --channels 50
+
+`channels` starts channels in steps and reports what each one costs. `soak`
+keeps a set of channels cycling through gapless, crossfade and hard
+switches and stop/start, and reports switch latency percentiles, relay
+throughput and per-channel cost as it goes. At the end it stops everything
+and compares threads, fds, tasks and child processes with the numbers from
+before the first start, to catch leaks. `dsp` runs the loudness normalizer
+over many channels' worth of audio on one core, without FFmpeg.
+
+Linux only (CPU, memory and sockets are read from /proc).
+"""
+import argparse
+import asyncio
+import logging
+import os
+import shutil
+import socket
+import statistics
+import subprocess
+import sys
+import tempfile
+import threading
+import time
+from functools import partial
+from http.server import SimpleHTTPRequestHandler
+from typing import Dict, List, Optional
+
+import main
+
+def make_source(directory: str, seconds: int = 20) -> str:
+    """Generate a test-tone MP3 to stand in for a radio station"""
+    path = os.path.join(directory, "source.mp3")
+    subprocess.run(
+        ["ffmpeg", "-loglevel", "error", "-y", "-f", "lavfi", "-i", f"sine=frequency=440:duration={seconds}",
+         "-ac", "2", "-ar", "44100", "-c:a", "libmp3lame", "-b:a", "128k", path],
+        check=True,
+    )
+    return path
+
+
+def serve_directory(directory: str) -> main.ThreadingHTTPServer:
+    class QuietHandler(SimpleHTTPRequestHandler):
+        def log_message(self, format, *args):
+            pass
+
+    server = main.ThreadingHTTPServer(("127.0.0.1", 0), partial(QuietHandler, directory=directory))
+    threading.Thread(target=server.serve_forever, daemon=True).start()
+    return server
+
+
+def child_pids() -> List[int]:
+    me = os.getpid()
+    pids = []
+    for entry in os.listdir("/proc"):
+        if not entry.isdigit():
+            continue
+        try:
+            with open(f"/proc/{entry}/stat") as f:
+                fields = f.read().rsplit(")", 1)[1].split()
+        except OSError:
+            continue
+        if int(fields[1]) == me:
+            pids.append(int(entry))
+    return pids
+
+
+def proc_sample(pid: int) -> Dict[str, float]:
+    """CPU seconds, RSS bytes and thread count of one process"""
+    return main.process_usage(pid) or {"cpu": 0.0, "rss": 0, "threads": 0}
+
+
+def tree_sample() -> Dict[str, float]:
+    pids = [os.getpid()] + child_pids()
+    samples = [proc_sample(pid) for pid in pids]
+    return {
+        "cpu": sum(s["cpu"] for s in samples),
+        "rss": sum(s["rss"] for s in samples),
+        "self_rss": samples[0]["rss"],
+        "threads": samples[0]["threads"],
+        "fds": len(os.listdir("/proc/self/fd")),
+        "processes": len(pids) - 1,
+    }
+
+
+def bench_channels(args) -> None:
+    asyncio.run(_bench_channels(args))
+
+
+async def _bench_channels(args) -> None:
+    manager = main.StreamManager()
+    workdir = tempfile.mkdtemp(prefix="qs-bench-")
+    server = serve_directory(workdir)
+    try:
+        make_source(workdir)
+        source_url = f"http://127.0.0.1:{server.server_address[1]}/source.mp3"
+        steps = sorted(int(n) for n in args.steps.split(","))
+        profile, _ = main._parse_profile(args.profile)
+        started = 0
+        print(f"{'channels':>8} {'running':>8} {'start p50':>10} {'start max':>10} "
+              f"{'cpu %':>7} {'cpu %/ch':>9} {'rss MB':>8} {'MB/ch':>7} {'py MB':>6} {'threads':>8} {'fds':>6}")
+
+        async def start(n: int) -> float:
+            t0 = time.perf_counter()
+            await manager.start_stream(source_url, workdir, f"ch{n}.flv", f"bench {n}", channel_id=f"ch{n}",
+                                       mode=args.mode, profile=profile)
+            return time.perf_counter() - t0
+
+        for target in steps:
+            latencies = await asyncio.gather(*(start(n) for n in range(started, target)))
+            started = target
+            await asyncio.sleep(args.settle)
+
+            before = tree_sample()
+            t0 = time.monotonic()
+            await asyncio.sleep(args.window)
+            after = tree_sample()
+            cpu = 100.0 * (after["cpu"] - before["cpu"]) / (time.monotonic() - t0)
+            running = sum(1 for ch in manager.channels() if ch.get_status()["running"])
+            print(f"{target:>8} {running:>8} {statistics.median(latencies) * 1000:>8.0f}ms "
+                  f"{max(latencies) * 1000:>8.0f}ms {cpu:>7.1f} {cpu / target:>9.2f} "
+                  f"{after['rss'] / 2**20:>8.0f} {after['rss'] / 2**20 / target:>7.1f} "
+                  f"{after['self_rss'] / 2**20:>6.0f} {after['threads']:>8} {after['fds']:>6}")
+            if running < target:
+                print(f"only {running}/{target} channels running, stopping here")
+                break
+    finally:
+        await manager.stop_all()
+        server.shutdown()
+        shutil.rmtree(workdir, ignore_errors=True)
+
+
+def percentiles(values: List[float]) -> Dict[str, float]:
+    """p50/p95/p99/max of a sample, 0 when empty"""
+    if not values:
+        return {"p50": 0.0, "p95": 0.0, "p99": 0.0, "max": 0.0}
+    if len(values) == 1:
+        return {"p50": values[0], "p95": values[0], "p99": values[0], "max": values[0]}
+    cuts = statistics.quantiles(values, n=100, method="inclusive")
+    return {"p50": cuts[49], "p95": cuts[94], "p99": cuts[98], "max": max(values)}
+
+
+def free_port() -> int:
+    with socket.socket() as s:
+        s.bind(("127.0.0.1", 0))
+        return s.getsockname()[1]
+
+
+def listening(port: int) -> bool:
+    """Whether something listens on a local TCP port, without connecting to it"""
+    needle = f":{port:04X} "
+    try:
+        with open("/proc/net/tcp") as f:
+            return any(needle in line and line.split()[3] == "0A" for line in f)
+    except OSError:
+        return False
+
+
+class RtmpIngest:
+    """A local FFmpeg RTMP server per channel, standing in for the real ingest.
+
+    `ffmpeg -listen 1` takes a single publisher and exits when it disconnects,
+    so each channel's listener is started again whenever it exits.
+    """
+
+    def __init__(self) -> None:
+        self._tasks: Dict[str, asyncio.Task] = {}
+        self._procs: Dict[str, asyncio.subprocess.Process] = {}
+        self.sessions = 0
+
+    async def url(self, channel_id: str) -> str:
+        """RTMP server URL for a channel, listening before this returns"""
+        if channel_id not in self._tasks:
+            port = free_port()
+            self._tasks[channel_id] = asyncio.create_task(self._serve(channel_id, port))
+            self._tasks[channel_id].port = port
+        port = self._tasks[channel_id].port
+        for _ in range(100):
+            if listening(port):
+                break
+            await asyncio.sleep(0.02)
+        return f"rtmp://127.0.0.1:{port}/live"
+
+    async def _serve(self, channel_id: str, port: int) -> None:
+        while True:
+            proc = await asyncio.create_subprocess_exec(
+                "ffmpeg", "-loglevel", "error", "-listen", "1", "-i", f"rtmp://127.0.0.1:{port}/live/{channel_id}",
+                "-c", "copy", "-f", "null", "-",
+                stdin=subprocess.DEVNULL, stdout=subprocess.DEVNULL, stderr=subprocess.DEVNULL,
+            )
+            self._procs[channel_id] = proc
+            await proc.wait()
+            self.sessions += 1
+
+    async def close(self) -> None:
+        for task in self._tasks.values():
+            task.cancel()
+        for proc in self._procs.values():
+            if proc.returncode is None:
+                proc.kill()
+                await proc.wait()
+        self._tasks.clear()
+        self._procs.clear()
+
+
+class SwitchLog:
+    """Collects the "switch" events the channels publish once a start or switch has audio flowing"""
+
+    def __init__(self) -> None:
+        self.ms: Dict[str, List[float]] = {}
+        self.total: Dict[str, List[float]] = {}
+        self.lost = 0
+        self._seq = main.event_bus.seq
+        self._task = asyncio.create_task(self._run())
+
+    async def _run(self) -> None:
+        while True:
+            await main.event_bus.wait()
+            self.drain()
+
+    def drain(self) -> None:
+        events = main.event_bus.since(self._seq)
+        if events is None:
+            self.lost += 1  # Fell behind the backlog
+            events = main.event_bus.since(main.event_bus.seq) or []
+        for seq, kind, data in events:
+            if kind == "switch":
+                self.ms.setdefault(data["mode"], []).append(data["ms"])
+                self.total.setdefault(data["mode"], []).append(data["ms"])
+        self._seq = main.event_bus.seq
+
+    def take(self) -> Dict[str, List[float]]:
+        """Latencies since the last take(), by mode"""
+        self.drain()
+        ms, self.ms = self.ms, {}
+        return ms
+
+    def close(self) -> None:
+        self._task.cancel()
+
+
+SOAK_ACTIONS = [
+    ("gapless", {"switch_mode": "gapless"}),
+    ("crossfade", {"switch_mode": "gapless", "crossfade_ms": 300}),
+    ("hard", {"switch_mode": "hard"}),
+    ("restart", None),  # Stop, then start again
+]
+
+
+def bench_soak(args) -> None:
+    asyncio.run(_bench_soak(args))
+
+
+async def _bench_soak(args) -> None:
+    manager = main.StreamManager()
+    main.source_pool.grace = args.grace
+    workdir = tempfile.mkdtemp(prefix="qs-soak-")
+    server = serve_directory(workdir)
+    ingest = RtmpIngest() if args.rtmp else None
+    switches = SwitchLog()
+    make_source(workdir, 60)
+    base_url = f"http://127.0.0.1:{server.server_address[1]}/source.mp3"
+    stations = [f"{base_url}?station={n}" for n in range(args.stations)]
+    channel_ids = [f"soak{n}" for n in range(args.channels)]
+    manager._start_http_server()  # Lives as long as the process, so part of the baseline
+    await asyncio.sleep(0.5)
+    baseline = tree_sample()
+    baseline["tasks"] = len(asyncio.all_tasks())
+    errors: Dict[str, int] = {}
+    wall_ms: List[float] = []
+    t_start = time.monotonic()
+    try:
+        async def start(channel_id: str, cycle: int, options: Optional[Dict[str, object]]) -> None:
+            station = stations[(cycle + channel_ids.index(channel_id)) % len(stations)]
+            if ingest is not None:
+                rtmp_server, key = await ingest.url(channel_id), channel_id
+            else:
+                rtmp_server, key = workdir, f"{channel_id}.flv"
+            t0 = time.perf_counter()
+            if options is None:
+                await manager.stop_stream(channel_id)
+                result = await manager.start_stream(station, rtmp_server, key, f"station {station[-1]}",
+                                                    channel_id=channel_id)
+            else:
+                result = await manager.start_stream(station, rtmp_server, key, f"station {station[-1]}",
+                                                    channel_id=channel_id, **options)
+            wall_ms.append((time.perf_counter() - t0) * 1000)
+            if "error" in result:
+                errors[result["error"]] = errors.get(result["error"], 0) + 1
+
+        await asyncio.gather(*(start(channel_id, 0, {}) for channel_id in channel_ids))
+        await asyncio.sleep(args.settle)
+        switches.take()
+        print(f"{'cycles':>7} {'switches':>8} {'p50 ms':>7} {'p95 ms':>7} {'p99 ms':>7} {'max ms':>7} {'errors':>6} "
+              f"{'rt ratio':>8} {'underrun':>8} {'cpu %/ch':>8} {'MB/ch':>6} {'py MB':>6} {'threads':>7} "
+              f"{'fds':>5} {'tasks':>5} {'procs':>5}")
+        window: Dict[str, List[float]] = {}
+        before, t0 = tree_sample(), time.monotonic()
+        for cycle in range(1, args.cycles + 1):
+            name, options = SOAK_ACTIONS[cycle % len(SOAK_ACTIONS)]
+            await asyncio.gather(*(start(channel_id, cycle, options) for channel_id in channel_ids))
+            await asyncio.sleep(args.interval)
+            for mode, ms in switches.take().items():
+                window.setdefault(mode, []).extend(ms)
+            if cycle % args.report_every and cycle != args.cycles:
+                continue
+            after = tree_sample()
+            cpu = 100.0 * (after["cpu"] - before["cpu"]) / (time.monotonic() - t0)
+            relays = [manager.get_status(channel_id).get("relay") or {} for channel_id in channel_ids]
+            ratio = statistics.mean(r.get("realtime_ratio", 0.0) for r in relays)
+            underruns = sum(r.get("underruns", 0) for r in relays)
+            latencies = [ms for values in window.values() for ms in values]
+            p = percentiles(latencies)
+            print(f"{cycle:>7} {len(latencies):>8} {p['p50']:>7.1f} {p['p95']:>7.1f} {p['p99']:>7.1f} {p['max']:>7.1f} "
+                  f"{sum(errors.values()):>6} {ratio:>8.3f} {underruns:>8} {cpu / len(channel_ids):>8.2f} "
+                  f"{after['rss'] / 2**20 / len(channel_ids):>6.1f} {after['self_rss'] / 2**20:>6.0f} "
+                  f"{after['threads']:>7} {after['fds']:>5} {len(asyncio.all_tasks()):>5} {after['processes']:>5}")
+            window = {mode: [] for mode in window} if args.cumulative else {}
+            if not args.cumulative:
+                before, t0 = after, time.monotonic()
+
+        print(f"\nswitch latency by mode (ms), {time.monotonic() - t_start:.0f} s:")
+        for mode, values in sorted(switches.total.items()):
+            p = percentiles(values)
+            print(f"  {mode:<18} n={len(values):<6} p50 {p['p50']:.1f}  p95 {p['p95']:.1f}  p99 {p['p99']:.1f}  "
+                  f"max {p['max']:.1f}")
+        wall = percentiles(wall_ms)
+        print(f"  {'start_stream call':<18} n={len(wall_ms):<6} p50 {wall['p50']:.1f}  p95 {wall['p95']:.1f}  p99 {wall['p99']:.1f}  "
+              f"max {wall['max']:.1f}")
+        for error, count in sorted(errors.items()):
+            print(f"  error x{count}: {error}")
+        if switches.lost:
+            print(f"  (switch events lost to the backlog {switches.lost} times)")
+    finally:
+        await manager.stop_all()
+        main.source_prober.close()
+        switches.close()
+        if ingest is not None:
+            await ingest.close()
+        server.shutdown()
+        shutil.rmtree(workdir, ignore_errors=True)
+
+    # Everything is stopped: what is left over beyond the baseline leaked
+    await asyncio.sleep(1.0)
+    end = tree_sample()
+    end["tasks"] = len(asyncio.all_tasks())
+    leaks = []
+    for key in ("threads", "fds", "tasks", "processes"):
+        if end[key] > baseline[key]:
+            leaks.append(f"{key} {baseline[key]} -> {end[key]}")
+    growth = (end["self_rss"] - baseline["self_rss"]) / 2**20
+    print(f"\nafter stop: threads {end['threads']}, fds {end['fds']}, tasks {end['tasks']}, "
+          f"processes {end['processes']}, py RSS +{growth:.1f} MB")
+    print("LEAK: " + ", ".join(leaks) if leaks else "no leaks")
+    if leaks:
+        sys.exit(1)
+
+
+def speech_like(seconds: float, seed: int = 0):
+    """Stereo float test signal with the level swings of speech: noise and a tone gated by a syllable-rate envelope"""
+    np = main.load_numpy()
+    rng = np.random.default_rng(seed)
+    n = int(seconds * main.PCM_SAMPLE_RATE)
+    t = np.arange(n) / main.PCM_SAMPLE_RATE
+    envelope = np.clip(np.sin(2 * np.pi * 3.1 * t) + 0.3 * np.sin(2 * np.pi * 0.23 * t), 0, None)
+    mono = envelope * (0.3 * rng.standard_normal(n) + np.sin(2 * np.pi * 180 * t))
+    mono *= 32767 / np.abs(mono).max()
+    return np.stack((mono, np.roll(mono, 7)), axis=1)
+
+
+def bench_dsp(args) -> None:
+    np = main.load_numpy()
+    if np is None:
+        sys.exit("loudness normalization needs NumPy (pip install numpy)")
+    tick_bytes = main.PcmRelay("bench")._tick_bytes
+    base = speech_like(args.seconds)
+    levels = np.linspace(-30.0, 0.0, args.channels) if args.channels > 1 else np.zeros(1)  # Input gain per channel, so the stations differ
+    sources = [np.clip(base * 10 ** (db / 20), -32768, 32767).astype("<i2").tobytes() for db in levels]
+    normalizers = [main.LoudnessNormalizer(args.target) for _ in sources]
+    rings = [bytearray(tick_bytes) for _ in sources]
+    ticks = len(sources[0]) // tick_bytes
+    call_ms: List[float] = []
+
+    # Round-robin over the channels a tick at a time, as the event loop would
+    cpu0 = time.process_time()
+    for i in range(ticks):
+        for source, ring, normalizer in zip(sources, rings, normalizers):
+            ring[:] = source[i * tick_bytes:(i + 1) * tick_bytes]
+            t0 = time.perf_counter()
+            normalizer.process([memoryview(ring)])
+            call_ms.append((time.perf_counter() - t0) * 1000)
+    cpu = time.process_time() - cpu0
+    audio = ticks * tick_bytes / main.PCM_BYTES_PER_SEC * len(sources)
+    p = percentiles(call_ms)
+    print(f"{len(sources)} channels x {ticks * tick_bytes / main.PCM_BYTES_PER_SEC:.0f} s in "
+          f"{tick_bytes // main.PCM_FRAME_BYTES}-frame ticks: {cpu:.2f} CPU s for {audio:.0f} s of audio")
+    print(f"  per tick: p50 {p['p50']:.3f} ms  p99 {p['p99']:.3f} ms  max {p['max']:.3f} ms")
+    print(f"  load per channel {100 * cpu / audio:.3f}% of a core, about {audio / cpu:.0f} channels per core")
+    print(f"\n{'input':>7} {'in LUFS':>8} {'gain dB':>8} {'out LUFS':>8} {'limiter':>8}")
+    for db, normalizer in list(zip(levels, normalizers))[::max(1, len(normalizers) // 8)]:
+        stats = normalizer.stats()
+        measured = stats["window_lufs"]
+        out = f"{measured + stats['gain_db']:.1f}" if measured is not None else "-"
+        print(f"{db:>+5.1f}dB {measured!s:>8} {stats['gain_db']:>+8.1f} {out:>8} {stats['max_limiter_db']:>8.1f}")
+
+    if args.compare:
+        if shutil.which("ffmpeg") is None:
+            sys.exit("ffmpeg not found in PATH")
+        # The same audio through FFmpeg's loudnorm, one process per channel as a filter graph would need
+        with tempfile.NamedTemporaryFile(suffix=".pcm") as f:
+            f.write(sources[len(sources) // 2])
+            f.flush()
+            before = os.times()
+            subprocess.run(["ffmpeg", "-loglevel", "error", "-f", "s16le", "-ar", str(main.PCM_SAMPLE_RATE), "-ac", "2",
+                            "-i", f.name, "-af", f"loudnorm=I={args.target}:TP={main.LIMITER_CEILING_DB}",
+                            "-f", "null", "-"], check=True)
+            after = os.times()
+        cpu = after.children_user + after.children_system - before.children_user - before.children_system
+        print(f"\nffmpeg loudnorm: {100 * cpu / args.seconds:.3f}% of a core per channel "
+              f"(plus the extra process and its latency)")
+
+
+def main_cli(argv=None) -> None:
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    sub = parser.add_subparsers(dest="command", required=True)
+
+    p = sub.add_parser("channels", help="start channels in steps and report per-channel cost")
+    p.add_argument("--steps", default="1,5,10,20", help="comma-separated channel counts")
+    p.add_argument("--settle", type=float, default=3.0, help="seconds to wait after starting a step")
+    p.add_argument("--window", type=float, default=5.0, help="seconds to sample CPU over")
+    p.add_argument("--mode", choices=[main.MODE_RELAY, main.MODE_DIRECT], default=main.MODE_RELAY,
+                   help="relay (feed + encoder per channel) or direct (one FFmpeg per channel)")
+    p.add_argument("--profile", choices=sorted(main.ENCODER_PROFILES), default=None,
+                   help="encoder preset (default: ENCODER_PROFILE)")
+    p.set_defaults(func=bench_channels)
+
+    p = sub.add_parser("soak", help="cycle channels through switches and restarts, watching latency and leaks")
+    p.add_argument("--channels", type=int, default=4, help="channels cycling at once")
+    p.add_argument("--cycles", type=int, default=200, help="switch/restart rounds across all channels")
+    p.add_argument("--stations", type=int, default=3, help="distinct source URLs to switch between")
+    p.add_argument("--interval", type=float, default=0.5, help="seconds of audio between rounds")
+    p.add_argument("--settle", type=float, default=2.0, help="seconds to wait after the first start")
+    p.add_argument("--report-every", type=int, default=20, help="print a row every this many rounds")
+    p.add_argument("--cumulative", action="store_true", help="percentiles over the whole run, not per row")
+    p.add_argument("--grace", type=float, default=main.SOURCE_GRACE_S,
+                   help="seconds an unused feed is kept (0 makes every switch start a new feed)")
+    p.add_argument("--rtmp", action="store_true", help="publish to local ffmpeg -listen RTMP servers, not files")
+    p.set_defaults(func=bench_soak)
+
+    p = sub.add_parser("dsp", help="run the loudness normalizer over many channels on one core")
+    p.add_argument("--channels", type=int, default=50, help="channels to normalize")
+    p.add_argument("--seconds", type=float, default=60.0, help="seconds of audio per channel")
+    p.add_argument("--target", type=float, default=-16.0, help="target loudness in LUFS")
+    p.add_argument("--compare", action="store_true", help="also time FFmpeg's loudnorm filter on the same audio")
+    p.set_defaults(func=bench_dsp)
+
+    args = parser.parse_args(argv)
+    logging.getLogger("main").setLevel(logging.WARNING)
+    if args.command != "dsp" and shutil.which("ffmpeg") is None:
+        sys.exit("ffmpeg not found in PATH")
+    args.func(args)
+
+
+if __name__ == "__main__":
+    main_cli()
@@ -1,17 +1,32 @@
 from pathlib import Path
-from typing import List, Dict, Optional
+from typing import Any, List, Dict, Optional, Set
 import subprocess
 import threading
 import os
 import logging
-import queue
+import asyncio
 import time
+import json
+import re
+import hashlib
+import itertools
+import array
+import random
+import math
+import bisect
+import heapq
+import sys
+import shutil
+import signal
+import socket
+import ssl
+from collections import deque
+from urllib.parse import urljoin, urlsplit
 from http.server import HTTPServer, BaseHTTPRequestHandler
 from socketserver import ThreadingMixIn
 
 from fastapi import FastAPI, Request
-from fastapi.responses import JSONResponse, HTMLResponse
-from fastapi.templating import Jinja2Templates
+from fastapi.responses import JSONResponse, HTMLResponse, Response, StreamingResponse
 
 # Paths
 BASE_DIR = Path(__file__).parent
@@ -26,11 +41,14 @@ logging.basicConfig(
 logger = logging.getLogger(__name__)
 
 app = FastAPI(title="QuranStream Local Controller")
-templates = Jinja2Templates(directory=str(TEMPLATES_DIR))
 
-# Global stream queue for HTTP server
-stream_queue = queue.Queue(maxsize=100)
-stream_lock = threading.Lock()
+# HTTP listener endpoint (see StreamHTTPHandler)
+HTTP_STREAM_HOST = os.environ.get("HTTP_STREAM_HOST", "127.0.0.1")
+HTTP_STREAM_PORT = int(os.environ.get("HTTP_STREAM_PORT", 8888))
+HUB_BUFFER_SIZE = 512 * 1024  # ~30 s of 128k AAC
+HUB_MAX_LAG = HUB_BUFFER_SIZE // 2  # Listeners further behind than this are dropped
+HUB_READ_SIZE = 4096
+HUB_SEND_TIMEOUT = 10.0  # A listener whose socket accepts nothing for this long is dropped
 
 
 class ThreadingHTTPServer(ThreadingMixIn, HTTPServer):
@@ -38,47 +56,189 @@ class ThreadingHTTPServer(ThreadingMixIn, HTTPServer):
     daemon_threads = True
 
 
+class BroadcastHub:
+    """Fans a channel's encoded audio out to any number of HTTP listeners.
+
+    The encoder's ADTS output is appended to a ring buffer from the event loop;
+    every listener (on its own HTTP server thread) keeps its own read cursor
+    into it, so listeners never take data from each other and a slow one is
+    dropped instead of holding up the rest.
+    """
+
+    def __init__(self, name: str, size: int = HUB_BUFFER_SIZE) -> None:
+        self.name = name
+        self._size = size
+        self._buf = bytearray(size)
+        self._view = memoryview(self._buf)
+        self._head = 0  # Total bytes ever written
+        self._cond = threading.Condition()
+        self._clients: Dict[int, Dict[str, object]] = {}
+        self._next_client = 0
+        self._dropped_clients = 0
+        self._closed = False
+        self._loop: Optional[asyncio.AbstractEventLoop] = None
+        self.format = "adts"  # Or "mp3" while a direct encoder passes the station through
+        self.on_output = None  # Called once when the next encoded audio arrives (the same packets go to RTMP)
+
+    def pump(self, fd: int) -> None:
+        """Copy an encoder's stdout into the ring whenever the event loop reports it readable"""
+        self._loop = asyncio.get_running_loop()
+        self._loop.add_reader(fd, self._on_readable, fd)
+
+    def stop_pump(self, fd: Optional[int]) -> None:
+        if self._loop is not None and fd is not None:
+            self._loop.remove_reader(fd)
+
+    def _on_readable(self, fd: int) -> None:
+        size = self._size
+        start = self._head % size
+        try:
+            # Listeners only read behind head, so the region ahead of it is free to overwrite
+            got = os.readv(fd, [self._view[start:min(size, start + HUB_READ_SIZE)]])
+        except BlockingIOError:
+            return
+        except OSError as e:
+            logger.error(f"[{self.name}] Error reading encoder output: {e}")
+            got = 0
+        if not got:
+            self._loop.remove_reader(fd)
+            return
+        with self._cond:
+            self._head += got
+            self._cond.notify_all()
+        if self.on_output is not None:
+            on_output, self.on_output = self.on_output, None
+            on_output()
+
+    def close(self) -> None:
+        with self._cond:
+            self._closed = True
+            self._cond.notify_all()
+
+    def reopen(self) -> None:
+        with self._cond:
+            self._closed = False
+
+    def _sync_point(self, pos: int) -> int:
+        """First ADTS (or MP3) frame header at or after pos (so new listeners start on a frame), else pos"""
+        size = self._size
+        end = self._head
+        mask, sync = (0xE6, 0xE2) if self.format == "mp3" else (0xF6, 0xF0)  # MP3 has a nonzero layer
+        for p in range(pos, min(end - 1, pos + 8192)):
+            if self._buf[p % size] == 0xFF and self._buf[(p + 1) % size] & mask == sync:
+                return p
+        return pos
+
+    def listen(self, write, address: str) -> None:
+        """Stream to one listener until it disconnects, falls too far behind or the hub closes"""
+        size = self._size
+        with self._cond:
+            client_id = self._next_client
+            self._next_client += 1
+            cursor = self._sync_point(max(self._head - HUB_READ_SIZE * 4, 0))
+            client = {"address": address, "connected": time.time(), "sent": 0, "lag": 0}
+            self._clients[client_id] = client
+        logger.info(f"[{self.name}] Listener {address} connected ({len(self._clients)} total)")
+        reason = "disconnected"
+        try:
+            while True:
+                with self._cond:
+                    while self._head == cursor and not self._closed:
+                        self._cond.wait(5)
+                    if self._closed:
+                        reason = "stream stopped"
+                        break
+                    head = self._head
+                lag = head - cursor
+                client["lag"] = lag
+                if lag > HUB_MAX_LAG:
+                    reason = f"too slow ({lag} bytes behind)"
+                    self._dropped_clients += 1
+                    break
+                start = cursor % size
+                n = min(lag, size - start)
+                write(self._view[start:start + n])
+                if self._head - cursor > size - HUB_READ_SIZE:
+                    # The producer lapped us while we were sending: what went out is corrupt. Its read in
+                    # progress may already have filled the HUB_READ_SIZE bytes past head, hence the margin
+                    reason = "too slow (overrun)"
+                    self._dropped_clients += 1
+                    break
+                cursor += n
+                client["sent"] += n
+        except socket.timeout:  # Not a TimeoutError before Python 3.10
+            reason = "too slow (send timed out)"
+            self._dropped_clients += 1
+        except (OSError, ValueError):
+            pass
+        finally:
+            with self._cond:
+                self._clients.pop(client_id, None)
+            logger.info(f"[{self.name}] Listener {address} {reason} ({len(self._clients)} left)")
+
+    def stats(self) -> Dict[str, object]:
+        now = time.time()
+        clients = list(self._clients.values())
+        return {
+            "listeners": len(clients),
+            "dropped_listeners": self._dropped_clients,
+            "bytes_buffered": min(self._head, self._size),
+            "clients": [
+                {
+                    "address": c["address"],
+                    "connected_s": round(now - c["connected"]),
+                    "bytes_sent": c["sent"],
+                    "lag_bytes": c["lag"],
+                }
+                for c in clients
+            ],
+        }
+
+
 class StreamHTTPHandler(BaseHTTPRequestHandler):
-    """HTTP Handler that serves stream data from queue"""
+    """Serves a channel's audio as chunked ADTS AAC (MP3 when passed through): /stream or /stream/<channel id>"""
+    
+    protocol_version = "HTTP/1.1"  # Needed for chunked transfer encoding
     
     def do_GET(self):
-        if self.path == '/stream':
-            self.send_response(200)
-            self.send_header('Content-Type', 'audio/mpeg')  # MP3 format
-            self.send_header('Cache-Control', 'no-cache')
-            self.send_header('Connection', 'keep-alive')
-            self.send_header('Transfer-Encoding', 'chunked')
-            self.end_headers()
-            
-            logger.info("Client connected to stream endpoint")
-            try:
-                while True:
-                    try:
-                        # Get data from queue with timeout
-                        chunk = stream_queue.get(timeout=2)
-                        if chunk is None:  # Sentinel value to stop
-                            break
-                        if chunk:  # Only send non-empty chunks
-                            self.wfile.write(chunk)
-                            self.wfile.flush()
-                    except queue.Empty:
-                        # Keep connection alive - FFmpeg will wait for data
-                        # Send a small keep-alive chunk if needed
-                        try:
-                            self.wfile.write(b'')
-                            self.wfile.flush()
-                        except:
-                            break
-                        time.sleep(0.1)
-                        continue
-                    except (BrokenPipeError, ConnectionResetError):
-                        logger.info("Client disconnected")
-                        break
-            except Exception as e:
-                logger.error(f"Error serving stream: {e}")
+        path = self.path.split('?', 1)[0].rstrip('/')
+        if path == '/stream':
+            channel_id = DEFAULT_CHANNEL
+        elif path.startswith('/stream/'):
+            channel_id = path[len('/stream/'):]
         else:
-            self.send_response(404)
-            self.end_headers()
+            self._not_found()
+            return
+        channel = StreamManager().get_channel(channel_id) if CHANNEL_ID_RE.match(channel_id) else None
+        if channel is None:
+            self._not_found()
+            return
+        
+        self.send_response(200)
+        self.send_header('Content-Type', 'audio/mpeg' if channel.hub.format == 'mp3' else 'audio/aac')
+        self.send_header('Cache-Control', 'no-cache')
+        self.send_header('Connection', 'close')
+        self.send_header('Transfer-Encoding', 'chunked')
+        self.end_headers()
+        
+        def write_chunk(data):
+            self.wfile.write(b'%x\r\n' % len(data))
+            self.wfile.write(data)
+            self.wfile.write(b'\r\n')
+            self.wfile.flush()
+        
+        self.connection.settimeout(HUB_SEND_TIMEOUT)
+        channel.hub.listen(write_chunk, self.client_address[0])
+        try:
+            self.wfile.write(b'0\r\n\r\n')
+        except OSError:
+            pass
+        self.close_connection = True
+    
+    def _not_found(self):
+        self.send_response(404)
+        self.send_header('Content-Length', '0')
+        self.end_headers()
     
     def log_message(self, format, *args):
         # Suppress default logging
@@ -137,423 +297,4203 @@ def parse_m3u(content: str) -> List[Dict[str, str]]:
     return stations
 
 
-class _Singleton(type):
-    _instances: Dict[type, object] = {}
-    _lock = threading.Lock()
-
-    def __call__(cls, *args, **kwargs):
-        with cls._lock:
-            if cls not in cls._instances:
-                cls._instances[cls] = super(_Singleton, cls).__call__(*args, **kwargs)
-            return cls._instances[cls]
-
+class StationCatalog:
+    """Station list parsed from the M3U file once and reloaded only when the file changes"""
 
-class StreamManager(metaclass=_Singleton):
-    def __init__(self) -> None:
-        self._main_process: Optional[subprocess.Popen] = None  # Main FFmpeg that streams to RTMP
-        self._feed_process: Optional[subprocess.Popen] = None  # Feed process that reads from source
+    def __init__(self, path: Path) -> None:
+        self._path = path
         self._lock = threading.Lock()
-        self._current_station: Optional[Dict[str, str]] = None
-        self._rtmp_url: Optional[str] = None
-        self._http_port = 8888
-
-    def _build_rtmp_url(self, server: str, key: str) -> str:
-        server = server.strip()
-        key = key.strip()
-        if not server:
-            return key
-        if server.endswith('/'):
-            return f"{server}{key}"
-        return f"{server}/{key}"
+        self._stamp: Optional[tuple] = None  # (mtime_ns, size) of the loaded file
+        self._stations: List[Dict] = []
+        self._by_id: Dict[int, Dict] = {}
+        self._by_url: Dict[str, Dict] = {}
+        self._body: bytes = b"[]"
+        self._etag: str = '""'
 
-    def _start_http_server(self):
-        """Start HTTP server if not already running"""
-        global http_server, http_server_thread
-        
-        if http_server is not None:
+    def _refresh(self) -> None:
+        """Re-parse the playlist if its mtime/size changed since the last load"""
+        st = self._path.stat()
+        stamp = (st.st_mtime_ns, st.st_size)
+        if stamp == self._stamp:
             return
-        
+        with self._lock:
+            if stamp == self._stamp:
+                return
+            content = self._path.read_text(encoding="utf-8")
+            stations = parse_m3u(content)
+            body = json.dumps(stations, ensure_ascii=False, separators=(",", ":")).encode("utf-8")
+            self._stations = stations
+            self._by_id = {s["id"]: s for s in stations}
+            self._by_url = {s["url"]: s for s in stations}
+            self._body = body
+            self._etag = '"%s"' % hashlib.sha1(body).hexdigest()[:20]
+            self._stamp = stamp
+            logger.info(f"Loaded {len(stations)} stations from {self._path.name}")
+
+    def stations(self) -> List[Dict]:
+        self._refresh()
+        return self._stations
+
+    def json_body(self) -> tuple:
+        """Return the pre-serialized station list and its ETag"""
+        self._refresh()
+        return self._body, self._etag
+
+    def get_by_id(self, station_id: int) -> Optional[Dict]:
+        self._refresh()
+        return self._by_id.get(station_id)
+
+    def get_by_url(self, url: str) -> Optional[Dict]:
+        self._refresh()
+        return self._by_url.get(url)
+
+
+def etag_matches(if_none_match: Optional[str], etag: str) -> bool:
+    """Check an If-None-Match header value against an ETag"""
+    if not if_none_match:
+        return False
+    if if_none_match.strip() == "*":
+        return True
+    for tag in if_none_match.split(","):
+        tag = tag.strip()
+        if tag.startswith("W/"):
+            tag = tag[2:]
+        if tag == etag:
+            return True
+    return False
+
+
+station_catalog = StationCatalog(M3U_PATH)
+
+
+PROBE_INTERVAL = float(os.environ.get("PROBE_INTERVAL", 300.0))  # Seconds between sweeps of the catalog; 0 disables
+PROBE_TTL = float(os.environ.get("PROBE_TTL", 900.0))  # How long a probe result is trusted
+PROBE_CONCURRENCY = int(os.environ.get("PROBE_CONCURRENCY", 8))
+PROBE_TIMEOUT = float(os.environ.get("PROBE_TIMEOUT", 5.0))
+PROBE_SAMPLE_BYTES = 4096  # Audio read from each station to check it really streams
+PROBE_MAX_REDIRECTS = 5
+
+# kbps by bitrate index, for (MPEG-1, layer) and (MPEG-2/2.5, layer)
+_MP3_BITRATES = {
+    (1, 1): (0, 32, 64, 96, 128, 160, 192, 224, 256, 288, 320, 352, 384, 416, 448),
+    (1, 2): (0, 32, 48, 56, 64, 80, 96, 112, 128, 160, 192, 224, 256, 320, 384),
+    (1, 3): (0, 32, 40, 48, 56, 64, 80, 96, 112, 128, 160, 192, 224, 256, 320),
+    (2, 1): (0, 32, 48, 56, 64, 80, 96, 112, 128, 144, 160, 176, 192, 224, 256),
+    (2, 2): (0, 8, 16, 24, 32, 40, 48, 56, 64, 80, 96, 112, 128, 144, 160),
+    (2, 3): (0, 8, 16, 24, 32, 40, 48, 56, 64, 80, 96, 112, 128, 144, 160),
+}
+_MP3_SAMPLE_RATES = {3: (44100, 48000, 32000), 2: (22050, 24000, 16000), 0: (11025, 12000, 8000)}
+
+
+def _mp3_frame(data: bytes, i: int) -> Optional[tuple]:
+    """(bitrate kbps, frame length) of the MPEG audio frame header at data[i], or None"""
+    if i + 4 > len(data) or data[i] != 0xFF or data[i + 1] & 0xE0 != 0xE0:
+        return None
+    version = (data[i + 1] >> 3) & 3  # 3 = MPEG-1, 2 = MPEG-2, 0 = MPEG-2.5
+    layer = 4 - ((data[i + 1] >> 1) & 3)
+    bitrate_index = data[i + 2] >> 4
+    rate_index = (data[i + 2] >> 2) & 3
+    if version == 1 or layer == 4 or bitrate_index in (0, 15) or rate_index == 3:
+        return None
+    kbps = _MP3_BITRATES[(1 if version == 3 else 2, layer)][bitrate_index]
+    rate = _MP3_SAMPLE_RATES[version][rate_index]
+    padding = (data[i + 2] >> 1) & 1
+    if layer == 1:
+        length = (12000 * kbps // rate + padding) * 4
+    else:
+        length = (144000 if layer == 2 or version == 3 else 72000) * kbps // rate + padding
+    return kbps, length
+
+
+def mp3_bitrate(data: bytes) -> Optional[int]:
+    """Bitrate of the first MPEG audio frame in data that is followed by another one"""
+    start = 0
+    if data[:3] == b"ID3" and len(data) >= 10:
+        start = 10 + ((data[6] & 0x7F) << 21 | (data[7] & 0x7F) << 14 | (data[8] & 0x7F) << 7 | (data[9] & 0x7F))
+    for i in range(start, len(data) - 4):
+        frame = _mp3_frame(data, i)
+        if frame is not None and _mp3_frame(data, i + frame[1]) is not None:
+            return frame[0]
+    return None
+
+
+class SourceProber:
+    """Checks whether stations are up, without FFmpeg.
+
+    A probe follows the station's redirects, reads the response headers and
+    the first few KB of audio, and records reachability, time to first byte,
+    content type and bitrate. Results are cached for PROBE_TTL. At most
+    PROBE_CONCURRENCY probes run at once; connections that end cleanly (the
+    redirect hops, which for the catalog all go through the same host) are
+    kept alive and reused, so a sweep costs one TLS handshake per connection
+    rather than per station. Stream connections are closed after the sample.
+    """
+
+    def __init__(self, concurrency: int = PROBE_CONCURRENCY, timeout: float = PROBE_TIMEOUT,
+                 ttl: float = PROBE_TTL) -> None:
+        self.timeout = timeout
+        self.ttl = ttl
+        self._concurrency = concurrency
+        self._semaphore: Optional[asyncio.Semaphore] = None  # Made on first use, on the running loop
+        self._idle: Dict[tuple, List[tuple]] = {}  # (scheme, host, port) -> idle keep-alive (reader, writer)
+        self._ssl = None
+        self._results: Dict[str, tuple] = {}  # url -> (monotonic time, result)
+        self.version = 0  # Bumped whenever the results change
+
+    def result(self, url: str) -> Optional[Dict[str, object]]:
+        """The cached result for url, or None if it was never probed or the result is too old"""
+        entry = self._results.get(url)
+        if entry is None or time.monotonic() - entry[0] > self.ttl:
+            return None
+        return entry[1]
+
+    def expire(self) -> None:
+        now = time.monotonic()
+        stale = [url for url, (checked, _) in self._results.items() if now - checked > self.ttl]
+        for url in stale:
+            del self._results[url]
+        if stale:
+            self.version += 1
+
+    async def check(self, url: str) -> Dict[str, object]:
+        """Probe url now and cache the result"""
+        if self._semaphore is None:
+            self._semaphore = asyncio.Semaphore(self._concurrency)
+        async with self._semaphore:
+            result = await self.probe(url)
+        self._results[url] = (time.monotonic(), result)
+        self.version += 1
+        return result
+
+    async def check_all(self, urls: List[str]) -> List[Dict[str, object]]:
+        return await asyncio.gather(*(self.check(url) for url in urls))
+
+    async def usable(self, url: str) -> bool:
+        """False only if url is known to be down and still is when probed again"""
+        cached = self.result(url)
+        if cached is None or cached["ok"]:
+            return True
+        return (await self.check(url))["ok"]
+
+    async def run(self, urls) -> None:
+        """Probe every station returned by urls() each PROBE_INTERVAL"""
+        while True:
+            started = time.monotonic()
+            try:
+                results = await self.check_all(urls())
+                self.expire()
+                up = sum(1 for r in results if r["ok"])
+                logger.info(f"Probed {len(results)} stations in {time.monotonic() - started:.1f}s: {up} reachable")
+            except Exception as e:
+                logger.error(f"Station probe failed: {e}")
+            await asyncio.sleep(PROBE_INTERVAL)
+
+    def close(self) -> None:
+        for connections in self._idle.values():
+            for _, writer in connections:
+                writer.close()
+        self._idle.clear()
+
+    async def probe(self, url: str) -> Dict[str, object]:
+        started = time.monotonic()
+        result: Dict[str, object] = {"ok": False, "status": None, "content_type": None, "bitrate_kbps": None,
+                                     "ttfb_ms": None, "redirects": 0, "error": None, "checked_at": time.time()}
         try:
-            http_server = ThreadingHTTPServer(('127.0.0.1', self._http_port), StreamHTTPHandler)
-            http_server_thread = threading.Thread(target=http_server.serve_forever, daemon=True)
-            http_server_thread.start()
-            logger.info(f"HTTP Server started on port {self._http_port}")
-        except Exception as e:
-            logger.error(f"Failed to start HTTP server: {e}")
+            await asyncio.wait_for(self._probe(url, started, result), self.timeout)
+        except asyncio.TimeoutError:
+            result["error"] = f"no audio within {self.timeout:g}s"
+        except (OSError, ValueError, asyncio.IncompleteReadError, asyncio.LimitOverrunError) as e:
+            result["error"] = str(e) or type(e).__name__
+        return result
 
-    def _start_main_stream(self, rtmp_url: str) -> bool:
-        """Start main FFmpeg process that reads from stdin pipe and streams to RTMP"""
-        if self._main_process and self._main_process.poll() is None:
-            # Already running, just update RTMP URL if different
-            if self._rtmp_url != rtmp_url:
-                logger.warning("RTMP URL changed but main stream is running. Restarting...")
-                self.stop_stream()
+    async def _probe(self, url: str, started: float, result: Dict[str, object]) -> None:
+        for _ in range(PROBE_MAX_REDIRECTS + 1):
+            status, headers, reader, writer, key = await self._request(url)
+            result["status"] = status
+            if 300 <= status < 400 and "location" in headers:
+                await self._finish(reader, writer, key, headers)
+                url = urljoin(url, headers["location"])
+                result["redirects"] += 1
+                continue
+            try:
+                content_type = headers.get("content-type", "").split(";")[0].strip().lower()
+                result["content_type"] = content_type or None
+                if status != 200:
+                    result["error"] = f"HTTP {status}"
+                    return
+                if content_type.startswith(("text/", "application/json")):
+                    result["error"] = f"not audio ({content_type})"
+                    return
+                sample = b""
+                while len(sample) < PROBE_SAMPLE_BYTES:
+                    data = await reader.read(PROBE_SAMPLE_BYTES - len(sample))
+                    if not data:
+                        break
+                    if not sample:
+                        result["ttfb_ms"] = round((time.monotonic() - started) * 1000, 1)
+                    sample += data
+                if not sample:
+                    result["error"] = "no data"
+                    return
+                icy_br = headers.get("icy-br", "").split(",")[0]
+                result["bitrate_kbps"] = int(icy_br) if icy_br.isdigit() else mp3_bitrate(sample)
+                result["ok"] = True
+                return
+            finally:
+                # The body of a live stream never ends, so this connection cannot be reused
+                writer.close()
+        result["error"] = "too many redirects"
+
+    async def _request(self, url: str) -> tuple:
+        """Send a GET and read the response head, reusing an idle connection to the host if there is one"""
+        parts = urlsplit(url)
+        if parts.scheme not in ("http", "https") or not parts.hostname:
+            raise ValueError(f"unsupported URL: {url}")
+        port = parts.port or (443 if parts.scheme == "https" else 80)
+        key = (parts.scheme, parts.hostname, port)
+        path = (parts.path or "/") + (f"?{parts.query}" if parts.query else "")
+        request = (f"GET {path} HTTP/1.1\r\nHost: {parts.netloc}\r\nUser-Agent: QuranStream-Prober\r\n"
+                   f"Accept: */*\r\nIcy-MetaData: 0\r\nConnection: keep-alive\r\n\r\n").encode("latin-1")
+        idle = self._idle.get(key, [])
+        while True:
+            reused = bool(idle)
+            if reused:
+                reader, writer = idle.pop()
             else:
-                return True
-        
-        # Main FFmpeg reads from stdin pipe and streams to RTMP
-        cmd = [
-            "ffmpeg",
-            "-loglevel", "error",
-            "-nostats",
-            "-f", "s16le",  # Input format: raw PCM
-            "-ar", "44100",  # Sample rate
-            "-ac", "2",  # Channels
-            "-i", "pipe:0",  # Read from stdin
-            "-vn",
-            "-c:a", "aac",
-            "-b:a", "128k",
-            "-flags", "+low_delay",
-            "-fflags", "nobuffer",
-            "-f", "flv",
-            rtmp_url,
-        ]
-        
+                if parts.scheme == "https" and self._ssl is None:
+                    self._ssl = ssl.create_default_context()
+                reader, writer = await asyncio.open_connection(
+                    parts.hostname, port, ssl=self._ssl if parts.scheme == "https" else None
+                )
+            try:
+                writer.write(request)
+                await writer.drain()
+                head = await reader.readuntil(b"\r\n\r\n")
+                break
+            except (OSError, asyncio.IncompleteReadError):
+                writer.close()
+                if not reused:
+                    raise
+                # The server closed the idle connection meanwhile; try the next one
+            except BaseException:
+                writer.close()
+                raise
+        lines = head.decode("latin-1").split("\r\n")
+        status_line = lines[0].split(None, 2)  # "HTTP/1.1 200 OK", or "ICY 200 OK" from SHOUTcast
+        if len(status_line) < 2 or not status_line[1].isdigit():
+            writer.close()
+            raise ValueError(f"bad status line: {lines[0][:60]!r}")
+        headers = {}
+        for line in lines[1:]:
+            name, sep, value = line.partition(":")
+            if sep:
+                headers[name.strip().lower()] = value.strip()
+        headers[":version"] = status_line[0]
+        return int(status_line[1]), headers, reader, writer, key
+
+    async def _finish(self, reader, writer, key: tuple, headers: Dict[str, str]) -> None:
+        """Skip a redirect's body and park the connection for reuse if the server keeps it open"""
+        length = headers.get("content-length", "")
+        if (not length.isdigit() or headers[":version"] != "HTTP/1.1"
+                or headers.get("connection", "").lower() == "close"):
+            writer.close()
+            return
         try:
-            self._main_process = subprocess.Popen(
-                cmd,
-                stdout=subprocess.PIPE,
-                stderr=subprocess.PIPE,
-                stdin=subprocess.PIPE,  # Accept input from stdin
-                creationflags=subprocess.CREATE_NO_WINDOW if os.name == 'nt' else 0,
-            )
-            self._rtmp_url = rtmp_url
-            logger.info(f"Main FFmpeg process started with PID: {self._main_process.pid}")
-            
-            # Monitor main process and log errors
-            def monitor_main():
-                try:
-                    # Read stderr to see errors
-                    error_lines = []
-                    def read_stderr():
-                        try:
-                            for line in self._main_process.stderr:
-                                line_str = line.decode('utf-8', errors='ignore').strip()
-                                if line_str:
-                                    error_lines.append(line_str)
-                                    if 'error' in line_str.lower() or 'failed' in line_str.lower():
-                                        logger.error(f"Main FFmpeg: {line_str}")
-                        except Exception as e:
-                            logger.error(f"Error reading main stderr: {e}")
-                    
-                    stderr_thread = threading.Thread(target=read_stderr, daemon=True)
-                    stderr_thread.start()
-                    
-                    exit_code = self._main_process.wait()
-                    if exit_code != 0:
-                        logger.error(f"Main FFmpeg process exited with code {exit_code}")
-                        if error_lines:
-                            logger.error(f"Last errors: {error_lines[-5:]}")
-                    else:
-                        logger.warning("Main FFmpeg process exited normally")
-                except Exception as e:
-                    logger.error(f"Error monitoring main process: {e}")
-            
-            threading.Thread(target=monitor_main, daemon=True).start()
-            return True
-        except FileNotFoundError:
-            logger.error("FFmpeg not found in PATH")
-            return False
-        except Exception as e:
-            logger.error(f"Failed to start main FFmpeg: {e}")
-            return False
+            if int(length):
+                await reader.readexactly(int(length))
+        except BaseException:
+            writer.close()
+            raise
+        idle = self._idle.setdefault(key, [])
+        if len(idle) < self._concurrency:
+            idle.append((reader, writer))
+        else:
+            writer.close()
 
-    def _feed_stream(self, stream_url: str, station_name: Optional[str] = None):
-        """Feed stream data to main FFmpeg stdin via queue"""
-        if not self._main_process or self._main_process.poll() is not None:
-            logger.error("Main process not running, cannot feed stream")
-            return None
-        
-        cmd = [
-            "ffmpeg",
-            "-loglevel", "error",
-            "-nostats",
-            "-re",
-            "-reconnect", "1",
-            "-reconnect_at_eof", "1",
-            "-reconnect_streamed", "1",
-            "-reconnect_delay_max", "2",
-            "-i", stream_url,
-            "-vn",
-            "-c:a", "pcm_s16le",  # Raw PCM 16-bit little-endian
-            "-ar", "44100",
-            "-ac", "2",
-            "-f", "s16le",  # Raw PCM format
-            "-",  # Output to stdout
-        ]
-        
+
+source_prober = SourceProber()
+
+
+class Histogram:
+    """A Prometheus histogram with one series per combination of label values"""
+
+    def __init__(self, name: str, help_text: str, buckets: tuple, labelnames: tuple) -> None:
+        self.name = name
+        self.help = help_text
+        self.buckets = tuple(sorted(buckets))
+        self.labelnames = labelnames
+        self._series: Dict[tuple, list] = {}  # label values -> [count per bucket (+Inf last), sum]
+
+    def observe(self, value: float, *labels: str) -> None:
+        series = self._series.get(labels)
+        if series is None:
+            series = self._series[labels] = [[0] * (len(self.buckets) + 1), 0.0]
+        series[0][bisect.bisect_left(self.buckets, value)] += 1
+        series[1] += value
+
+    def render(self, lines: List[str]) -> None:
+        lines.append(f"# HELP {self.name} {self.help}")
+        lines.append(f"# TYPE {self.name} histogram")
+        bounds = [repr(b) for b in self.buckets] + ["+Inf"]
+        for labels, (counts, total) in list(self._series.items()):
+            base = dict(zip(self.labelnames, labels))
+            cumulative = 0
+            for bound, n in zip(bounds, counts):
+                cumulative += n
+                lines.append(f"{self.name}_bucket{_prom_labels({**base, 'le': bound})} {cumulative}")
+            lines.append(f"{self.name}_sum{_prom_labels(base)} {total}")
+            lines.append(f"{self.name}_count{_prom_labels(base)} {cumulative}")
+
+
+def _prom_labels(labels: Dict[str, object]) -> str:
+    if not labels:
+        return ""
+    parts = []
+    for key, value in labels.items():
+        value = str(value).replace("\\", "\\\\").replace("\"", "\\\"").replace("\n", "\\n")
+        parts.append(f'{key}="{value}"')
+    return "{" + ",".join(parts) + "}"
+
+
+RELAY_WRITE_SECONDS = Histogram(
+    "quranstream_relay_write_seconds", "Time to write one relay tick to every encoder of a channel",
+    (0.0001, 0.00025, 0.0005, 0.001, 0.0025, 0.005, 0.01, 0.025, 0.05, 0.1, 0.25), ("channel",),
+)
+SWITCH_SECONDS = Histogram(
+    "quranstream_switch_seconds", "Time from a start or station switch until the new feed's audio reached the relay",
+    (0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1.0, 2.5, 5.0, 10.0), ("channel", "mode"),
+)
+API_REQUEST_SECONDS = Histogram(
+    "quranstream_api_request_seconds", "Control API request latency",
+    (0.001, 0.0025, 0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1.0, 2.5, 5.0, 10.0), ("method", "handler", "code"),
+)
+
+try:
+    _CLK_TCK = os.sysconf("SC_CLK_TCK")
+    _PAGE_SIZE = os.sysconf("SC_PAGE_SIZE")
+except (AttributeError, ValueError, OSError):
+    _CLK_TCK = _PAGE_SIZE = 0
+
+
+def process_usage(pid: int) -> Optional[Dict[str, float]]:
+    """CPU seconds, RSS bytes, thread count and start time (clock ticks since boot) of a process, from /proc (Linux only)"""
+    if not _CLK_TCK:
+        return None
+    try:
+        with open(f"/proc/{pid}/stat") as f:
+            fields = f.read().rsplit(")", 1)[1].split()
+    except OSError:
+        return None
+    return {
+        "cpu": (int(fields[11]) + int(fields[12])) / _CLK_TCK,
+        "rss": int(fields[21]) * _PAGE_SIZE,
+        "threads": int(fields[17]),
+        "start_ticks": int(fields[19]),
+    }
+
+
+# PCM relay between feed and main FFmpeg (s16le, 44100 Hz, stereo)
+PCM_SAMPLE_RATE = 44100
+PCM_FRAME_BYTES = 4  # One stereo s16le sample
+PCM_BYTES_PER_SEC = PCM_SAMPLE_RATE * PCM_FRAME_BYTES
+RELAY_BUFFER_SIZE = int(os.environ.get("RELAY_BUFFER_SIZE", 256 * 1024))  # ~1.5 s of audio
+RELAY_BATCH_SIZE = int(os.environ.get("RELAY_BATCH_SIZE", 32 * 1024))  # ~186 ms per write
+RELAY_STALL_SECONDS = 0.1  # A write tick taking longer than this (the loop was held up) counts as a stall
+RELAY_MAX_LATENCY = 1.0  # Buffered audio beyond this is dropped to keep the channel near live
+RELAY_FILL = os.environ.get("RELAY_FILL", "silence")  # What to send on underrun: "silence" or "noise"
+RELAY_SPLICE = os.environ.get("RELAY_SPLICE", "0") == "1" and hasattr(os, "splice")
+# Failover to a channel's fallback stations when its source stalls
+FAILOVER_STALL_MS = int(os.environ.get("FAILOVER_STALL_MS", 3000))  # No audio from the feed for this long
+FAILOVER_SILENCE_S = float(os.environ.get("FAILOVER_SILENCE_S", 15.0))  # Nothing but silence for this long
+FAILOVER_SILENCE_LEVEL = int(os.environ.get("FAILOVER_SILENCE_LEVEL", 32))  # Peak sample counted as silence (~-60 dBFS)
+FAILOVER_TIMEOUT = float(os.environ.get("FAILOVER_TIMEOUT", 5.0))  # Per candidate: time to deliver audio
+FAILOVER_RECHECK = float(os.environ.get("FAILOVER_RECHECK", 30.0))  # Seconds between checks of a down primary
+FAILBACK_BACKOFF_MAX = float(os.environ.get("FAILBACK_BACKOFF_MAX", 600.0))  # Longest wait after failed failbacks
+FAILOVER_FIRST_AUDIO_TIMEOUT = 10.0  # A freshly started feed gets this long before it counts as stalled
+
+
+def crossfade_pcm(old: bytes, new: memoryview, done: int, frames: int) -> None:
+    """Linear crossfade of old (fading out) into new (fading in), in place in new (s16le stereo).
+
+    The two are the same length and sit done frames into a fade that is
+    frames long, so a fade can be applied a tick at a time. Frame i of
+    the whole fade is weighted i / frames towards new.
+    """
+    np = load_numpy()
+    a = np.frombuffer(old, dtype="<i2").reshape(-1, 2)
+    b = np.frombuffer(new, dtype="<i2").reshape(-1, 2)
+    w = (np.arange(done, done + len(b), dtype=np.float32) / frames)[:, None]
+    mixed = np.rint(a * (1.0 - w) + b * w)
+    b[:] = np.clip(mixed, -32768, 32767).astype("<i2")
+
+
+def pcm_peak(data: memoryview, stride: int = 7) -> int:
+    """Peak magnitude of s16le PCM, sampled every stride samples (odd, so both channels are seen)"""
+    samples = data.cast("h")[::stride]
+    if sys.byteorder == "big":
+        samples = array.array("h", samples.tobytes())
+        samples.byteswap()
+    if not len(samples):
+        return 0
+    return max(max(samples), -min(samples))
+
+
+_FILLER_CACHE: Dict[int, memoryview] = {}
+
+
+def _filler_pcm(nbytes: int) -> memoryview:
+    """Reusable block of silence or low-level comfort noise"""
+    nbytes -= nbytes % PCM_FRAME_BYTES
+    block = _FILLER_CACHE.get(nbytes)
+    if block is None:
+        if RELAY_FILL == "noise":
+            rng = random.Random(0)
+            samples = array.array("h", (rng.randint(-24, 24) for _ in range(nbytes // 2)))
+            if sys.byteorder == "big":
+                samples.byteswap()
+            block = memoryview(samples.tobytes())
+        else:
+            block = memoryview(bytes(nbytes))
+        _FILLER_CACHE[nbytes] = block
+    return block
+
+
+np = None  # NumPy once load_numpy() imported it; only crossfades and loudness normalization need it
+
+
+def load_numpy():
+    """Import NumPy on first use, so it is not loaded until a crossfade or LOUDNESS_TARGET needs it; None if it is not installed"""
+    global np
+    if np is None:
         try:
-            feed_proc = subprocess.Popen(
-                cmd,
-                stdout=subprocess.PIPE,  # Read from stdout
-                stderr=subprocess.PIPE,
-                stdin=subprocess.DEVNULL,
-                creationflags=subprocess.CREATE_NO_WINDOW if os.name == 'nt' else 0,
-            )
-            
-            logger.info(f"Feed process started for {station_name} with PID: {feed_proc.pid}")
-            
-            # Write from feed to main process stdin in a separate thread
-            def write_to_main():
-                try:
-                    chunk_size = 8192
-                    while True:
-                        chunk = feed_proc.stdout.read(chunk_size)
-                        if not chunk:
-                            break
-                        try:
-                            if self._main_process and self._main_process.poll() is None and self._main_process.stdin:
-                                self._main_process.stdin.write(chunk)
-                                self._main_process.stdin.flush()
-                            else:
-                                logger.warning("Main process stdin not available")
-                                break
-                        except (BrokenPipeError, OSError) as e:
-                            logger.error(f"Error writing to main stdin: {e}")
-                            break
-                except Exception as e:
-                    logger.error(f"Error in write_to_main: {e}")
-                finally:
-                    logger.info(f"Feed write thread ended for {station_name}")
-            
-            write_thread = threading.Thread(target=write_to_main, daemon=True)
-            write_thread.start()
-            
-            # Monitor feed process
-            def monitor_feed():
-                try:
-                    error_lines = []
-                    def read_stderr():
-                        try:
-                            for line in feed_proc.stderr:
-                                line_str = line.decode('utf-8', errors='ignore').strip()
-                                if line_str:
-                                    error_lines.append(line_str)
-                                    if 'error' in line_str.lower() or 'failed' in line_str.lower():
-                                        logger.error(f"Feed FFmpeg error: {line_str}")
-                        except Exception as e:
-                            logger.error(f"Error reading feed stderr: {e}")
-                    
-                    stderr_thread = threading.Thread(target=read_stderr, daemon=True)
-                    stderr_thread.start()
-                    
-                    exit_code = feed_proc.wait()
-                    if exit_code != 0:
-                        logger.warning(f"Feed process exited with code {exit_code}")
-                        if error_lines:
-                            logger.error(f"Last errors: {error_lines[-3:]}")
-                    else:
-                        logger.info(f"Feed process ended normally for {station_name}")
-                except Exception as e:
-                    logger.error(f"Error monitoring feed process: {e}")
-            
-            threading.Thread(target=monitor_feed, daemon=True).start()
-            return feed_proc
-        except Exception as e:
-            logger.error(f"Failed to start feed process: {e}")
+            import numpy
+        except ImportError:
             return None
+        np = numpy
+    return np
 
-    def start_stream(self, stream_url: str, rtmp_server: str, stream_key: str, station_name: Optional[str] = None) -> Dict[str, str]:
-        with self._lock:
-            logger.info(f"Starting stream - Station: {station_name}, URL: {stream_url}")
-            logger.info(f"RTMP Server: {rtmp_server}, Key: {stream_key[:10]}...")
-            
-            rtmp_url = self._build_rtmp_url(rtmp_server, stream_key)
-            logger.info(f"Full RTMP URL: {rtmp_url[:50]}...")
-            
-            # Clean up any dead processes first
-            if self._feed_process and self._feed_process.poll() is not None:
-                self._feed_process = None
-            if self._main_process and self._main_process.poll() is not None:
-                self._main_process = None
-            
-            # Stop ALL old processes first (both feed and main if RTMP URL changed)
-            if self._feed_process and self._feed_process.poll() is None:
-                logger.info(f"Stopping old feed process (PID: {self._feed_process.pid})")
-                try:
-                    self._feed_process.kill()  # Force kill for faster stop
-                    try:
-                        self._feed_process.wait(timeout=1)
-                    except:
-                        pass
-                except Exception as e:
-                    logger.error(f"Error stopping feed: {e}")
-                self._feed_process = None
-            
-            # If RTMP URL changed, restart main process too
-            if self._main_process and self._main_process.poll() is None:
-                if self._rtmp_url != rtmp_url:
-                    logger.info(f"RTMP URL changed, restarting main process (PID: {self._main_process.pid})")
-                    try:
-                        self._main_process.kill()
-                        try:
-                            self._main_process.wait(timeout=1)
-                        except:
-                            pass
-                    except Exception as e:
-                        logger.error(f"Error stopping main process: {e}")
-                    self._main_process = None
-                    self._rtmp_url = None
-            
-            # Small delay to ensure old processes are fully stopped
-            time.sleep(0.3)
-            
-            # Kill ALL FFmpeg processes as safety measure (Windows only)
-            # This ensures no orphaned processes interfere
-            if os.name == 'nt':
-                try:
-                    # Use taskkill to kill all ffmpeg processes
-                    kill_proc = subprocess.Popen(
-                        ['taskkill', '/F', '/IM', 'ffmpeg.exe'],
-                        stdout=subprocess.DEVNULL,
-                        stderr=subprocess.DEVNULL,
-                        creationflags=subprocess.CREATE_NO_WINDOW
-                    )
-                    kill_proc.wait(timeout=2)
-                    if kill_proc.returncode == 0:
-                        logger.info("Killed all FFmpeg processes as safety measure")
-                    time.sleep(0.5)  # Wait for processes to fully terminate
-                except subprocess.TimeoutExpired:
-                    kill_proc.kill()
-                except Exception as e:
-                    logger.debug(f"Could not clean up orphaned processes: {e}")
-            
-            # Start or ensure main stream is running
-            if not self._start_main_stream(rtmp_url):
-                return {"error": "failed to start main stream"}
-            
-            # Start feeding new stream
-            self._feed_process = self._feed_stream(stream_url, station_name)
-            
-            if not self._feed_process:
-                return {"error": "failed to start feed process"}
-            
-            self._current_station = {"name": station_name or stream_url, "url": stream_url}
-            
-            return {"status": "starting", "rtmp": rtmp_url}
+LOUDNESS_TARGET = float(os.environ["LOUDNESS_TARGET"]) if os.environ.get("LOUDNESS_TARGET") else None  # LUFS; unset = off
+LOUDNESS_WINDOW = float(os.environ.get("LOUDNESS_WINDOW", 10.0))  # Seconds of gated loudness the gain follows
+LOUDNESS_MAX_GAIN_DB = float(os.environ.get("LOUDNESS_MAX_GAIN_DB", 12.0))  # Most boost (or cut) applied
+LOUDNESS_GAIN_RATE_DB = float(os.environ.get("LOUDNESS_GAIN_RATE_DB", 2.0))  # dB per second the gain may move
+LOUDNESS_SEGMENT_FRAMES = PCM_SAMPLE_RATE // 10  # Gating blocks are 4 segments (400 ms), one every segment
+LOUDNESS_SHORT_TERM_SEGMENTS = 30  # 3 s
+LOUDNESS_ABSOLUTE_GATE = -70.0  # LUFS
+LOUDNESS_RELATIVE_GATE = -10.0  # LU below the loudness of the blocks over the absolute gate
+LIMITER_CEILING_DB = float(os.environ.get("LIMITER_CEILING_DB", -1.0))  # Sample peak ceiling after the gain, dBFS
+LIMITER_RELEASE_DB = 20.0  # dB per second the limiter lets go
+LIMITER_BLOCK_FRAMES = 64  # Limiter gain resolution (~1.5 ms)
 
-    def stop_stream(self) -> Dict[str, str]:
-        with self._lock:
-            # Stop feed process (force kill for speed)
-            if self._feed_process and self._feed_process.poll() is None:
-                logger.info(f"Stopping feed process (PID: {self._feed_process.pid})")
-                try:
-                    self._feed_process.kill()  # Force kill
-                    try:
-                        self._feed_process.wait(timeout=1)
-                    except:
-                        pass
-                except Exception as e:
-                    logger.error(f"Error stopping feed: {e}")
-            
-            # Stop main process (force kill for speed)
-            if self._main_process and self._main_process.poll() is None:
-                logger.info(f"Stopping main stream (PID: {self._main_process.pid})")
-                try:
-                    self._main_process.kill()  # Force kill
-                    try:
-                        self._main_process.wait(timeout=1)
-                        logger.info("Main stream stopped")
-                    except:
-                        pass
-                except Exception as e:
-                    logger.error(f"Error stopping main stream: {e}")
-            
-            # Close stdin if open
-            if self._main_process and self._main_process.stdin:
-                try:
-                    self._main_process.stdin.close()
-                except:
-                    pass
-            
-            self._main_process = None
-            self._feed_process = None
-            self._current_station = None
-            
-            # Kill all FFmpeg processes as final cleanup (Windows only)
-            if os.name == 'nt':
-                try:
-                    subprocess.Popen(
-                        ['taskkill', '/F', '/IM', 'ffmpeg.exe'],
-                        stdout=subprocess.DEVNULL,
-                        stderr=subprocess.DEVNULL,
-                        creationflags=subprocess.CREATE_NO_WINDOW
-                    ).wait(timeout=2)
-                except:
-                    pass
-            
-            return {"status": "stopped"}
 
-    def get_status(self) -> Dict[str, Optional[str]]:
-        with self._lock:
-            # Stream is running if main process is running (feed can restart without stopping stream)
-            running = self._main_process is not None and self._main_process.poll() is None
-            name = self._current_station.get("name") if self._current_station else None
-            url = self._current_station.get("url") if self._current_station else None
-            feed_running = self._feed_process is not None and self._feed_process.poll() is None
-            return {"running": running, "name": name, "url": url, "feed_running": feed_running}
+def _lufs(energy: float) -> Optional[float]:
+    """Loudness of a K-weighted mean square (summed over channels); None below the absolute gate"""
+    if energy <= 0:
+        return None
+    lufs = -0.691 + 10 * math.log10(energy)
+    return lufs if lufs >= LOUDNESS_ABSOLUTE_GATE else None
 
 
-@app.get("/", response_class=HTMLResponse)
-async def index(request: Request):
-    # Render template
-    return templates.TemplateResponse("index.html", {"request": request})
+def _gated_energy(blocks) -> float:
+    """Mean energy of the blocks that pass both BS.1770 gates; 0 if none do"""
+    blocks = blocks[blocks >= 10 ** ((LOUDNESS_ABSOLUTE_GATE + 0.691) / 10)]
+    if not len(blocks):
+        return 0.0
+    blocks = blocks[blocks >= blocks.mean() * 10 ** (LOUDNESS_RELATIVE_GATE / 10)]
+    return float(blocks.mean())
 
 
-@app.get("/api/stations")
-async def get_stations():
-    try:
-        content = M3U_PATH.read_text(encoding="utf-8")
-    except Exception as e:
-        return JSONResponse(status_code=500, content={"error": f"Failed to read M3U file: {e}"})
-    stations = parse_m3u(content)
-    return stations
+def k_weighting(n: int, rate: int = PCM_SAMPLE_RATE):
+    """Weights that turn the rfft of an n-frame s16 segment into its K-weighted mean square.
 
+    The power response of the BS.1770 pre-filter (high shelf) and RLB
+    high-pass, designed for any sample rate as libebur128 does, times the
+    Parseval factors of a one-sided spectrum.
+    """
+    k = math.tan(math.pi * 1681.974450955533 / rate)
+    vh = 10 ** (3.999843853973347 / 20)
+    vb = vh ** 0.4996667741545416
+    q = 0.7071752369554196
+    a0 = 1 + k / q + k * k
+    shelf = ([(vh + vb * k / q + k * k) / a0, 2 * (k * k - vh) / a0, (vh - vb * k / q + k * k) / a0],
+             [1.0, 2 * (k * k - 1) / a0, (1 - k / q + k * k) / a0])
+    k = math.tan(math.pi * 38.13547087602444 / rate)
+    q = 0.5003270373238773
+    a0 = 1 + k / q + k * k
+    highpass = ([1.0, -2.0, 1.0], [1.0, 2 * (k * k - 1) / a0, (1 - k / q + k * k) / a0])
+    z = np.exp(-2j * np.pi * np.arange(n // 2 + 1) / n)  # z^-1 at each bin
+    weights = np.ones(n // 2 + 1)
+    for b, a in (shelf, highpass):
+        h = (b[0] + b[1] * z + b[2] * z * z) / (a[0] + a[1] * z + a[2] * z * z)
+        weights *= np.abs(h) ** 2
+    weights[1:(n + 1) // 2] *= 2  # Every bin but DC (and Nyquist) stands for two
+    return weights / (n * n * 32768.0 ** 2)
 
-@app.post("/api/start")
-async def api_start(payload: Dict[str, str]):
-    url = payload.get("url")
-    rtmp_server = payload.get("rtmp_server", "")
-    key = payload.get("key", "")
-    if not url or not rtmp_server or not key:
-        return JSONResponse(status_code=400, content={"error": "Missing url, rtmp_server, or key"})
 
-    # Find station name by URL (optional)
-    station_name: Optional[str] = None
+class LoudnessNormalizer:
+    """Levels the PCM a relay sends out to a target loudness, in place.
+
+    Loudness is measured EBU R128 style: each 100 ms segment is K-weighted
+    through its spectrum, 400 ms blocks are formed every 100 ms and gated
+    at -70 LUFS and 10 LU below the rest. The gain follows the gated
+    loudness of the last LOUDNESS_WINDOW seconds towards the target, moving
+    at most LOUDNESS_GAIN_RATE_DB per second and holding through silence.
+    A limiter then keeps sample peaks under LIMITER_CEILING_DB: it reacts
+    within the 64-frame block that would clip (the gain is already down at
+    the block's start, so it needs no look-ahead delay) and lets go at
+    LIMITER_RELEASE_DB per second. Everything works on a whole tick of audio
+    at once with NumPy.
+    """
+
+    _weights = None  # k_weighting(LOUDNESS_SEGMENT_FRAMES), shared
+
+    def __init__(self, target: float) -> None:
+        if LoudnessNormalizer._weights is None:
+            LoudnessNormalizer._weights = k_weighting(LOUDNESS_SEGMENT_FRAMES)
+        self.target = target
+        self._gain_db = 0.0
+        self._limiter_db = 0.0  # Limiter gain at the end of the last tick
+        self._max_limiter_db = 0.0
+        self._peak: Optional[float] = None  # Output meters over the last tick, linear
+        self._rms: Optional[float] = None
+        self._frames = 0
+        self._seconds = 0.0  # Time spent processing
+        self.reset()
+
+    def reset(self) -> None:
+        """Start measuring afresh (a new station); the gain carries on from where it is"""
+        self._carry = np.zeros((0, 2), dtype=np.float32)  # Frames short of a whole segment
+        self._segments: deque = deque(maxlen=LOUDNESS_SHORT_TERM_SEGMENTS)
+        self._blocks: deque = deque(maxlen=max(1, int(LOUDNESS_WINDOW * 10)))
+        self._histogram = np.zeros((2, 751))  # Block count and energy per 0.1 LU from -70 LUFS
+        self._window_energy = 0.0
+
+    def process(self, chunks: List[memoryview]) -> None:
+        """Measure, level and limit one tick of s16le stereo audio, writing it back into chunks"""
+        started = time.perf_counter()
+        parts = [np.frombuffer(chunk, dtype="<i2") for chunk in chunks]
+        x = (np.concatenate(parts) if len(parts) > 1 else parts[0]).reshape(-1, 2).astype(np.float32)
+        n = len(x)
+        self._measure(x)
+        gain_from, self._gain_db = self._gain_db, self._next_gain(n / PCM_SAMPLE_RATE)
+        if gain_from != self._gain_db:
+            x *= np.linspace(10 ** (gain_from / 20), 10 ** (self._gain_db / 20), n, endpoint=False,
+                             dtype=np.float32)[:, None]
+        elif self._gain_db:
+            x *= np.float32(10 ** (self._gain_db / 20))
+        limiter = self._limit(x)
+        if limiter is not None:
+            x *= limiter[:, None]
+        np.rint(x, out=x)
+        np.clip(x, -32768, 32767, out=x)
+        self._peak = float(np.abs(x).max())
+        self._rms = math.sqrt(float(np.square(x, dtype=np.float64).mean()))
+        flat = x.reshape(-1)
+        i = 0
+        for part in parts:
+            part[:] = flat[i:i + len(part)]
+            i += len(part)
+        self._frames += n
+        self._seconds += time.perf_counter() - started
+
+    def _measure(self, x) -> None:
+        seg = LOUDNESS_SEGMENT_FRAMES
+        if len(self._carry):
+            x = np.concatenate((self._carry, x))
+        whole = len(x) - len(x) % seg
+        self._carry = x[whole:].copy()
+        if not whole:
+            return
+        # Channels (the short last axis) are summed elementwise: reducing over it is slow
+        spectra = np.fft.rfft(x[:whole].reshape(-1, seg, 2), axis=1)
+        power = spectra.real ** 2 + spectra.imag ** 2
+        for energy in (power[..., 0] + power[..., 1]) @ self._weights:
+            self._segments.append(float(energy))
+            if len(self._segments) < 4:
+                continue
+            block = (self._segments[-1] + self._segments[-2] + self._segments[-3] + self._segments[-4]) / 4
+            self._blocks.append(block)
+            lufs = _lufs(block)
+            if lufs is not None:
+                i = min(int((lufs - LOUDNESS_ABSOLUTE_GATE) * 10), 750)
+                self._histogram[0, i] += 1
+                self._histogram[1, i] += block
+        self._window_energy = _gated_energy(np.fromiter(self._blocks, float, len(self._blocks)))
+
+    def _next_gain(self, seconds: float) -> float:
+        loudness = _lufs(self._window_energy)
+        if loudness is None:
+            return self._gain_db  # Nothing measured yet, or silence: hold
+        want = min(max(self.target - loudness, -LOUDNESS_MAX_GAIN_DB), LOUDNESS_MAX_GAIN_DB)
+        step = LOUDNESS_GAIN_RATE_DB * seconds
+        return self._gain_db + min(max(want - self._gain_db, -step), step)
+
+    def _limit(self, x):
+        """Per-frame limiter gain for x, or None when it has nothing to do"""
+        n = len(x)
+        starts = np.arange(0, n, LIMITER_BLOCK_FRAMES)
+        peaks = np.maximum.reduceat(np.maximum(np.abs(x[:, 0]), np.abs(x[:, 1])), starts)
+        need = np.minimum(32768 * 10 ** (LIMITER_CEILING_DB / 20) / np.maximum(peaks, 1.0), 1.0)
+        if self._limiter_db == 0.0 and need.min() >= 1.0:
+            return None
+        need_db = 20 * np.log10(need)
+        # Gain at each block edge: low enough for the blocks on both sides, so
+        # ramping between edges never lets a block through above the ceiling
+        edges = np.empty(len(starts) + 1)
+        edges[0] = min(self._limiter_db, need_db[0])
+        edges[1:-1] = np.minimum(need_db[:-1], need_db[1:])
+        edges[-1] = need_db[-1]
+        # Drop at once, recover at most LIMITER_RELEASE_DB per second
+        release = np.arange(len(edges)) * (LIMITER_RELEASE_DB * LIMITER_BLOCK_FRAMES / PCM_SAMPLE_RATE)
+        edges = np.minimum.accumulate(edges - release) + release
+        self._limiter_db = float(edges[-1])
+        self._max_limiter_db = min(self._max_limiter_db, float(edges.min()))
+        return np.interp(np.arange(n), np.append(starts, n), 10 ** (edges / 20)).astype(np.float32)
+
+    def _integrated(self) -> Optional[float]:
+        """Gated loudness of everything since reset(), from the block histogram"""
+        count, energy = self._histogram
+        if not count.sum():
+            return None
+        threshold = _lufs(energy.sum() / count.sum()) + LOUDNESS_RELATIVE_GATE
+        start = max(0, math.ceil((threshold - LOUDNESS_ABSOLUTE_GATE) * 10))
+        if not count[start:].sum():
+            return None
+        return _lufs(energy[start:].sum() / count[start:].sum())
+
+    def stats(self) -> Dict[str, object]:
+        def rounded(value: Optional[float]) -> Optional[float]:
+            return round(value, 1) if value is not None else None
+
+        def dbfs(value: Optional[float]) -> Optional[float]:
+            return round(20 * math.log10(value / 32768), 1) if value else None
+
+        short_term = sum(self._segments) / len(self._segments) if self._segments else 0.0
+        return {
+            "target_lufs": self.target,
+            "momentary_lufs": rounded(_lufs(self._blocks[-1])) if self._blocks else None,
+            "short_term_lufs": rounded(_lufs(short_term)),
+            "window_lufs": rounded(_lufs(self._window_energy)),
+            "integrated_lufs": rounded(self._integrated()),
+            "gain_db": round(self._gain_db, 2),
+            "limiter_db": round(self._limiter_db, 2),
+            "max_limiter_db": round(self._max_limiter_db, 2),
+            "peak_dbfs": dbfs(self._peak),
+            "rms_dbfs": dbfs(self._rms),
+            "load": round(self._seconds * PCM_SAMPLE_RATE / self._frames, 5) if self._frames else 0.0,
+        }
+
+
+RELAY_PIPE_SIZE = 1024 * 1024  # Encoder stdin pipe size on Linux, ~6 s of audio
+
+
+class _Sink:
+    """An encoder's stdin as seen by the relay.
+
+    The pipe is non-blocking, so a stalled encoder loses audio instead of
+    holding up the event loop and every other sink.
+    """
+
+    def __init__(self, fd: int) -> None:
+        self.fd = fd
+        self.pending: Optional[bytearray] = None  # Rest of a partially written chunk
+        self.bytes = 0
+        self.dropped_bytes = 0
+        self.stalls = 0
+        self.waiting = False  # Splice mode: paused until the pipe is writable again
+        try:
+            import fcntl
+            fcntl.fcntl(fd, fcntl.F_SETPIPE_SZ, RELAY_PIPE_SIZE)
+        except (ImportError, AttributeError, OSError):
+            pass
+
+
+class _FeedSource:
+    """A shared feed as seen by the relay"""
+
+    def __init__(self, feed: "SharedFeed", label: Optional[str], on_first_data=None, now: float = 0.0) -> None:
+        self.feed = feed
+        self.fd: Optional[int] = None  # Splice mode: the feed process's stdout
+        self.label = label
+        self.watching = False  # Splice mode: registered with the loop's reader
+        self.ended = False
+        self.attached_at = now
+        self.last_data: Optional[float] = None  # Loop time of the last audio from the feed
+        self.silent_since: Optional[float] = None
+        self._on_first_data = on_first_data
+
+    def first_data(self) -> None:
+        callback, self._on_first_data = self._on_first_data, None
+        if callback is not None:
+            callback()
+
+
+class _Crossfade:
+    """The outgoing feed during a crossfade: it keeps playing under the new one until the fade is done"""
+
+    def __init__(self, source: _FeedSource, queued: bytes, nbytes: int, on_done=None) -> None:
+        self.source = source
+        self.nbytes = nbytes  # Length of the whole fade
+        self.done = 0  # Bytes of it played so far
+        self.buf = bytearray(queued[:nbytes])  # Old audio not yet mixed in
+        self.on_done = on_done  # Called with the bytes actually faded once the fade ends
+
+    def push(self, chunk: memoryview) -> None:
+        room = self.nbytes - self.done - len(self.buf)
+        if room > 0:
+            self.buf += chunk[:room]
+
+
+def _write_some(fd: int, data) -> int:
+    """Write what a non-blocking pipe accepts right now"""
     try:
-        content = M3U_PATH.read_text(encoding="utf-8")
-        stations = parse_m3u(content)
-        match = next((s for s in stations if s["url"] == url), None)
-        station_name = match["name"] if match else None
-    except Exception:
-        station_name = None
+        return os.write(fd, data)
+    except BlockingIOError:
+        return 0
 
-    # Run in thread to avoid blocking
-    import asyncio
-    loop = asyncio.get_event_loop()
-    result = await loop.run_in_executor(None, StreamManager().start_stream, url, rtmp_server, key, station_name)
-    if "error" in result:
-        return JSONResponse(status_code=500, content=result)
-    return result
 
+class PcmRelay:
+    """Moves PCM from a shared feed to the stdin of one or more encoder FFmpegs.
 
-@app.post("/api/stop")
-async def api_stop():
-    result = StreamManager().stop_stream()
-    return result
+    Everything runs as callbacks on the event loop, so a channel costs no
+    threads. The feed (see SharedFeed) pushes its audio into a fixed ring
+    buffer, so no bytes objects are allocated per chunk. A timer drains the
+    ring on a real-time clock in RELAY_BATCH_SIZE ticks; when the feed is
+    reconnecting or dead it writes silence (or comfort noise) instead, so the
+    encoders and the RTMP sessions never starve. With RELAY_SPLICE=1 (Linux)
+    the feed has a single channel and its pipe is spliced straight into a
+    single encoder's pipe, so the data never enters Python; that mode has no
+    clock and no underrun filler.
 
+    With on_stall set, every tick also checks the source: it is reported as
+    stalled once it has sent nothing for FAILOVER_STALL_MS, or only silence
+    (a sparse peak scan of the audio going out) for FAILOVER_SILENCE_S. It is
+    reported again on every tick until the source changes.
 
-@app.get("/api/status")
-async def api_status():
-    status = StreamManager().get_status()
-    return status
+    With loudness_target set (LOUDNESS_TARGET, needs NumPy), each tick's
+    audio is levelled by a LoudnessNormalizer on its way out; the filler
+    is not. Splice mode has no way to process the audio.
+
+    Every method must be called from the event loop.
+    """
+
+    def __init__(self, name: str, buffer_size: int = RELAY_BUFFER_SIZE, batch_size: int = RELAY_BATCH_SIZE,
+                 use_splice: bool = RELAY_SPLICE, loudness_target: Optional[float] = LOUDNESS_TARGET) -> None:
+        self.name = name
+        buffer_size -= buffer_size % PCM_FRAME_BYTES
+        self._size = buffer_size
+        self._buf = bytearray(buffer_size)
+        self._view = memoryview(self._buf)
+        self._batch = max(PCM_FRAME_BYTES, min(batch_size, buffer_size // 2))
+        self._batch -= self._batch % PCM_FRAME_BYTES
+        # The writer runs on a clock with one batch per tick (20-250 ms) and
+        # keeps about two ticks of audio buffered against network jitter
+        tick = min(max(self._batch / PCM_BYTES_PER_SEC, 0.02), 0.25)
+        self._tick_bytes = int(tick * PCM_SAMPLE_RATE) * PCM_FRAME_BYTES
+        self._jitter_bytes = min(max(2 * self._tick_bytes, PCM_BYTES_PER_SEC // 5), buffer_size // 2)
+        self._jitter_bytes -= self._jitter_bytes % PCM_FRAME_BYTES
+        self._max_fill = min(int(RELAY_MAX_LATENCY * PCM_BYTES_PER_SEC), buffer_size - self._tick_bytes)
+        self._priming = True
+        self._live = False
+        self._use_splice = use_splice
+        self._loop: Optional[asyncio.AbstractEventLoop] = None
+        # Total bytes ever put into / taken out of the ring; fill = head - tail
+        self._head = 0
+        self._tail = 0
+        self._source: Optional[_FeedSource] = None  # Current feed
+        self._fade: Optional[_Crossfade] = None  # Previous feed, while it fades out under the current one
+        self.on_stall = None  # Called with a reason while the source is stalled (see _check_stall)
+        self._sinks: Dict[object, _Sink] = {}  # Encoder stdin pipes, keyed by their owner
+        self._dsp: Optional[LoudnessNormalizer] = None
+        if loudness_target is not None:
+            if load_numpy() is None:
+                logger.warning(f"[{name}] Loudness normalization needs NumPy; sending audio unprocessed")
+            elif use_splice:
+                logger.warning(f"[{name}] Loudness normalization does not work with RELAY_SPLICE; sending audio unprocessed")
+            else:
+                self._dsp = LoudnessNormalizer(loudness_target)
+        self._tick_handle: Optional[asyncio.TimerHandle] = None
+        self._clock_start: Optional[float] = None
+        self._clock_frames = 0
+        # Metrics
+        self._bytes_in = 0
+        self._bytes_out = 0
+        self._read_stalls = 0
+        self._write_stalls = 0
+        self._max_write_ms = 0.0
+        self._underruns = 0
+        self._underrun_since: Optional[float] = None
+        self._underrun_seconds = 0.0
+        self._filler_bytes = 0
+        self._dropped_bytes = 0
+        self._clock_resets = 0
+        self._rate = 0.0
+        self._rate_bytes = 0
+        self._rate_started = time.monotonic()
+
+    def add_sink(self, key, fd: int) -> None:
+        """Start feeding an encoder's stdin; every sink gets the same audio"""
+        self._loop = asyncio.get_running_loop()
+        self._sinks[key] = _Sink(fd)
+        if self._use_splice:
+            self._watch_source()
+        elif self._tick_handle is None:
+            self._clock_start = None
+            self._tick_handle = self._loop.call_soon(self._tick)
+
+    def remove_sink(self, key, fd: Optional[int] = None) -> None:
+        """Stop feeding an encoder; with fd given, only if that pipe is still the registered one"""
+        sink = self._sinks.get(key)
+        if sink is None or (fd is not None and sink.fd != fd):
+            return
+        del self._sinks[key]
+        if sink.waiting:
+            self._loop.remove_writer(sink.fd)
+        if not self._sinks:
+            self._priming = True
+            self._live = False
+            if self._tick_handle is not None:
+                self._tick_handle.cancel()
+                self._tick_handle = None
+            self._end_underrun()
+            if self._source is not None:
+                self._unwatch(self._source)
+
+    def sink_stats(self, key) -> Dict[str, object]:
+        sink = self._sinks.get(key)
+        if sink is None:
+            return {"bytes": 0, "dropped_bytes": 0, "stalls": 0}
+        return {"bytes": sink.bytes, "dropped_bytes": sink.dropped_bytes, "stalls": sink.stalls}
+
+    @property
+    def splice(self) -> bool:
+        return self._use_splice
+
+    def attach_feed(self, feed: "SharedFeed", label: Optional[str] = None, prebuffer_bytes: int = 0,
+                    on_first_data=None) -> None:
+        """Start relaying from a feed in place of the current one.
+
+        With prebuffer_bytes, the newest audio the feed already has is queued
+        first (if it is delivering right now). on_first_data is called once
+        when the feed's first audio reaches the buffer.
+        """
+        self._loop = asyncio.get_running_loop()
+        self.detach_source()
+        source = _FeedSource(feed, label, on_first_data, self._loop.time())
+        if self._dsp is not None:
+            self._dsp.reset()
+        # Cut at a frame boundary so the new feed's samples stay aligned
+        self._head -= self._head % PCM_FRAME_BYTES
+        self._source = source
+        if self._use_splice:
+            feed.subscribe(source, on_fd=lambda fd: self._on_source_fd(source, fd))
+            return
+        prebuffer = feed.recent(prebuffer_bytes) if prebuffer_bytes and feed.hot() else b""
+        if prebuffer:
+            self._put(prebuffer)
+            source.last_data = source.attached_at
+            source.first_data()
+        # From here on the feed pushes each chunk as it decodes it
+        feed.subscribe(source, push=lambda chunk: self._push(source, chunk))
+
+    def cutover(self, feed: "SharedFeed", label: Optional[str] = None, crossfade_bytes: int = 0,
+                on_first_data=None, on_faded=None) -> None:
+        """Switch to a pre-warmed feed at a frame boundary, optionally crossfading from the current one.
+
+        The fade starts right at the play position: the current feed's queued
+        audio moves out of the ring and the feed keeps pushing to the fade
+        until crossfade_bytes of it have been mixed under the new one.
+        on_faded is called with the bytes actually faded once the old feed is
+        let go (at once when there is no fade).
+        """
+        self._end_fade()
+        old = self._source
+        crossfade_bytes -= crossfade_bytes % PCM_FRAME_BYTES
+        if old is None or crossfade_bytes <= 0 or load_numpy() is None:
+            self.attach_feed(feed, label, FEED_PREWARM_BYTES, on_first_data)
+            if on_faded is not None:
+                on_faded(0)
+            return
+        # Keep the old feed subscribed (attach_feed would drop it); it pushes to the fade instead
+        self._source = None
+        self._head -= self._head % PCM_FRAME_BYTES
+        n = min(self._head - self._tail, crossfade_bytes)
+        start = self._tail % self._size
+        first = min(n, self._size - start)
+        queued = bytes(self._view[start:start + first]) + bytes(self._view[:n - first])
+        self._head = self._tail
+        self.attach_feed(feed, label, FEED_PREWARM_BYTES, on_first_data)
+        fade = _Crossfade(old, queued, crossfade_bytes, on_faded)
+        old.feed.subscribe(old, push=fade.push)
+        self._fade = fade
+
+    def can_cutover(self) -> bool:
+        """Gapless switching needs the audio to pass through the ring buffer"""
+        return not self._use_splice and self._source is not None
+
+    def detach_source(self) -> None:
+        """Stop taking audio from the current feed"""
+        self._end_fade()
+        source, self._source = self._source, None
+        if source is not None:
+            self._unwatch(source)
+            source.feed.unsubscribe(source)
+
+    def clear(self) -> None:
+        """Drop buffered audio (e.g. when the channel stops)"""
+        self._end_fade()
+        self._tail = self._head
+
+    def _end_fade(self) -> None:
+        """Let go of the feed that was fading out"""
+        fade, self._fade = self._fade, None
+        if fade is None:
+            return
+        fade.source.feed.unsubscribe(fade.source)
+        if fade.on_done is not None:
+            fade.on_done(fade.done)
+
+    def _crossfade(self, chunks: List[memoryview]) -> None:
+        """Mix the fading feed under this tick's audio from the new one"""
+        fade = self._fade
+        frames = fade.nbytes // PCM_FRAME_BYTES
+        for chunk in chunks:
+            n = min(len(chunk), fade.nbytes - fade.done)
+            if n <= 0:
+                break
+            old = bytes(fade.buf[:n])
+            del fade.buf[:n]
+            if len(old) < n:
+                # The old feed fell behind: fade from silence for the rest
+                old += bytes(n - len(old))
+            crossfade_pcm(old, chunk[:n], fade.done // PCM_FRAME_BYTES, frames)
+            fade.done += n
+        if fade.done >= fade.nbytes:
+            self._end_fade()
+
+    def _on_source_fd(self, source: "_FeedSource", fd: Optional[int]) -> None:
+        """Splice mode: the feed process (re)started with a new stdout, or exited (fd is None)"""
+        self._unwatch(source)
+        source.fd = fd
+        source.ended = fd is None
+        if fd is not None and source is self._source:
+            self._watch_source()
+
+    def _watch_source(self) -> None:
+        """Splice mode: have the loop call us when the feed has data, unless the encoder's pipe is full"""
+        source = self._source
+        if not self._use_splice or source is None or source.watching or source.ended or source.fd is None:
+            return
+        sink = next(iter(self._sinks.values()), None)
+        if sink is None or sink.waiting:
+            return
+        self._loop.add_reader(source.fd, self._on_splice_readable, source)
+        source.watching = True
+
+    def _unwatch(self, source: "_FeedSource") -> None:
+        if source.watching:
+            self._loop.remove_reader(source.fd)
+            source.watching = False
+
+    def _source_ended(self, source: "_FeedSource", how: str = "reader") -> None:
+        self._unwatch(source)
+        source.ended = True
+        logger.info(f"[{self.name}] Feed {how} ended for {source.label}")
+
+    def _put(self, data: bytes) -> None:
+        """Copy data into the ring at head"""
+        size = self._size
+        free = size - (self._head - self._tail)
+        if len(data) > free:
+            # Keep the newest audio; dropping the start keeps the rest contiguous
+            data = memoryview(data)[len(data) - free + free % PCM_FRAME_BYTES:]
+        start = self._head % size
+        first = min(len(data), size - start)
+        self._view[start:start + first] = data[:first]
+        self._view[:len(data) - first] = data[first:]
+        self._head += len(data)
+        self._bytes_in += len(data)
+
+    def _push(self, source: "_FeedSource", chunk: memoryview) -> None:
+        """Take a frame-aligned chunk the feed just decoded"""
+        over = self._head - self._tail + len(chunk) - self._size
+        if over > 0:
+            # Ring full (the encoders are not taking audio): make room by dropping the oldest
+            over += -over % PCM_FRAME_BYTES
+            self._tail += over
+            self._dropped_bytes += over
+            self._read_stalls += 1
+        self._put(chunk)
+        source.last_data = self._loop.time()
+        source.first_data()
+
+    def _check_stall(self, now: float, audio: List[memoryview]) -> None:
+        """Tell on_stall if the source has sent nothing, or only silence, for too long"""
+        source = self._source
+        if source.last_data is None:
+            quiet, limit = now - source.attached_at, FAILOVER_FIRST_AUDIO_TIMEOUT
+        else:
+            quiet, limit = now - source.last_data, FAILOVER_STALL_MS / 1000
+        if quiet >= limit:
+            self.on_stall(f"no audio for {quiet * 1000:.0f} ms")
+            return
+        if not audio:
+            return
+        if max(pcm_peak(chunk) for chunk in audio) > FAILOVER_SILENCE_LEVEL:
+            source.silent_since = None
+        elif source.silent_since is None:
+            source.silent_since = now
+        elif now - source.silent_since >= FAILOVER_SILENCE_S:
+            self.on_stall(f"silent for {now - source.silent_since:.0f} s")
+
+    def _tick(self) -> None:
+        """Write one tick of audio per tick of the wall clock, padding underruns with filler"""
+        self._tick_handle = None
+        if not self._sinks:
+            return
+        size = self._size
+        tick_frames = self._tick_bytes // PCM_FRAME_BYTES
+        now = self._loop.time()
+        if self._clock_start is None:
+            self._clock_start, self._clock_frames = now, 0
+        # Stay one tick ahead of the clock so the encoder never waits on us
+        due = int((now - self._clock_start) * PCM_SAMPLE_RATE) + tick_frames - self._clock_frames
+        if due > PCM_SAMPLE_RATE:
+            # The loop was held up for over a second; restart the clock instead of bursting
+            self._clock_resets += 1
+            self._clock_start, self._clock_frames = now, 0
+            due = tick_frames
+        want = due * PCM_FRAME_BYTES
+        fill = self._head - self._tail
+        if fill > self._max_fill:
+            drop = fill - self._jitter_bytes
+            drop -= drop % PCM_FRAME_BYTES
+            self._tail += drop
+            self._dropped_bytes += drop
+            fill -= drop
+        if self._priming and fill >= self._jitter_bytes:
+            self._priming = False
+        take = 0 if self._priming else min(fill, want)
+        take -= take % PCM_FRAME_BYTES
+        start = self._tail % size
+        first = min(take, size - start)
+        chunks = [self._view[start:start + first]] if take else []
+        if take > first:
+            chunks.append(self._view[:take - first])
+        if self.on_stall is not None and self._source is not None:
+            self._check_stall(now, chunks)
+        if self._fade is not None and chunks:
+            self._crossfade(chunks)
+        if self._dsp is not None and chunks:
+            self._dsp.process(chunks)
+        if take < want:
+            chunks.extend(self._filler_chunks(want - take))
+        t0 = time.perf_counter()
+        for key, sink in list(self._sinks.items()):
+            try:
+                self._deliver(sink, chunks, want)
+            except OSError as e:
+                logger.error(f"[{self.name}] Error writing to main stdin: {e}")
+                self.remove_sink(key, sink.fd)
+        if not self._sinks:
+            return
+        self._account_write(want, time.perf_counter() - t0)
+        self._clock_frames += due
+        self._tail += take
+        self._live = self._live or take > 0
+        if take < want:
+            self._start_underrun(want - take)
+        elif take:
+            self._end_underrun()
+        # Next write is due once the clock catches up with what has been written
+        next_tick = self._clock_start + self._clock_frames / PCM_SAMPLE_RATE
+        self._tick_handle = self._loop.call_at(next_tick, self._tick)
+
+    def _deliver(self, sink: "_Sink", chunks: List[memoryview], total: int) -> None:
+        """Write one tick to a sink without letting a slow encoder hold up the others"""
+        if sink.pending:
+            del sink.pending[:_write_some(sink.fd, sink.pending)]
+            if sink.pending:
+                # Encoder pipe still full: skip this tick for this sink only
+                sink.dropped_bytes += total
+                sink.stalls += 1
+                self._write_stalls += 1
+                return
+        for i, chunk in enumerate(chunks):
+            n = _write_some(sink.fd, chunk)
+            if n < len(chunk):
+                # Keep the rest of this chunk so the sink's stream stays frame-aligned
+                sink.pending = bytearray(chunk[n:])
+                sink.bytes += sum(len(c) for c in chunks[:i + 1])
+                rest = sum(len(c) for c in chunks[i + 1:])
+                if rest:
+                    sink.dropped_bytes += rest
+                    sink.stalls += 1
+                    self._write_stalls += 1
+                return
+        sink.bytes += total
+
+    def _filler_chunks(self, nbytes: int) -> List[memoryview]:
+        filler = _filler_pcm(self._tick_bytes * 2)
+        chunks = []
+        while nbytes > 0:
+            n = min(nbytes, len(filler))
+            chunks.append(filler[:n])
+            nbytes -= n
+        return chunks
+
+    def _start_underrun(self, nbytes: int) -> None:
+        self._filler_bytes += nbytes
+        if not self._live:
+            return  # Still waiting for the first audio since the encoder started
+        if self._underrun_since is None:
+            self._underrun_since = time.monotonic()
+            self._underruns += 1
+            self._priming = True
+            if self._source is not None:
+                logger.warning(f"[{self.name}] Feed underrun, sending {RELAY_FILL} to keep the encoder fed")
+
+    def _end_underrun(self) -> None:
+        if self._underrun_since is None:
+            return
+        duration = time.monotonic() - self._underrun_since
+        self._underrun_since = None
+        self._underrun_seconds += duration
+        if self._source is not None:
+            logger.info(f"[{self.name}] Feed recovered after {duration * 1000:.0f} ms of {RELAY_FILL}")
+
+    def _on_splice_readable(self, source: "_FeedSource") -> None:
+        key, sink = next(iter(self._sinks.items()), (None, None))
+        if sink is None:
+            self._unwatch(source)
+            return
+        t0 = time.perf_counter()
+        try:
+            n = os.splice(source.fd, sink.fd, self._batch, flags=os.SPLICE_F_NONBLOCK)
+        except BlockingIOError:
+            # The encoder's pipe is full: park the feed until it drains
+            self._write_stalls += 1
+            self._unwatch(source)
+            sink.waiting = True
+            self._loop.add_writer(sink.fd, self._on_sink_writable, sink)
+            return
+        except OSError as e:
+            logger.error(f"[{self.name}] Error splicing to main stdin: {e}")
+            self.remove_sink(key, sink.fd)
+            return
+        if not n:
+            self._source_ended(source, "splice")
+            return
+        self._bytes_in += n
+        sink.bytes += n
+        self._account_write(n, time.perf_counter() - t0)
+        source.first_data()
+
+    def _on_sink_writable(self, sink: "_Sink") -> None:
+        self._loop.remove_writer(sink.fd)
+        sink.waiting = False
+        self._watch_source()
+
+    def _account_write(self, n: int, elapsed: float) -> None:
+        RELAY_WRITE_SECONDS.observe(elapsed, self.name)
+        self._bytes_out += n
+        if elapsed > RELAY_STALL_SECONDS:
+            self._write_stalls += 1
+        self._max_write_ms = max(self._max_write_ms, elapsed * 1000)
+        self._rate_bytes += n
+        now = time.monotonic()
+        if now - self._rate_started >= 1.0:
+            self._rate = self._rate_bytes / (now - self._rate_started)
+            self._rate_bytes = 0
+            self._rate_started = now
+
+    def _pipe_fill(self) -> Optional[int]:
+        """Bytes waiting in the feed pipe (splice mode has no ring buffer)"""
+        source = self._source
+        if source is None or source.fd is None:
+            return 0
+        try:
+            import fcntl
+            import termios
+            buf = fcntl.ioctl(source.fd, termios.FIONREAD, b"\0\0\0\0")
+            return int.from_bytes(buf, sys.byteorder)
+        except Exception:
+            return None
+
+    def stats(self) -> Dict[str, object]:
+        fill = self._pipe_fill() if self._use_splice else self._head - self._tail
+        rate = self._rate if time.monotonic() - self._rate_started < 2.0 else 0.0
+        return {
+            "mode": "splice" if self._use_splice else "ring",
+            "buffer_size": self._size,
+            "buffer_fill": fill,
+            "buffer_fill_pct": round(100.0 * fill / self._size, 1) if fill is not None else None,
+            "batch_size": self._batch,
+            "sinks": len(self._sinks),
+            "bytes_in": self._bytes_in,
+            "bytes_out": self._bytes_out,
+            "bytes_per_sec": round(rate),
+            "realtime_ratio": round(rate / PCM_BYTES_PER_SEC, 3),
+            "read_stalls": self._read_stalls,
+            "write_stalls": self._write_stalls,
+            "max_write_ms": round(self._max_write_ms, 1),
+            "latency_ms": round(1000.0 * fill / PCM_BYTES_PER_SEC) if fill is not None else None,
+            "fill": None if self._use_splice else RELAY_FILL,
+            "underruns": self._underruns,
+            "underrun_ms": round(1000 * (self._underrun_seconds + (
+                time.monotonic() - self._underrun_since if self._underrun_since is not None else 0.0))),
+            "in_underrun": self._underrun_since is not None,
+            "filler_bytes": self._filler_bytes,
+            "dropped_bytes": self._dropped_bytes,
+            "clock_resets": self._clock_resets,
+            "loudness": self._dsp.stats() if self._dsp is not None else None,
+        }
+
+
+class _Singleton(type):
+    _instances: Dict[type, object] = {}
+    _lock = threading.Lock()
+
+    def __call__(cls, *args, **kwargs):
+        with cls._lock:
+            if cls not in cls._instances:
+                cls._instances[cls] = super(_Singleton, cls).__call__(*args, **kwargs)
+            return cls._instances[cls]
+
+
+PROGRESS_MAX_DRIFT = float(os.environ.get("PROGRESS_MAX_DRIFT", 2.0))  # Seconds behind real time before warning
+
+
+def _progress_number(value: Optional[str], suffix: str = "") -> Optional[float]:
+    """A number from a -progress value such as "1.02x" or "128.0kbits/s"; None for N/A"""
+    if not value:
+        return None
+    if suffix and value.endswith(suffix):
+        value = value[:-len(suffix)]
+    try:
+        return float(value)
+    except ValueError:
+        return None
+
+
+class ChangeNotifier:
+    """Lets any number of coroutines wait for the next change of something"""
+
+    def __init__(self) -> None:
+        self._event: Optional[asyncio.Event] = None
+
+    def notify(self) -> None:
+        if self._event is not None:
+            self._event.set()
+            self._event = None
+
+    async def wait(self, timeout: Optional[float] = None) -> bool:
+        """Wait for the next notify(); False on timeout"""
+        if self._event is None:
+            self._event = asyncio.Event()
+        try:
+            await asyncio.wait_for(self._event.wait(), timeout)
+            return True
+        except asyncio.TimeoutError:
+            return False
+
+
+EVENT_BACKLOG = 256  # Events kept for /api/events subscribers that reconnect or fall behind
+
+
+class EventBus:
+    """Numbered channel events (status, restart, switch) for /api/events.
+
+    Publishing only appends to a bounded deque and wakes the subscribers, so
+    any number of them cost nothing until something happens. Each subscriber
+    remembers the last number it has sent and picks up from there; one that
+    fell out of the backlog starts over from a snapshot. Only used from the
+    event loop, so it needs no lock.
+    """
+
+    def __init__(self, backlog: int = EVENT_BACKLOG) -> None:
+        self._events: deque = deque(maxlen=backlog)
+        self.seq = 0
+        self._published = ChangeNotifier()
+
+    def publish(self, kind: str, data: Dict[str, object]) -> None:
+        self.seq += 1
+        self._events.append((self.seq, kind, {"time": time.time(), **data}))
+        self._published.notify()
+
+    def since(self, seq: int) -> Optional[List[tuple]]:
+        """(seq, kind, data) of the events after seq; None if some of them are no longer kept"""
+        if seq > self.seq or (self._events and self._events[0][0] > seq + 1):
+            return None
+        return [event for event in self._events if event[0] > seq]
+
+    async def wait(self, timeout: Optional[float] = None) -> bool:
+        return await self._published.wait(timeout)
+
+
+event_bus = EventBus()
+
+
+class FFmpegProgress:
+    """Live telemetry of one FFmpeg, parsed incrementally from its -progress output.
+
+    FFmpeg writes blocks of key=value lines (every 0.5 s by default), each
+    ending with progress=continue or progress=end. drift_s is how far the
+    process has fallen behind the wall clock since its first block; it grows
+    whenever speed stays under 1.0x.
+    """
+
+    def __init__(self, channel_id: str, role: str, on_update=None) -> None:
+        self.channel_id = channel_id
+        self.role = role
+        self._on_update = on_update
+        self._partial = b""
+        self._block: Dict[str, str] = {}
+        self._first: Optional[tuple] = None  # (monotonic time, out_time) of the first block
+        self.updates = 0
+        self.updated_at: Optional[float] = None
+        self.out_time: Optional[float] = None
+        self.speed: Optional[float] = None
+        self.bitrate_kbps: Optional[float] = None
+        self.total_size: Optional[int] = None
+        self.dup_frames = 0
+        self.drop_frames = 0
+        self.drift = 0.0
+        self.lagging = False
+        self.ended = False
+
+    def feed(self, data: bytes) -> None:
+        lines = (self._partial + data).split(b"\n")
+        self._partial = lines.pop()
+        for line in lines:
+            key, sep, value = line.partition(b"=")
+            if not sep:
+                continue
+            key = key.strip().decode("ascii", "ignore")
+            value = value.strip().decode("ascii", "ignore")
+            if key == "progress":
+                self._complete(value == "end")
+            else:
+                self._block[key] = value
+
+    def _complete(self, ended: bool) -> None:
+        block, self._block = self._block, {}
+        now = time.monotonic()
+        out_us = _progress_number(block.get("out_time_us"))
+        self.out_time = out_us / 1e6 if out_us is not None and out_us >= 0 else self.out_time
+        self.speed = _progress_number(block.get("speed"), "x")
+        self.bitrate_kbps = _progress_number(block.get("bitrate"), "kbits/s")
+        size = _progress_number(block.get("total_size"))
+        self.total_size = int(size) if size is not None else self.total_size
+        self.dup_frames = int(_progress_number(block.get("dup_frames")) or 0)
+        self.drop_frames = int(_progress_number(block.get("drop_frames")) or 0)
+        if self.out_time is not None:
+            if self._first is None:
+                self._first = (now, self.out_time)
+            else:
+                self.drift = (now - self._first[0]) - (self.out_time - self._first[1])
+        if self.drift > PROGRESS_MAX_DRIFT and not self.lagging:
+            self.lagging = True
+            logger.warning(f"[{self.channel_id}] {self.role} is {self.drift:.1f}s behind real time (speed {self.speed}x)")
+        elif self.lagging and self.drift < PROGRESS_MAX_DRIFT / 2:
+            self.lagging = False
+            logger.info(f"[{self.channel_id}] {self.role} caught up with real time")
+        self.updates += 1
+        self.updated_at = now
+        self.ended = ended
+        if self._on_update is not None:
+            self._on_update()
+
+    def snapshot(self) -> Dict[str, object]:
+        return {
+            "out_time_s": round(self.out_time, 3) if self.out_time is not None else None,
+            "speed": self.speed,
+            "bitrate_kbps": self.bitrate_kbps,
+            "total_size": self.total_size,
+            "dup_frames": self.dup_frames,
+            "drop_frames": self.drop_frames,
+            "drift_s": round(self.drift, 3),
+            "lagging": self.lagging,
+            "updates": self.updates,
+            "updated_s_ago": round(time.monotonic() - self.updated_at, 1) if self.updated_at is not None else None,
+            "ended": self.ended,
+        }
+
+
+FFMPEG_LOGLEVEL = os.environ.get("FFMPEG_LOGLEVEL", "warning")  # Least severe FFmpeg messages kept in the logs
+if FFMPEG_LOGLEVEL not in ("quiet", "panic", "fatal", "error", "warning", "info", "verbose", "debug", "trace"):
+    raise ValueError("FFMPEG_LOGLEVEL must be an FFmpeg log level name, e.g. warning")
+LOG_LINES = int(os.environ.get("LOG_LINES", 200))  # stderr lines kept per FFmpeg process
+LOG_PROCESSES = int(os.environ.get("LOG_PROCESSES", 8))  # Recent processes per channel whose lines are kept
+LOG_LEVELS = ("debug", "info", "warning", "error", "fatal")  # Least to most severe
+LOG_LINE_MAX = 4096  # Longer stderr lines are cut to this many bytes
+_LOG_RANKS = {level: rank for rank, level in enumerate(LOG_LEVELS)}
+_FFMPEG_LEVELS = {b"trace": "debug", b"debug": "debug", b"verbose": "debug", b"info": "info",
+                  b"warning": "warning", b"error": "error", b"fatal": "fatal", b"panic": "fatal"}
+_log_seq = itertools.count(1)  # Orders lines across processes
+
+
+def _ffmpeg_level(line: bytes) -> tuple:
+    """(level, start, end of its tag) of a line FFmpeg wrote with -loglevel level+...
+
+    The tag is either first ("[error] ...") or after the component ("[aac @ 0x...] [warning] ...").
+    """
+    start = 0
+    for _ in range(2):
+        if not line.startswith(b"[", start):
+            break
+        end = line.find(b"] ", start)
+        if end < 0:
+            break
+        level = _FFMPEG_LEVELS.get(line[start + 1:end])
+        if level is not None:
+            return level, start, end + 2
+        start = end + 2
+    return "info", 0, 0
+
+
+class ProcessLog:
+    """The last LOG_LINES stderr lines of one FFmpeg, with their time and level.
+
+    Lines are kept as the bytes FFmpeg wrote: the stderr reader only looks up
+    the level tag and appends, and nothing is decoded until someone asks
+    for the lines.
+    """
+
+    def __init__(self, role: str, on_line=None, size: int = LOG_LINES) -> None:
+        self.role = role
+        self.pid: Optional[int] = None
+        self._on_line = on_line
+        self._lines: deque = deque(maxlen=size)  # (seq, time, level, line, start, end of the level tag)
+
+    def append(self, line: bytes) -> tuple:
+        """Keep a stderr line; returns its entry"""
+        level, start, end = _ffmpeg_level(line)
+        entry = (next(_log_seq), time.time(), level, line, start, end)
+        self._lines.append(entry)
+        if self._on_line is not None:
+            self._on_line()
+        return entry
+
+    @property
+    def seq(self) -> int:
+        """Number of the newest line kept (0 if none)"""
+        return self._lines[-1][0] if self._lines else 0
+
+    def since(self, seq: int) -> List[tuple]:
+        """The kept lines numbered after seq, oldest first"""
+        found = []
+        for entry in reversed(self._lines):
+            if entry[0] <= seq:
+                break
+            found.append(entry)
+        found.reverse()
+        return found
+
+    @staticmethod
+    def message(entry: tuple) -> str:
+        """The line without its level tag"""
+        _, _, _, line, start, end = entry
+        return (line[:start] + line[end:]).decode("utf-8", errors="replace").rstrip()
+
+    def describe(self, entry: tuple) -> Dict[str, object]:
+        return {"seq": entry[0], "time": entry[1], "pid": self.pid, "role": self.role, "level": entry[2],
+                "message": self.message(entry)}
+
+    def errors(self, n: int = 5) -> List[str]:
+        """The last n error and fatal messages"""
+        found = []
+        for entry in reversed(self._lines):
+            if len(found) == n:
+                break
+            if entry[2] in ("error", "fatal"):
+                found.append(self.message(entry))
+        found.reverse()
+        return found
+
+
+class LogBook:
+    """A channel's ProcessLogs: its last LOG_PROCESSES FFmpegs, including the feeds it used"""
+
+    def __init__(self, processes: int = LOG_PROCESSES) -> None:
+        self._logs: deque = deque(maxlen=processes)
+        self.updates = ChangeNotifier()  # Fires on each new line
+
+    def open(self, role: str) -> ProcessLog:
+        """A log for a new process of this channel"""
+        log = ProcessLog(role, self.updates.notify)
+        self._logs.append(log)
+        return log
+
+    def add(self, log: ProcessLog) -> None:
+        """Include a process shared with other channels (a feed)"""
+        if log not in self._logs:
+            self._logs.append(log)
+            self.updates.notify()
+
+    @property
+    def seq(self) -> int:
+        """Number of the newest line of any of the processes"""
+        return max((log.seq for log in self._logs), default=0)
+
+    def lines(self, since: int = 0, level: str = "debug", tail: Optional[int] = None) -> List[Dict[str, object]]:
+        """Lines numbered after since at level or above, oldest first; the last tail of them if given"""
+        rank = _LOG_RANKS[level]
+        found = [(entry, log) for log in list(self._logs) for entry in log.since(since)
+                 if _LOG_RANKS[entry[2]] >= rank]
+        found.sort(key=lambda item: item[0][0])
+        if tail is not None:
+            found = found[max(0, len(found) - tail):]
+        return [log.describe(entry) for entry, log in found]
+
+
+class FFmpegProcess:
+    """An FFmpeg child started on the event loop, with our ends of its pipes.
+
+    The pipes are plain non-blocking fds that the relay, the hub and the
+    progress parser register with the loop, so neither the audio nor the
+    telemetry goes through asyncio streams or extra threads.
+    """
+
+    def __init__(self, proc: asyncio.subprocess.Process, stdin_fd: Optional[int] = None,
+                 stdout_fd: Optional[int] = None, progress_fd: Optional[int] = None,
+                 progress: Optional[FFmpegProgress] = None, log: Optional[ProcessLog] = None) -> None:
+        self.proc = proc
+        self.pid = proc.pid
+        self.stdin_fd = stdin_fd
+        self.stdout_fd = stdout_fd
+        self.progress_fd = progress_fd
+        self.progress = progress
+        self.log = log or ProcessLog("ffmpeg")
+        self.log.pid = proc.pid
+        self.task: Optional[asyncio.Task] = None  # Watches stderr and the exit
+        self.stopping = False  # Killed on purpose, so the exit is not a crash
+        self._loop = asyncio.get_running_loop()
+        if progress_fd is not None:
+            self._loop.add_reader(progress_fd, self._read_progress)
+
+    def running(self) -> bool:
+        return self.proc.returncode is None
+
+    def _read_progress(self) -> None:
+        try:
+            data = os.read(self.progress_fd, 4096)
+        except BlockingIOError:
+            return
+        except OSError:
+            data = b""
+        if not data:
+            self._loop.remove_reader(self.progress_fd)
+            return
+        if self.progress is not None:
+            self.progress.feed(data)
+
+    def close_pipes(self) -> None:
+        """Close our pipe ends once nothing on the loop watches them any more"""
+        if self.progress_fd is not None:
+            self._loop.remove_reader(self.progress_fd)
+        for name in ("stdin_fd", "stdout_fd", "progress_fd"):
+            fd = getattr(self, name)
+            if fd is not None:
+                setattr(self, name, None)
+                try:
+                    os.close(fd)
+                except OSError:
+                    pass
+
+
+# The event loop carries every channel's audio clock, so when the CPU is short
+# it should win against the FFmpegs rather than share with each of them
+FFMPEG_NICE = int(os.environ.get("FFMPEG_NICE", 10))
+_pidfd_watcher: Optional[tuple] = None  # (watcher, loop) on Python < 3.12
+
+
+def _use_pidfd_watcher(loop: asyncio.AbstractEventLoop) -> None:
+    """Reap children through pidfds on the loop instead of a waitpid thread per child.
+
+    Python 3.12+ already does this; before that the default watcher starts a
+    thread for every process, which would undo most of the savings here.
+    """
+    global _pidfd_watcher
+    if sys.version_info >= (3, 12) or not isinstance(loop, asyncio.SelectorEventLoop):
+        return
+    if _pidfd_watcher is not None and _pidfd_watcher[1] is loop:
+        return
+    try:
+        os.close(os.pidfd_open(os.getpid()))
+    except (AttributeError, OSError):
+        return
+    watcher = asyncio.PidfdChildWatcher()
+    watcher.attach_loop(loop)
+    asyncio.set_child_watcher(watcher)
+    _pidfd_watcher = (watcher, loop)
+
+
+async def spawn_ffmpeg(cmd: List[str], pipe_stdin: bool = False, pipe_stdout: bool = False,
+                       progress: Optional[FFmpegProgress] = None,
+                       log: Optional[ProcessLog] = None) -> FFmpegProcess:
+    """Start FFmpeg with raw pipes for its audio; stderr stays an asyncio stream for watch_process.
+
+    With progress given, FFmpeg also writes -progress telemetry to a pipe of
+    its own, which is parsed into it. watch_process keeps stderr in log.
+    """
+    loop = asyncio.get_running_loop()
+    _use_pidfd_watcher(loop)
+    child_fds: List[int] = []
+    stdin_fd = stdout_fd = progress_fd = None
+    try:
+        stdin = stdout = subprocess.DEVNULL
+        if pipe_stdin:
+            stdin, stdin_fd = os.pipe()
+            child_fds.append(stdin)
+        if pipe_stdout:
+            stdout_fd, stdout = os.pipe()
+            child_fds.append(stdout)
+        if progress is not None:
+            progress_fd, progress_child = os.pipe()
+            child_fds.append(progress_child)
+            cmd = [cmd[0], "-progress", f"pipe:{progress_child}"] + cmd[1:]
+        proc = await asyncio.create_subprocess_exec(
+            *cmd,
+            stdin=stdin,
+            stdout=stdout,
+            stderr=subprocess.PIPE,
+            pass_fds=child_fds[-1:] if progress is not None else (),
+            creationflags=subprocess.CREATE_NO_WINDOW if os.name == 'nt' else 0,
+        )
+    except BaseException:
+        for fd in (stdin_fd, stdout_fd, progress_fd):
+            if fd is not None:
+                os.close(fd)
+        raise
+    finally:
+        for fd in child_fds:
+            os.close(fd)
+    for fd in (stdin_fd, stdout_fd, progress_fd):
+        if fd is not None:
+            os.set_blocking(fd, False)
+    if FFMPEG_NICE and hasattr(os, "setpriority"):
+        try:
+            os.setpriority(os.PRIO_PROCESS, proc.pid, FFMPEG_NICE)
+        except OSError:
+            pass
+    state_store.track(proc.pid)
+    return FFmpegProcess(proc, stdin_fd, stdout_fd, progress_fd, progress, log)
+
+
+async def watch_process(ff: FFmpegProcess, channel_id: str, label: str) -> tuple:
+    """Keep a process's stderr in its log and log its errors until it exits; returns (exit code, last errors)"""
+    log = ff.log
+    stderr = ff.proc.stderr
+    overlong = False  # In the middle of a line too long for the stream's buffer
+    # Read until EOF whatever the lines look like: FFmpeg blocks once its stderr pipe is full
+    while True:
+        try:
+            line = await stderr.readuntil(b"\n")
+        except asyncio.IncompleteReadError as e:
+            line = e.partial  # EOF, maybe after a last line with no newline
+            if not line or overlong:
+                break
+        except asyncio.LimitOverrunError as e:
+            # Keep what fits of the first part, skip the rest of the line
+            part = await stderr.read(e.consumed)
+            if not overlong and part:
+                overlong = True
+                line = part
+            else:
+                continue
+        except OSError as e:
+            logger.error(f"[{channel_id}] Error reading {label} stderr: {e}")
+            break
+        else:
+            if overlong:
+                overlong = False
+                continue
+        if line.isspace():
+            continue
+        entry = log.append(line[:LOG_LINE_MAX])
+        if entry[2] in ("error", "fatal"):
+            logger.error(f"[{channel_id}] {label}: {ProcessLog.message(entry)}")
+    exit_code = await ff.proc.wait()
+    state_store.untrack(ff.pid)
+    return exit_code, log.errors()
+
+
+async def kill_process(ff: Optional[FFmpegProcess], channel_id: str, role: str) -> None:
+    """Force-kill a process, reap it and close our ends of its pipes"""
+    if ff is None:
+        return
+    ff.stopping = True
+    if ff.running():
+        logger.info(f"[{channel_id}] Stopping {role} process (PID: {ff.pid})")
+        try:
+            ff.proc.kill()
+            await asyncio.wait_for(ff.proc.wait(), 1)
+        except ProcessLookupError:
+            pass
+        except asyncio.TimeoutError:
+            logger.error(f"[{channel_id}] {role} process (PID: {ff.pid}) did not exit after kill")
+        except Exception as e:
+            logger.error(f"[{channel_id}] Error stopping {role}: {e}")
+    if not ff.running():
+        state_store.untrack(ff.pid)
+    ff.close_pipes()
+
+
+# Restarting crashed FFmpeg processes (see RestartPolicy)
+RESTART_MAX_RETRIES = int(os.environ.get("RESTART_MAX_RETRIES", 5))  # Quick failures in a row before giving up
+RESTART_BASE_DELAY = float(os.environ.get("RESTART_BASE_DELAY", 1.0))
+RESTART_MAX_DELAY = float(os.environ.get("RESTART_MAX_DELAY", 30.0))
+RESTART_JITTER = 0.25  # Each delay is randomized by +/- this fraction so channels do not retry in lockstep
+RESTART_HEALTHY_AFTER = float(os.environ.get("RESTART_HEALTHY_AFTER", 30.0))  # Uptime that counts as recovered
+RESTART_CIRCUIT_COOLDOWN = float(os.environ.get("RESTART_CIRCUIT_COOLDOWN", 300.0))  # 0 = wait for a manual start
+
+
+class RestartPolicy:
+    """Exponential backoff with jitter and a circuit breaker for one supervised process.
+
+    Every exit counts as a failure; one that comes after RESTART_HEALTHY_AFTER
+    of uptime starts the backoff over. After more than RESTART_MAX_RETRIES
+    failures in a row the circuit opens: restarts stop for
+    RESTART_CIRCUIT_COOLDOWN, then a single trial restart is made (half-open)
+    and the circuit closes again only if that one stays up.
+    """
+
+    CLOSED = "closed"
+    OPEN = "open"
+    HALF_OPEN = "half_open"
+
+    def __init__(self, max_retries: int = RESTART_MAX_RETRIES, base_delay: float = RESTART_BASE_DELAY,
+                 max_delay: float = RESTART_MAX_DELAY, jitter: float = RESTART_JITTER,
+                 healthy_after: float = RESTART_HEALTHY_AFTER, cooldown: float = RESTART_CIRCUIT_COOLDOWN) -> None:
+        self.max_retries = max_retries
+        self.base_delay = base_delay
+        self.max_delay = max_delay
+        self.jitter = jitter
+        self.healthy_after = healthy_after
+        self.cooldown = cooldown
+        self.restarts = 0
+        self.last_exit: Optional[int] = None
+        self.last_error: Optional[str] = None
+        self.reset()
+
+    def reset(self) -> None:
+        """Forget earlier failures (a manual start); the lifetime counters are kept"""
+        self.failures = 0
+        self.circuit = self.CLOSED
+        self._started_at: Optional[float] = None
+        self._next_at: Optional[float] = None
+
+    def started(self) -> None:
+        self._started_at = time.monotonic()
+        self._next_at = None
+
+    def attempt(self) -> None:
+        """A restart is being made now"""
+        self.restarts += 1
+        if self.circuit == self.OPEN:
+            self.circuit = self.HALF_OPEN
+
+    def exited(self, exit_code: Optional[int], error: Optional[str]) -> Optional[float]:
+        """Record an exit (or failed start); returns the delay before the next restart, or None to give up"""
+        now = time.monotonic()
+        self.last_exit = exit_code
+        self.last_error = error
+        if self._started_at is not None and now - self._started_at >= self.healthy_after:
+            self.failures = 0
+            self.circuit = self.CLOSED
+        self._started_at = None
+        self.failures += 1
+        if self.circuit == self.HALF_OPEN or self.failures > self.max_retries:
+            self.circuit = self.OPEN
+            if self.cooldown <= 0:
+                self._next_at = None
+                return None
+            delay = self.cooldown
+        else:
+            delay = min(self.max_delay, self.base_delay * 2 ** (self.failures - 1))
+            delay *= 1.0 + random.uniform(-self.jitter, self.jitter)
+        self._next_at = now + delay
+        return delay
+
+    def status(self, running: bool) -> Dict[str, object]:
+        now = time.monotonic()
+        if running and self._started_at is not None and now - self._started_at >= self.healthy_after:
+            self.failures = 0
+            self.circuit = self.CLOSED
+        return {
+            "restarts": self.restarts,
+            "failures": self.failures,
+            "circuit": self.circuit,
+            "last_exit": self.last_exit,
+            "last_error": self.last_error,
+            "next_restart_s": round(max(0.0, self._next_at - now), 1) if self._next_at is not None else None,
+        }
+
+
+# How every FFmpeg that pulls a station opens it
+SOURCE_INPUT_ARGS = [
+    "-re",
+    "-reconnect", "1",
+    "-reconnect_at_eof", "1",
+    "-reconnect_streamed", "1",
+    "-reconnect_delay_max", "2",
+]
+
+# Encoder presets for /api/start "profile"; fields left out of a custom profile come from its preset
+ENCODER_PROFILES: Dict[str, Dict[str, Any]] = {
+    "standard": {"codec": "aac", "bitrate_kbps": 128, "sample_rate": 44100, "mono": False},
+    "low": {"codec": "aac", "bitrate_kbps": 64, "sample_rate": 44100, "mono": False},
+    "voice": {"codec": "aac", "bitrate_kbps": 48, "sample_rate": 44100, "mono": True},
+    "he-aac": {"codec": "he-aac", "bitrate_kbps": 48, "sample_rate": 44100, "mono": False},
+    "he-aac-v2": {"codec": "he-aac-v2", "bitrate_kbps": 32, "sample_rate": 44100, "mono": False},
+    "passthrough": {"codec": "copy", "bitrate_kbps": None, "sample_rate": None, "mono": None},  # Direct mode only
+}
+ENCODER_PROFILE = os.environ.get("ENCODER_PROFILE", "standard")  # Preset for channels started without a profile
+if ENCODER_PROFILE not in ENCODER_PROFILES or ENCODER_PROFILES[ENCODER_PROFILE]["codec"] == "copy":
+    raise ValueError(f"ENCODER_PROFILE must be one of {', '.join(p for p in ENCODER_PROFILES if p != 'passthrough')}")
+ENCODER_CODECS = {
+    "aac": ["-c:a", "aac"],
+    "he-aac": ["-c:a", "libfdk_aac", "-profile:a", "aac_he"],
+    "he-aac-v2": ["-c:a", "libfdk_aac", "-profile:a", "aac_he_v2"],  # Parametric stereo: stereo only
+    "copy": ["-c:a", "copy"],  # The station's MP3 as it is; the ingest has to take MP3 in FLV
+}
+ENCODER_SAMPLE_RATES = (22050, 24000, 32000, 44100, 48000)
+ENCODER_MAX_KBPS = 320
+MODE_RELAY = "relay"  # Feed FFmpeg -> relay -> one encoder per destination; gapless switching and failover
+MODE_DIRECT = "direct"  # One FFmpeg per destination pulls and encodes the station; a switch restarts it
+
+FFMPEG_NOT_FOUND = "FFmpeg not found in PATH"
+_ffmpeg_info: Optional[Dict[str, Any]] = None
+_ffmpeg_checking: Optional[asyncio.Future] = None
+
+
+def _ffmpeg_table(out: bytes) -> List[tuple]:
+    """(flags, name) rows of an `ffmpeg -encoders` or `-muxers` listing, after its legend"""
+    rows = []
+    listing = False
+    for line in out.decode("utf-8", errors="ignore").splitlines():
+        fields = line.split()
+        if not listing:
+            listing = bool(fields) and fields[0].startswith("--")
+        elif len(fields) > 1:
+            rows.append((fields[0], fields[1]))
+    return rows
+
+
+async def _ffmpeg_output(*args: str) -> bytes:
+    proc = await asyncio.create_subprocess_exec("ffmpeg", "-hide_banner", *args,
+                                                stdout=subprocess.PIPE, stderr=subprocess.DEVNULL)
+    out, _ = await proc.communicate()
+    return out
+
+
+async def _check_ffmpeg() -> Dict[str, Any]:
+    global _ffmpeg_info
+    info: Dict[str, Any] = {"path": shutil.which("ffmpeg"), "version": None, "encoders": set(), "muxers": set()}
+    if info["path"] is not None:
+        try:
+            version, encoders, muxers = await asyncio.gather(
+                _ffmpeg_output("-version"), _ffmpeg_output("-encoders"), _ffmpeg_output("-muxers"))
+        except OSError:
+            info["path"] = None
+        else:
+            first = version.split(b"\n", 1)[0].split()
+            info["version"] = first[2].decode("ascii", "ignore") if len(first) > 2 else None
+            info["encoders"] = {name for flags, name in _ffmpeg_table(encoders) if flags.startswith("A")}
+            info["muxers"] = {name for flags, name in _ffmpeg_table(muxers) if "E" in flags}
+    _ffmpeg_info = info
+    return info
+
+
+async def ffmpeg_info() -> Dict[str, Any]:
+    """Path, version, audio encoders and muxers of the installed FFmpeg (path None if there is none).
+
+    Checked once per server run; callers arriving while the check runs wait for the same one.
+    """
+    global _ffmpeg_checking
+    if _ffmpeg_info is not None:
+        return _ffmpeg_info
+    if _ffmpeg_checking is None or _ffmpeg_checking.get_loop() is not asyncio.get_running_loop():
+        _ffmpeg_checking = asyncio.ensure_future(_check_ffmpeg())
+    return await asyncio.shield(_ffmpeg_checking)
+
+
+async def ffmpeg_missing(profile: Dict[str, Any]) -> Optional[str]:
+    """Why the installed FFmpeg cannot stream with this encoder profile, or None if it can"""
+    info = await ffmpeg_info()
+    if info["path"] is None:
+        return FFMPEG_NOT_FOUND
+    encoder = ENCODER_CODECS[profile["codec"]][1]
+    if encoder != "copy" and encoder not in info["encoders"]:
+        if encoder == "libfdk_aac":
+            return "HE-AAC needs an FFmpeg built with libfdk_aac"
+        return f"FFmpeg has no {encoder} encoder"
+    # FLV for RTMP, tee to also feed the HTTP hub, in the hub's format
+    missing = [name for name in ("flv", "tee", "mp3" if encoder == "copy" else "adts") if name not in info["muxers"]]
+    if missing:
+        return f"FFmpeg has no {', '.join(missing)} muxer"
+    return None
+
+
+def encoder_args(profile: Dict[str, Any]) -> List[str]:
+    """FFmpeg output options for an encoder profile"""
+    args = list(ENCODER_CODECS[profile["codec"]])
+    if profile["codec"] != "copy":
+        args += ["-b:a", f"{profile['bitrate_kbps']}k", "-ar", str(profile["sample_rate"]),
+                 "-ac", "1" if profile["mono"] else "2"]
+    return args
+
+
+class Destination:
+    """One RTMP output of a channel: a main FFmpeg encoding the channel's relayed PCM.
+
+    Each destination has its own encoder, so one failing ingest neither stops
+    nor reconnects the others; a destination whose encoder dies is restarted
+    on its own, as its RestartPolicy allows. With source_url set (direct
+    mode) the encoder pulls the station itself instead of reading the relay,
+    so the channel needs no feed process and no PCM round trip; its restarts
+    then also cover the station dropping.
+    """
+
+    def __init__(self, channel_id: str, rtmp_url: str, relay: PcmRelay, hub: Optional[BroadcastHub] = None,
+                 on_progress=None, on_change=None, profile: Optional[Dict[str, Any]] = None,
+                 source_url: Optional[str] = None, logs: Optional[LogBook] = None) -> None:
+        self.channel_id = channel_id
+        self.rtmp_url = rtmp_url
+        self._relay = relay
+        self.hub = hub  # Also send the encoded audio to the channel's HTTP listeners
+        self.profile = profile or ENCODER_PROFILES[ENCODER_PROFILE]
+        self.source_url = source_url
+        self.role = "direct" if source_url else "main"
+        self._on_progress = on_progress
+        self._on_change = on_change or (lambda: None)  # Called when the encoder stops or (re)starts
+        self._logs = logs or LogBook(1)  # Where each encoder's stderr is kept
+        self._lock = asyncio.Lock()
+        self._process: Optional[FFmpegProcess] = None
+        self._wanted = False
+        self.policy = RestartPolicy()
+
+    def is_running(self) -> bool:
+        return self._process is not None and self._process.running()
+
+    async def start(self) -> bool:
+        async with self._lock:
+            self._wanted = True
+            if self.is_running():
+                return True
+            self.policy.reset()
+            return await self._spawn()
+
+    async def stop(self) -> None:
+        async with self._lock:
+            self._wanted = False
+            proc, self._process = self._process, None
+        if proc is None:
+            return
+        self._release(proc)
+        await kill_process(proc, self.channel_id, self.role)
+
+    def _release(self, proc: FFmpegProcess) -> None:
+        """Unhook the encoder's pipes from the relay and the hub (no-op once they are closed)"""
+        if proc.stdin_fd is not None:
+            self._relay.remove_sink(self, proc.stdin_fd)
+        if self.hub is not None:
+            self.hub.stop_pump(proc.stdout_fd)
+
+    @property
+    def label(self) -> str:
+        return "Direct FFmpeg" if self.source_url else "Main FFmpeg"
+
+    async def _spawn(self) -> bool:
+        """Start the encoder (caller holds the lock)"""
+        if self.source_url:
+            # Direct FFmpeg pulls the station itself
+            cmd = (["ffmpeg", "-loglevel", f"level+{FFMPEG_LOGLEVEL}", "-nostats"]
+                   + SOURCE_INPUT_ARGS + ["-i", self.source_url])
+        else:
+            # Main FFmpeg reads from stdin pipe and streams to RTMP
+            cmd = [
+                "ffmpeg",
+                "-loglevel", f"level+{FFMPEG_LOGLEVEL}",
+                "-nostats",
+                "-f", "s16le",  # Input format: raw PCM
+                "-ar", "44100",  # Sample rate
+                "-ac", "2",  # Channels
+                # Raw PCM has nothing to probe; without these FFmpeg waits for seconds of it before encoding
+                "-probesize", "32",
+                "-analyzeduration", "0",
+                "-i", "pipe:0",  # Read from stdin
+            ]
+        cmd += ["-vn"] + encoder_args(self.profile) + ["-flags", "+low_delay", "-fflags", "nobuffer"]
+        if self.hub is not None:
+            # Same encode, muxed twice: FLV to RTMP and ADTS (MP3 when passed through) to stdout for the HTTP hub
+            self.hub.format = "mp3" if self.profile["codec"] == "copy" else "adts"
+            rtmp = self.rtmp_url.replace("\\", "\\\\").replace("'", "\\'").replace("|", "\\|")
+            cmd += ["-map", "0:a", "-f", "tee", f"[f=flv]{rtmp}|[f={self.hub.format}:onfail=ignore]pipe:1"]
+        else:
+            cmd += ["-f", "flv", self.rtmp_url]
+
+        try:
+            proc = await spawn_ffmpeg(cmd, pipe_stdin=not self.source_url, pipe_stdout=self.hub is not None,
+                                      progress=FFmpegProgress(self.channel_id, self.label, self._on_progress),
+                                      log=self._logs.open(self.role))
+        except FileNotFoundError:
+            logger.error(f"[{self.channel_id}] FFmpeg not found in PATH")
+            return False
+        except Exception as e:
+            logger.error(f"[{self.channel_id}] Failed to start {self.label}: {e}")
+            return False
+        self._process = proc
+        self.policy.started()
+        if proc.stdin_fd is not None:
+            self._relay.add_sink(self, proc.stdin_fd)
+        if self.hub is not None:
+            self.hub.pump(proc.stdout_fd)
+        logger.info(f"[{self.channel_id}] {self.label} process started with PID: {proc.pid} -> {self.rtmp_url[:50]}...")
+        proc.task = asyncio.create_task(self._monitor(proc))
+        return True
+
+    async def _monitor(self, proc: FFmpegProcess) -> None:
+        """Log the encoder's errors and restart it if it dies while still wanted"""
+        try:
+            exit_code, error_lines = await watch_process(proc, self.channel_id, self.label)
+            self._release(proc)
+            proc.close_pipes()
+            if proc.stopping or not self._wanted or self._process is not proc:
+                logger.info(f"[{self.channel_id}] Main stream stopped")
+                return
+            delay = self.policy.exited(exit_code, error_lines[-1] if error_lines else None)
+            if exit_code != 0:
+                logger.error(f"[{self.channel_id}] {self.label} process exited with code {exit_code}")
+                if error_lines:
+                    logger.error(f"[{self.channel_id}] Last errors: {error_lines}")
+            else:
+                logger.warning(f"[{self.channel_id}] {self.label} process exited normally")
+            self._exited(delay)
+            await self._restart(proc, delay)
+        except Exception as e:
+            logger.error(f"[{self.channel_id}] Error monitoring main process: {e}")
+
+    def _exited(self, delay: Optional[float]) -> None:
+        event_bus.publish("restart", {"channel": self.channel_id, "role": self.role, "rtmp": self.rtmp_url,
+                                      "exit_code": self.policy.last_exit, "error": self.policy.last_error,
+                                      "failures": self.policy.failures, "circuit": self.policy.circuit,
+                                      "delay_s": round(delay, 1) if delay is not None else None})
+        self._on_change()
+
+    async def _restart(self, dead: Optional[FFmpegProcess], delay: Optional[float]) -> None:
+        while True:
+            if delay is None:
+                logger.error(f"[{self.channel_id}] Encoder for {self.rtmp_url[:50]}... failed {self.policy.failures} "
+                             f"times in a row, not restarting until the next start")
+                return
+            logger.info(f"[{self.channel_id}] Restarting encoder for {self.rtmp_url[:50]}... in {delay:.1f}s "
+                        f"(failure {self.policy.failures}, circuit {self.policy.circuit})")
+            await asyncio.sleep(delay)
+            async with self._lock:
+                if not self._wanted or self._process is not dead:
+                    return
+                self.policy.attempt()
+                if await self._spawn():
+                    self._on_change()
+                    return
+                self._process = dead = None
+                delay = self.policy.exited(None, "failed to start")
+                self._exited(delay)
+
+    def summary(self) -> Dict[str, object]:
+        """The part of status() that changes only when the encoder starts, stops or restarts"""
+        status = self.status()
+        return {key: status[key] for key in ("rtmp", "role", "running", "pid", "restarts", "failures", "circuit",
+                                             "last_exit", "last_error")}
+
+    def on_air(self) -> bool:
+        """Whether the encoder has put out audio since it (re)started"""
+        proc = self._process
+        return proc is not None and proc.progress is not None and bool(proc.progress.out_time)
+
+    def status(self) -> Dict[str, object]:
+        proc = self._process
+        return {
+            "rtmp": self.rtmp_url,
+            "role": self.role,
+            "running": self.is_running(),
+            "pid": proc.pid if proc is not None else None,
+            **self.policy.status(self.is_running()),
+            **self._relay.sink_stats(self),
+            "progress": proc.progress.snapshot() if proc is not None and proc.progress is not None else None,
+        }
+
+
+# Feeds shared between channels playing the same station (see SourcePool)
+SOURCE_GRACE_S = float(os.environ.get("SOURCE_GRACE_S", 60.0))  # Keep a feed no channel uses decoding this long
+SOURCE_HISTORY_BYTES = 128 * 1024  # Newest audio a feed keeps for channels that join it (~0.7 s)
+SOURCE_READ_SIZE = 64 * 1024
+SOURCE_HOT_SECONDS = 0.5  # A feed that delivered audio this recently can be joined without waiting
+
+
+class SharedFeed:
+    """A feed FFmpeg decoding one stream URL to PCM for every channel playing it.
+
+    The feed reads its pipe with readv() into a small ring of recent audio and
+    pushes each frame-aligned chunk to its subscribers (the channels' relays),
+    so one decoder serves any number of encoders. A relay that joins a feed
+    which is already running is handed the newest audio as its prebuffer, so
+    the cut-over needs no wait. The feed restarts itself when it dies, as its
+    RestartPolicy allows, for as long as a channel holds it. A private feed
+    (RELAY_SPLICE) reads nothing and hands its pipe to its single subscriber.
+
+    Every method must be called from the event loop.
+    """
+
+    def __init__(self, url: str, name: Optional[str] = None, private: bool = False) -> None:
+        self.url = url
+        self.name = name or url
+        self.private = private
+        self.process: Optional[FFmpegProcess] = None
+        self.policy = RestartPolicy()
+        self.starting: Optional[asyncio.Future] = None  # First start, shared by everyone acquiring meanwhile
+        self.closed = False
+        self.last_data: Optional[float] = None  # Loop time of the last audio pushed
+        self._owners: Dict[object, int] = {}  # Channels holding the feed, with their reference counts
+        self._subscribers: Dict[object, object] = {}  # Relay sources -> push callback
+        self._fd_subscribers: Dict[object, object] = {}  # Private feed: relay source -> on_fd callback
+        self._waiters: List[tuple] = []  # (pushed byte count to wait for, future)
+        self._buf = bytearray(SOURCE_HISTORY_BYTES)
+        self._view = memoryview(self._buf)
+        # Total bytes read from the pipe / pushed to subscribers; they differ by a partial frame at most
+        self._head = 0
+        self._pushed = 0
+        self._loop = asyncio.get_running_loop()
+
+    @property
+    def refs(self) -> int:
+        return sum(self._owners.values())
+
+    @property
+    def channels(self) -> int:
+        return len(self._owners)
+
+    def running(self) -> bool:
+        return self.process is not None and self.process.running()
+
+    def failure(self) -> Optional[str]:
+        """How the decoder exited (code and last errors from its stderr), or None while it runs"""
+        proc = self.process
+        if proc is None or proc.proc.returncode is None:
+            return None
+        errors = proc.log.errors(3)
+        return f"exited with code {proc.proc.returncode}" + (f": {' | '.join(errors)}" if errors else "")
+
+    def hot(self) -> bool:
+        """Whether the feed is delivering audio right now"""
+        return self.last_data is not None and self._loop.time() - self.last_data < SOURCE_HOT_SECONDS
+
+    def hold(self, owner) -> None:
+        self._owners[owner] = self._owners.get(owner, 0) + 1
+
+    def drop(self, owner) -> None:
+        count = self._owners.get(owner, 0) - 1
+        if count > 0:
+            self._owners[owner] = count
+        else:
+            self._owners.pop(owner, None)
+
+    def subscribe(self, key, push=None, on_fd=None) -> None:
+        """Have push called with each new chunk of audio; a private feed calls on_fd with its pipe instead"""
+        if on_fd is not None:
+            self._fd_subscribers[key] = on_fd
+            if self.running():
+                on_fd(self.process.stdout_fd)
+        if push is not None:
+            self._subscribers[key] = push
+
+    def unsubscribe(self, key) -> None:
+        self._subscribers.pop(key, None)
+        self._fd_subscribers.pop(key, None)
+
+    def recent(self, nbytes: int) -> bytes:
+        """Copy of up to nbytes of the newest audio already pushed"""
+        size = len(self._buf)
+        n = min(nbytes, self._pushed, size - SOURCE_READ_SIZE)
+        n -= n % PCM_FRAME_BYTES
+        start = (self._pushed - n) % size
+        first = min(n, size - start)
+        return bytes(self._view[start:start + first]) + bytes(self._view[:n - first])
+
+    async def ready(self, nbytes: int, timeout: float, fresh: bool = False) -> bool:
+        """Wait until the feed delivers: at once if it is already (unless fresh), else until nbytes of new audio came in.
+
+        False if that takes longer than timeout or the process exits first.
+        """
+        target = nbytes if self.hot() and not fresh else self._pushed + nbytes
+        if self._pushed >= target:
+            return True
+        waiter = (target, self._loop.create_future())
+        self._waiters.append(waiter)
+        try:
+            return await asyncio.wait_for(waiter[1], timeout)
+        except asyncio.TimeoutError:
+            return False
+        finally:
+            self._waiters.remove(waiter)
+
+    async def audible(self, nbytes: int, timeout: float) -> bool:
+        """Like ready(), but only once nbytes in a row are not all silence"""
+        deadline = self._loop.time() + timeout
+        fresh = False
+        while await self.ready(nbytes, deadline - self._loop.time(), fresh):
+            if pcm_peak(memoryview(self.recent(nbytes))) > FAILOVER_SILENCE_LEVEL:
+                return True
+            fresh = True
+        return False
+
+    async def start(self) -> bool:
+        """Start the decoder; False if FFmpeg could not be started"""
+        ok = await self._spawn()
+        if ok:
+            self.policy.started()
+        return ok
+
+    async def retry(self) -> bool:
+        """Restart a dead feed now, forgetting earlier failures (someone asked for it)"""
+        self.policy.reset()
+        if self.running():
+            return True
+        await kill_process(self.process, self.name, "dead feed")
+        return await self.start()
+
+    async def close(self) -> None:
+        """Kill the decoder for good"""
+        self.closed = True
+        self._release_pipe()
+        await kill_process(self.process, self.name, "feed")
+
+    async def _spawn(self) -> bool:
+        cmd = [
+            "ffmpeg",
+            "-loglevel", f"level+{FFMPEG_LOGLEVEL}",
+            "-nostats",
+            *SOURCE_INPUT_ARGS,
+            "-i", self.url,
+            "-vn",
+            "-c:a", "pcm_s16le",  # Raw PCM 16-bit little-endian
+            "-ar", "44100",
+            "-ac", "2",
+            "-f", "s16le",  # Raw PCM format
+            "-",  # Output to stdout
+        ]
+        try:
+            proc = await spawn_ffmpeg(cmd, pipe_stdout=True,
+                                      progress=FFmpegProgress(self.name, "Feed FFmpeg", self._progress),
+                                      log=ProcessLog("feed", self._log_line))
+        except Exception as e:
+            logger.error(f"[{self.name}] Failed to start feed process: {e}")
+            return False
+        if self.closed:
+            await kill_process(proc, self.name, "feed")
+            return False
+        logger.info(f"[{self.name}] Feed process started with PID: {proc.pid}")
+        self.process = proc
+        for owner in list(self._owners):
+            owner.logs.add(proc.log)
+        # A new process starts on a frame boundary; drop any partial frame of the last one
+        self._head = self._pushed
+        if self.private:
+            for on_fd in list(self._fd_subscribers.values()):
+                on_fd(proc.stdout_fd)
+        else:
+            self._loop.add_reader(proc.stdout_fd, self._on_readable, proc)
+        proc.task = asyncio.create_task(self._monitor(proc))
+        return True
+
+    def _release_pipe(self) -> None:
+        """Stop everything on the loop from watching the feed's stdout, so it can be closed"""
+        proc = self.process
+        if proc is None or proc.stdout_fd is None:
+            return
+        if self.private:
+            for on_fd in list(self._fd_subscribers.values()):
+                on_fd(None)
+        else:
+            self._loop.remove_reader(proc.stdout_fd)
+
+    def _on_readable(self, proc: FFmpegProcess) -> None:
+        size = len(self._buf)
+        start = self._head % size
+        try:
+            got = os.readv(proc.stdout_fd, [self._view[start:start + min(SOURCE_READ_SIZE, size - start)]])
+        except BlockingIOError:
+            return
+        except OSError as e:
+            logger.error(f"[{self.name}] Error reading feed: {e}")
+            got = 0
+        if not got:
+            self._loop.remove_reader(proc.stdout_fd)
+            logger.info(f"[{self.name}] Feed reader ended")
+            return
+        self._head += got
+        end = self._head - self._head % PCM_FRAME_BYTES
+        if end > self._pushed:
+            self._push(end)
+
+    def _push(self, end: int) -> None:
+        """Hand the audio up to end to every subscriber and wake ready() waiters"""
+        size = len(self._buf)
+        start = self._pushed % size
+        n = end - self._pushed
+        first = min(n, size - start)
+        chunks = [self._view[start:start + first]]
+        if n > first:
+            chunks.append(self._view[:n - first])
+        self._pushed = end
+        self.last_data = self._loop.time()
+        for push in list(self._subscribers.values()):
+            for chunk in chunks:
+                push(chunk)
+        for target, waiter in self._waiters:
+            if end >= target and not waiter.done():
+                waiter.set_result(True)
+
+    def _progress(self) -> None:
+        for owner in list(self._owners):
+            owner.progress_updates.notify()
+
+    def _log_line(self) -> None:
+        for owner in list(self._owners):
+            owner.logs.updates.notify()
+
+    async def _monitor(self, proc: FFmpegProcess) -> None:
+        try:
+            exit_code, error_lines = await watch_process(proc, self.name, "Feed FFmpeg error")
+            if proc.stopping:
+                logger.info(f"[{self.name}] Feed process stopped")
+                return
+            if self.process is proc:
+                self._release_pipe()
+                for _, waiter in self._waiters:
+                    if not waiter.done():
+                        waiter.set_result(False)
+            if exit_code != 0:
+                logger.warning(f"[{self.name}] Feed process exited with code {exit_code}")
+                if error_lines:
+                    logger.error(f"[{self.name}] Last errors: {error_lines[-3:]}")
+            else:
+                logger.info(f"[{self.name}] Feed process ended normally")
+            if self.process is not proc or self.closed:
+                return
+            delay = self.policy.exited(exit_code, error_lines[-1] if error_lines else None)
+            self._exited(delay)
+            await self._restart(proc, delay)
+        except Exception as e:
+            logger.error(f"[{self.name}] Error monitoring feed process: {e}")
+
+    def _exited(self, delay: Optional[float]) -> None:
+        policy = self.policy
+        for owner in list(self._owners):
+            event_bus.publish("restart", {"channel": owner.channel_id, "role": "feed", "exit_code": policy.last_exit,
+                                          "error": policy.last_error, "failures": policy.failures,
+                                          "circuit": policy.circuit,
+                                          "delay_s": round(delay, 1) if delay is not None else None})
+            owner.publish_status()
+
+    async def _restart(self, dead: FFmpegProcess, delay: Optional[float]) -> None:
+        """Start the decoder again while channels use it; their encoders keep running on filler meanwhile"""
+        policy = self.policy
+        while True:
+            if not self.refs:
+                return  # Nobody is listening; the pool drops the feed
+            if delay is None:
+                logger.error(f"[{self.name}] Feed failed {policy.failures} times in a row, "
+                             f"not restarting until the next start")
+                return
+            logger.info(f"[{self.name}] Restarting feed in {delay:.1f}s "
+                        f"(failure {policy.failures}, circuit {policy.circuit})")
+            await asyncio.sleep(delay)
+            if self.process is not dead or self.closed or not self.refs:
+                return
+            policy.attempt()
+            await kill_process(dead, self.name, "dead feed")
+            if await self._spawn():
+                policy.started()
+                for owner in list(self._owners):
+                    owner.publish_status()
+                return
+            delay = policy.exited(None, "failed to start")
+            self._exited(delay)
+
+    def status(self) -> Dict[str, object]:
+        return {
+            **self.policy.status(self.running()),
+            "pid": self.process.pid if self.running() else None,
+            "channels": self.channels,
+            "progress": self.process.progress.snapshot() if self.process is not None else None,
+        }
+
+
+class SourcePool:
+    """Shared feeds keyed by stream URL, reference-counted by the channels playing them.
+
+    Channels playing the same station share one decoder. Once the last one
+    lets go, the feed keeps decoding for SOURCE_GRACE_S before it is killed,
+    so switching back to it in that time is immediate. With RELAY_SPLICE
+    every channel gets a private feed, since a pipe can only be spliced into
+    one encoder.
+    """
+
+    def __init__(self, grace: float = SOURCE_GRACE_S, private: bool = RELAY_SPLICE) -> None:
+        self.grace = grace
+        self.private = private
+        self._feeds: Dict[str, SharedFeed] = {}
+        self._private: List[SharedFeed] = []
+        self._expiry: Dict[SharedFeed, asyncio.TimerHandle] = {}
+        self._closing: Set[asyncio.Task] = set()
+
+    def feeds(self) -> List[SharedFeed]:
+        return list(self._feeds.values()) + self._private
+
+    async def acquire(self, url: str, name: Optional[str], owner) -> Optional[SharedFeed]:
+        """The feed for url, started if no channel is playing it yet; release() it when done"""
+        feed = None if self.private else self._feeds.get(url)
+        if feed is None:
+            feed = SharedFeed(url, name, self.private)
+            feed.starting = asyncio.ensure_future(feed.start())
+            if self.private:
+                self._private.append(feed)
+            else:
+                self._feeds[url] = feed
+        elif feed.refs:
+            logger.info(f"[{owner.channel_id}] Sharing the feed for {feed.name} with {feed.channels} other channel(s)")
+        feed.hold(owner)
+        expiry = self._expiry.pop(feed, None)
+        if expiry is not None:
+            expiry.cancel()
+        ok = await asyncio.shield(feed.starting)
+        if ok and not feed.running() and not feed.closed:
+            ok = await feed.retry()
+        if not ok:
+            self.release(feed, owner)
+            return None
+        return feed
+
+    def release(self, feed: Optional[SharedFeed], owner) -> None:
+        """Let go of a feed; the last channel to do so starts its grace period"""
+        if feed is None:
+            return
+        feed.drop(owner)
+        if feed.refs or feed in self._expiry:
+            return
+        # A feed that is not delivering is not worth keeping: the next channel to want it gets a fresh connection
+        if feed.running() and feed.hot() and self.grace > 0 and not feed.private:
+            logger.info(f"[{feed.name}] Feed unused, keeping it for {self.grace:g}s")
+            self._expiry[feed] = asyncio.get_running_loop().call_later(self.grace, self._expire, feed)
+        else:
+            self._expire(feed)
+
+    def _expire(self, feed: SharedFeed) -> None:
+        self._expiry.pop(feed, None)
+        if feed.refs:
+            return
+        if self._feeds.get(feed.url) is feed:
+            del self._feeds[feed.url]
+        if feed in self._private:
+            self._private.remove(feed)
+        task = asyncio.ensure_future(feed.close())
+        self._closing.add(task)
+        task.add_done_callback(self._closing.discard)
+
+    async def close(self) -> None:
+        """Kill the feeds no channel is using, without waiting out their grace period"""
+        for feed in self.feeds():
+            if not feed.refs:
+                expiry = self._expiry.get(feed)
+                if expiry is not None:
+                    expiry.cancel()
+                self._expire(feed)
+        if self._closing:
+            await asyncio.gather(*self._closing)
+
+
+source_pool = SourcePool()
+
+
+SWITCH_GAPLESS = "gapless"  # Pre-warm the next feed and cut over without a gap
+SWITCH_HARD = "hard"  # Kill the old feed, then start the new one
+SWITCH_FAILOVER = "failover"  # The source stalled; a fallback station took over
+SWITCH_FAILBACK = "failback"  # The primary station is back and took over from the fallback
+FAILBACK_CROSSFADE_MS = 300
+FEED_PREWARM_BYTES = PCM_BYTES_PER_SEC // 4  # Audio the standby feed must deliver before the cut-over
+FEED_PREWARM_TIMEOUT = 10.0
+MAX_CROSSFADE_MS = 2000
+
+
+def build_rtmp_url(server: str, key: str) -> str:
+    """Full RTMP URL from a server URL and a stream key"""
+    server = server.strip()
+    key = key.strip()
+    if not server:
+        return key
+    if server.endswith('/'):
+        return f"{server}{key}"
+    return f"{server}/{key}"
+
+
+class Channel:
+    """One station -> RTMP pipeline: a shared feed decoding the source, relayed to one encoder per destination.
+
+    In direct mode there is no feed and no relay: each destination's FFmpeg
+    pulls and encodes the station itself.
+
+    Processes, pipes and timers all live on the event loop; the channel lock
+    is an asyncio lock, so a slow start on one channel never blocks another.
+    """
+
+    def __init__(self, channel_id: str) -> None:
+        self.channel_id = channel_id
+        self._feed: Optional[SharedFeed] = None  # Feed decoding the current station, from source_pool
+        self._destinations: Dict[str, Destination] = {}  # Main FFmpegs that stream to RTMP, by URL
+        self._lock = asyncio.Lock()
+        self._current_station: Optional[Dict[str, str]] = None
+        self._mode = MODE_RELAY
+        self._profile: Dict[str, Any] = {"preset": ENCODER_PROFILE, **ENCODER_PROFILES[ENCODER_PROFILE]}
+        self._relay = PcmRelay(channel_id)
+        self.hub = BroadcastHub(channel_id)
+        self.progress_updates = ChangeNotifier()  # Fires on each -progress block of any of its processes
+        self.logs = LogBook()  # stderr of its recent FFmpegs, for /api/channels/{id}/logs
+        self.snapshot: Optional[Dict[str, object]] = None  # Last summary() sent to /api/events
+        self.on_air_at: Optional[float] = None  # Monotonic time the last start's first audio reached the relay
+        self.output_at: Optional[float] = None  # Monotonic time the last start's first encoded packet went out
+        self._switch_stats = {"count": 0, "last_mode": None, "last_ms": None, "max_ms": 0.0, "total_ms": 0.0,
+                              "start_ms": None, "output_ms": None, "crossfade_ms": None}
+        # Ordered stations to play: the requested one, then its fallbacks
+        self._sources: List[Dict[str, str]] = []
+        self._source_index = 0
+        self._failover_task: Optional[asyncio.Task] = None
+        self._failback_task: Optional[asyncio.Task] = None
+        self._failover_retry_at = 0.0
+        self._failback_delay = FAILOVER_RECHECK  # Doubles while failing back to the primary keeps failing
+        self._failed_back_at: Optional[float] = None  # Monotonic time of the last failback that worked
+        self._failover_stats = {"count": 0, "failbacks": 0, "last_ms": None, "max_ms": 0.0, "last_reason": None}
+
+    def _has_output(self) -> bool:
+        return any(dest.is_running() for dest in self._destinations.values())
+
+    async def _sync_destinations(self, rtmp_urls: List[str], source_url: Optional[str] = None) -> bool:
+        """Start encoders for new RTMP URLs and stop those no longer wanted; untouched ones keep running.
+
+        Encoders with another profile, or another station in direct mode
+        (source_url), are replaced.
+        """
+        for url, dest in list(self._destinations.items()):
+            if url not in rtmp_urls:
+                logger.info(f"[{self.channel_id}] RTMP destination removed: {url[:50]}...")
+                await self._destinations.pop(url).stop()
+            elif dest.profile != self._profile or dest.source_url != source_url:
+                logger.info(f"[{self.channel_id}] Restarting the encoder for {url[:50]}... with the new settings")
+                await self._destinations.pop(url).stop()
+        for url in rtmp_urls:
+            if url not in self._destinations:
+                # The first encoder also feeds the HTTP hub, until it is removed
+                has_hub = any(d.hub is not None for d in self._destinations.values())
+                self._destinations[url] = Destination(
+                    self.channel_id, url, self._relay, None if has_hub else self.hub, self._on_progress,
+                    self.publish_status, self._profile, source_url, self.logs,
+                )
+        await asyncio.gather(*(dest.start() for dest in self._destinations.values()))
+        if self._has_output():
+            return True
+        await asyncio.gather(*(dest.stop() for dest in self._destinations.values()))
+        self._destinations.clear()
+        return False
+
+    def _on_progress(self) -> None:
+        self.progress_updates.notify()
+
+    async def _acquire_feed(self, stream_url: str, station_name: Optional[str] = None) -> Optional[SharedFeed]:
+        """Get a feed decoding stream_url to PCM, shared with any channel already playing it"""
+        if not self._has_output():
+            logger.error(f"[{self.channel_id}] Main process not running, cannot feed stream")
+            return None
+        feed = await source_pool.acquire(stream_url, station_name, self)
+        if feed is not None:
+            logger.info(f"[{self.channel_id}] Feed for {station_name} is PID {feed.process.pid}")
+            self.logs.add(feed.process.log)
+        return feed
+
+    def _release_feed(self) -> None:
+        """Stop relaying the current feed and hand it back to the pool"""
+        self._relay.detach_source()
+        source_pool.release(self._feed, self)
+        self._feed = None
+
+    def _switch_timer(self, mode: str = SWITCH_HARD, started: Optional[float] = None):
+        """Return a callback that records the time from started (default now) until the new feed's audio reaches the relay"""
+        started = started if started is not None else time.monotonic()
+        is_switch = self._current_station is not None
+
+        def done():
+            elapsed_ms = (time.monotonic() - started) * 1000
+            SWITCH_SECONDS.observe(elapsed_ms / 1000, self.channel_id, mode if is_switch else "start")
+            event_bus.publish("switch", {"channel": self.channel_id, "mode": mode if is_switch else "start",
+                                         "ms": round(elapsed_ms, 1)})
+            if not is_switch:
+                self._switch_stats["start_ms"] = round(elapsed_ms, 1)
+                self.on_air_at = time.monotonic()
+            elif mode in (SWITCH_FAILOVER, SWITCH_FAILBACK):
+                stats = self._failover_stats
+                stats["count" if mode == SWITCH_FAILOVER else "failbacks"] += 1
+                stats["last_ms"] = round(elapsed_ms, 1)
+                stats["max_ms"] = max(stats["max_ms"], stats["last_ms"])
+                logger.info(f"[{self.channel_id}] {mode.capitalize()} took {elapsed_ms:.0f} ms")
+            else:
+                stats = self._switch_stats
+                stats["count"] += 1
+                stats["last_mode"] = mode
+                stats["last_ms"] = round(elapsed_ms, 1)
+                stats["max_ms"] = max(stats["max_ms"], stats["last_ms"])
+                stats["total_ms"] += elapsed_ms
+                logger.info(f"[{self.channel_id}] Switch ({mode}) took {elapsed_ms:.0f} ms")
+            self.publish_status()
+
+        return done
+
+    def _output_timer(self, then=None):
+        """Return a callback for the hub's first encoded audio: records the time from now until it, then calls then"""
+        started = time.monotonic()
+
+        def done():
+            self.output_at = time.monotonic()
+            elapsed_ms = (self.output_at - started) * 1000
+            self._switch_stats["output_ms"] = round(elapsed_ms, 1)
+            logger.info(f"[{self.channel_id}] First packet out {elapsed_ms:.0f} ms after the start")
+            startup_mark("first_output")
+            if then is not None:
+                then()
+            self.publish_status()
+
+        return done
+
+    def _faded(self, old: SharedFeed, nbytes: int) -> None:
+        """The old feed has faded out after a gapless switch: hand it back to the pool"""
+        source_pool.release(old, self)
+        self._switch_stats["crossfade_ms"] = round(nbytes * 1000 / PCM_BYTES_PER_SEC)
+        if nbytes:
+            self.publish_status()
+
+    async def _switch_gapless(self, stream_url: str, station_name: Optional[str], crossfade_ms: int,
+                              mode: str = SWITCH_GAPLESS, timeout: float = FEED_PREWARM_TIMEOUT,
+                              started: Optional[float] = None, audible: bool = False) -> Dict[str, str]:
+        """Start the new feed next to the current one and cut over once it has audio buffered.
+
+        With audible, that audio must not be all silence.
+        """
+        on_first_data = self._switch_timer(mode, started)
+        standby = await self._acquire_feed(stream_url, station_name)
+        if not standby:
+            return {"error": "failed to start feed process"}
+        if standby is self._feed:
+            # Already playing that stream
+            source_pool.release(standby, self)
+            on_first_data()
+        elif await (standby.audible if audible else standby.ready)(FEED_PREWARM_BYTES, timeout):
+            # A feed other channels are playing is ready at once
+            crossfade_bytes = int(PCM_BYTES_PER_SEC * crossfade_ms / 1000)
+            self._relay.cutover(standby, station_name, crossfade_bytes, on_first_data,
+                                on_faded=lambda nbytes, old=self._feed: self._faded(old, nbytes))
+            self._feed = standby
+        else:
+            # The old station keeps playing
+            failure = standby.failure()
+            if failure:
+                logger.error(f"[{self.channel_id}] New feed {failure}; keeping current station")
+            else:
+                logger.error(f"[{self.channel_id}] New feed produced no {'sound' if audible else 'audio'} "
+                             f"within {timeout:g}s, keeping current station")
+            source_pool.release(standby, self)
+            return {"error": "new station did not start producing audio"}
+        self._current_station = {"name": station_name or stream_url, "url": stream_url}
+        return {"status": "switched", "switch_ms": self._switch_stats["last_ms"]}
+
+    async def start_stream(self, stream_url: str, rtmp_server: str, stream_key: str, station_name: Optional[str] = None,
+                           targets: Optional[List[str]] = None, switch_mode: str = SWITCH_GAPLESS,
+                           crossfade_ms: int = 0, fallbacks: Optional[List[Dict[str, str]]] = None,
+                           start_index: int = 0, mode: str = MODE_RELAY,
+                           profile: Optional[Dict[str, Any]] = None) -> Dict[str, object]:
+        """Play stream_url on every RTMP destination; targets are extra full RTMP URLs to fan out to.
+
+        fallbacks ({"url", "name"} dicts, in order) take over when the station
+        stalls; start_index starts on one of them right away (0 is stream_url).
+        profile (see ENCODER_PROFILES, with its "preset") defaults to
+        ENCODER_PROFILE; mode is MODE_RELAY or MODE_DIRECT.
+        """
+        profile = profile or {"preset": ENCODER_PROFILE, **ENCODER_PROFILES[ENCODER_PROFILE]}
+        sources = [{"name": station_name or stream_url, "url": stream_url}] + list(fallbacks or [])
+        if not 0 <= start_index < len(sources):
+            start_index = 0
+        if start_index:
+            logger.warning(f"[{self.channel_id}] {sources[0]['name']} is down, "
+                           f"starting on fallback {sources[start_index]['name']}")
+        stream_url, station_name = sources[start_index]["url"], sources[start_index]["name"]
+        rtmp_urls: List[str] = []
+        if rtmp_server.strip() or stream_key.strip():
+            rtmp_urls.append(build_rtmp_url(rtmp_server, stream_key))
+        for url in targets or []:
+            if url not in rtmp_urls:
+                rtmp_urls.append(url)
+        if not rtmp_urls:
+            return {"error": "no RTMP destination"}
+        if self._relay.splice and len(rtmp_urls) > 1:
+            return {"error": "RELAY_SPLICE supports a single RTMP destination"}
+        if self._relay.splice and len(sources) > 1:
+            return {"error": "RELAY_SPLICE does not support fallbacks"}
+        if mode == MODE_DIRECT and len(sources) > 1:
+            return {"error": "direct mode does not support fallbacks"}
+        if mode != MODE_DIRECT and profile["codec"] == "copy":
+            return {"error": "the passthrough profile needs direct mode"}
+        error = await ffmpeg_missing(profile)
+        if error:
+            return {"error": error}
+
+        async with self._lock:
+            logger.info(f"[{self.channel_id}] Starting stream - Station: {station_name}, URL: {stream_url}")
+            for rtmp_url in rtmp_urls:
+                logger.info(f"[{self.channel_id}] RTMP destination: {rtmp_url[:50]}...")
+
+            if mode == MODE_DIRECT:
+                return await self._start_direct(stream_url, station_name, sources, rtmp_urls, profile)
+
+            # Let go of a dead feed first
+            if self._feed and not self._feed.running():
+                self._release_feed()
+
+            # Start encoders for new destinations; ones already streaming are left alone
+            self.hub.reopen()
+            self._mode, self._profile = MODE_RELAY, profile
+            self.hub.on_output = self._output_timer() if self._current_station is None else None
+            if not await self._sync_destinations(rtmp_urls):
+                self.hub.on_output = None
+                return {"error": "failed to start main stream"}
+
+            # A live feed: switch without interrupting the encoders
+            if switch_mode == SWITCH_GAPLESS and self._feed and self._relay.can_cutover():
+                result = await self._switch_gapless(stream_url, station_name, crossfade_ms)
+                if "error" not in result:
+                    self._use_sources(sources, start_index)
+                result.setdefault("rtmp", rtmp_urls[0])
+                result.setdefault("targets", rtmp_urls)
+                return result
+
+            # Let go of the old feed first
+            self._release_feed()
+
+            # Start feeding new stream
+            self._feed = await self._acquire_feed(stream_url, station_name)
+            if not self._feed:
+                return {"error": "failed to start feed process"}
+            self._relay.attach_feed(self._feed, station_name, FEED_PREWARM_BYTES, on_first_data=self._switch_timer())
+
+            self._current_station = {"name": station_name or stream_url, "url": stream_url}
+            self._use_sources(sources, start_index)
+
+            return {"status": "starting", "rtmp": rtmp_urls[0], "targets": rtmp_urls}
+
+    async def _start_direct(self, stream_url: str, station_name: str, sources: List[Dict[str, str]],
+                            rtmp_urls: List[str], profile: Dict[str, Any]) -> Dict[str, object]:
+        """Have each destination's FFmpeg pull the station itself (caller holds the lock)"""
+        self._release_feed()
+        self._relay.clear()
+        self.hub.reopen()
+        restart = self._current_station is None or self._current_station["url"] != stream_url or any(
+            dest.profile != profile or dest.source_url != stream_url for dest in self._destinations.values())
+        self._mode, self._profile = MODE_DIRECT, profile
+        if restart:
+            # There is no relay: the station is on air once the encoder puts out audio
+            switched = self._switch_timer()
+            self.hub.on_output = self._output_timer(switched) if self._current_station is None else switched
+        if not await self._sync_destinations(rtmp_urls, stream_url):
+            self.hub.on_output = None
+            return {"error": "failed to start direct stream"}
+        self._current_station = {"name": station_name or stream_url, "url": stream_url}
+        self._use_sources(sources, 0)
+        return {"status": "starting", "rtmp": rtmp_urls[0], "targets": rtmp_urls}
+
+    def requested_url(self) -> Optional[str]:
+        """URL of the station last started on this channel, even while a fallback stands in for it"""
+        return self._sources[0]["url"] if self._sources else None
+
+    def _use_sources(self, sources: List[Dict[str, str]], index: int) -> None:
+        """Remember the station and its fallbacks, now playing sources[index]"""
+        self._sources = sources
+        self._source_index = index
+        self._failover_retry_at = 0.0
+        self._failback_delay = FAILOVER_RECHECK
+        self._failed_back_at = None
+        self._relay.on_stall = self._on_stall if len(sources) > 1 else None
+        self._watch_primary()
+
+    def _on_stall(self, reason: str) -> None:
+        """The relay found the current source stalled; fail over unless that is already under way"""
+        if self._failover_task is not None and not self._failover_task.done():
+            return
+        if time.monotonic() < self._failover_retry_at:
+            return
+        self._failover_task = asyncio.create_task(self._fail_over(reason, time.monotonic()))
+
+    async def _fail_over(self, reason: str, detected: float) -> None:
+        """Switch to the next source that delivers audio within FAILOVER_TIMEOUT, wrapping round to the primary"""
+        stalled = self._feed
+        async with self._lock:
+            if self._feed is not stalled or self._current_station is None or len(self._sources) < 2:
+                return
+            logger.warning(f"[{self.channel_id}] {self._current_station['name']}: {reason}, failing over")
+            self._failover_stats["last_reason"] = reason
+            count = len(self._sources)
+            for step in range(1, count):
+                index = (self._source_index + step) % count
+                source = self._sources[index]
+                health = source_prober.result(source["url"])
+                if health is not None and not health["ok"]:
+                    logger.info(f"[{self.channel_id}] Skipping {source['name']}, it is down ({health['error']})")
+                    continue
+                result = await self._switch_gapless(source["url"], source["name"], 0, SWITCH_FAILOVER,
+                                                    FAILOVER_TIMEOUT, detected)
+                if "error" not in result:
+                    self._source_index = index
+                    self._watch_primary()
+                    self.publish_status()
+                    return
+            logger.error(f"[{self.channel_id}] No fallback is delivering audio, trying again in {FAILOVER_RECHECK:g}s")
+            self._failover_retry_at = time.monotonic() + FAILOVER_RECHECK
+
+    def _watch_primary(self) -> None:
+        if self._source_index and (self._failback_task is None or self._failback_task.done()):
+            if self._failed_back_at is not None:
+                # The primary went down again after a failback: back off, unless it held up for a good while
+                held = time.monotonic() - self._failed_back_at
+                self._failback_delay = (FAILOVER_RECHECK if held >= FAILBACK_BACKOFF_MAX
+                                        else min(self._failback_delay * 2, FAILBACK_BACKOFF_MAX))
+                self._failed_back_at = None
+            self._failback_task = asyncio.create_task(self._fail_back())
+
+    async def _fail_back(self) -> None:
+        """While a fallback plays, try the primary every so often and switch back once it delivers audio.
+
+        The primary counts as back only when its feed puts out FEED_PREWARM_BYTES
+        of sound within FAILOVER_TIMEOUT; the wait doubles after each failed try.
+        """
+        while self._source_index and self._current_station is not None:
+            await asyncio.sleep(self._failback_delay)
+            primary = self._sources[0] if self._sources else None
+            if primary is None:
+                continue
+            async with self._lock:
+                if not self._source_index or self._current_station is None or self._sources[0] is not primary:
+                    continue
+                logger.info(f"[{self.channel_id}] Trying {primary['name']} again")
+                result = await self._switch_gapless(primary["url"], primary["name"], FAILBACK_CROSSFADE_MS,
+                                                    SWITCH_FAILBACK, FAILOVER_TIMEOUT, audible=True)
+                if "error" not in result:
+                    self._source_index = 0
+                    self._failed_back_at = time.monotonic()
+                    self.publish_status()
+                else:
+                    self._failback_delay = min(self._failback_delay * 2, FAILBACK_BACKOFF_MAX)
+                    logger.info(f"[{self.channel_id}] {primary['name']} is still down, "
+                                f"trying again in {self._failback_delay:g}s")
+
+    async def _stop_processes(self) -> None:
+        """Kill this channel's main processes and release its feed (caller holds the channel lock)"""
+        self._release_feed()
+        await asyncio.gather(*(dest.stop() for dest in self._destinations.values()))
+        self._destinations.clear()
+        self._relay.clear()
+        self.hub.close()
+
+    async def stop_stream(self) -> Dict[str, str]:
+        async with self._lock:
+            await self._stop_processes()
+            self._current_station = None
+            self._sources = []
+            self._source_index = 0
+            self._relay.on_stall = None
+            self.hub.on_output = None
+            return {"status": "stopped"}
+
+    def stopped(self) -> bool:
+        """Not playing anything and not being started or stopped"""
+        return self._current_station is None and not self._lock.locked()
+
+    def summary(self) -> Dict[str, object]:
+        """The part of the status that changes only when a process starts, stops, restarts or switches"""
+        # Live only while both an encoder and the feed are up (direct mode has no feed); otherwise state says
+        # whether it is recovering
+        feed_running = self._feed is not None and self._feed.running()
+        running = self._has_output() and (feed_running or self._mode == MODE_DIRECT)
+        name = self._current_station.get("name") if self._current_station else None
+        url = self._current_station.get("url") if self._current_station else None
+        feed = self._feed_status()
+        for key in ("next_restart_s", "channels", "progress"):
+            del feed[key]
+        return {
+            "channel": self.channel_id,
+            "running": running,
+            "state": self._state(running),
+            "name": name,
+            "url": url,
+            "mode": self._mode,
+            "profile": self._profile,
+            "feed_running": feed_running,
+            "feed": feed,
+            "destinations": [dest.summary() for dest in self._destinations.values()],
+            "switch": self._switch_status(),
+            "failover": self._failover_status(),
+        }
+
+    def _failover_status(self) -> Dict[str, object]:
+        stats = self._failover_stats
+        return {
+            "sources": [source["name"] for source in self._sources],
+            "current": self._source_index,
+            "on_fallback": self._source_index > 0,
+            "count": stats["count"],
+            "failbacks": stats["failbacks"],
+            "last_ms": stats["last_ms"],
+            "max_ms": stats["max_ms"],
+            "last_reason": stats["last_reason"],
+        }
+
+    def publish_status(self) -> None:
+        """Send a status event to /api/events if the summary changed since the last one"""
+        summary = self.summary()
+        if summary != self.snapshot:
+            self.snapshot = summary
+            event_bus.publish("status", summary)
+
+    def get_status(self) -> Dict[str, Optional[str]]:
+        status = self.summary()
+        status["feed"] = self._feed_status()
+        status["destinations"] = [dest.status() for dest in self._destinations.values()]
+        status["relay"] = self._relay.stats()
+        status["http"] = self.hub.stats()
+        return status
+
+    def _feed_status(self) -> Dict[str, object]:
+        if self._feed is not None:
+            return self._feed.status()
+        return {**RestartPolicy().status(False), "pid": None, "channels": 0, "progress": None}
+
+    def progress(self) -> Dict[str, object]:
+        """-progress telemetry of the feed and every encoder"""
+        return {
+            "channel": self.channel_id,
+            "time": time.time(),
+            "feed": self._feed_status()["progress"],
+            "destinations": [dest.status()["progress"] for dest in self._destinations.values()],
+        }
+
+    def processes(self) -> List[tuple]:
+        """(role, destination index, pid) of each running encoder of this channel; feeds are in source_pool"""
+        procs = []
+        for i, dest in enumerate(self._destinations.values()):
+            status = dest.status()
+            if status["running"]:
+                procs.append((dest.role, str(i), status["pid"]))
+        return procs
+
+    def _state(self, running: bool) -> str:
+        """stopped, live, recovering (restarts pending) or failed (a circuit is open)"""
+        if self._current_station is None:
+            return "stopped"
+        if running:
+            return "live"
+        if (self._feed is not None and self._feed.policy.circuit == RestartPolicy.OPEN) or not any(
+                dest.is_running() or dest.policy.circuit != RestartPolicy.OPEN for dest in self._destinations.values()):
+            return "failed"
+        return "recovering"
+
+    def _switch_status(self) -> Dict[str, object]:
+        stats = self._switch_stats
+        return {
+            "count": stats["count"],
+            "last_mode": stats["last_mode"],
+            "last_ms": stats["last_ms"],
+            "avg_ms": round(stats["total_ms"] / stats["count"], 1) if stats["count"] else None,
+            "max_ms": round(stats["max_ms"], 1),
+            "start_ms": stats["start_ms"],
+            "output_ms": stats["output_ms"],
+            "crossfade_ms": stats["crossfade_ms"],
+        }
+
+
+DEFAULT_CHANNEL = "default"
+CHANNEL_ID_RE = re.compile(r"^[A-Za-z0-9_-]{1,64}$")
+
+
+class StreamManager(metaclass=_Singleton):
+    """Registry of channels keyed by channel id.
+
+    Channels are started and stopped on the event loop. The registry lock only
+    guards the channel dict, which the HTTP listener threads also read; every
+    channel has its own asyncio lock, so starting or stopping one channel
+    never waits on another.
+    """
+
+    def __init__(self) -> None:
+        self._channels: Dict[str, Channel] = {}
+        self._starting: Dict[str, int] = {}  # Start requests in progress per channel id
+        self._lock = threading.Lock()
+        self.resumed: Dict[str, Optional[float]] = {}  # Seconds from startup until each resumed channel was on air
+
+    def _start_http_server(self):
+        """Start HTTP server if not already running"""
+        global http_server, http_server_thread
+        
+        if http_server is not None:
+            return
+        
+        try:
+            http_server = ThreadingHTTPServer((HTTP_STREAM_HOST, HTTP_STREAM_PORT), StreamHTTPHandler)
+            http_server_thread = threading.Thread(target=http_server.serve_forever, daemon=True)
+            http_server_thread.start()
+            logger.info(f"HTTP Server started on port {HTTP_STREAM_PORT}")
+        except Exception as e:
+            logger.error(f"Failed to start HTTP server: {e}")
+
+    def get_channel(self, channel_id: str, create: bool = False) -> Optional[Channel]:
+        with self._lock:
+            channel = self._channels.get(channel_id)
+            if channel is None and create:
+                channel = Channel(channel_id)
+                self._channels[channel_id] = channel
+            return channel
+
+    def channels(self) -> List[Channel]:
+        with self._lock:
+            return list(self._channels.values())
+
+    async def start_stream(self, stream_url: str, rtmp_server: str, stream_key: str,
+                           station_name: Optional[str] = None, channel_id: str = DEFAULT_CHANNEL,
+                           **options) -> Dict[str, str]:
+        # Start on the first station that is not known to be down
+        urls = [stream_url] + [source["url"] for source in options.get("fallbacks") or []]
+        for start_index, url in enumerate(urls):
+            if await source_prober.usable(url):
+                break
+        else:
+            health = source_prober.result(stream_url)
+            return {"error": f"station is unreachable: {health['error']}"}
+        with self._lock:
+            self._start_http_server()
+        with self._lock:
+            self._starting[channel_id] = self._starting.get(channel_id, 0) + 1
+        channel = self.get_channel(channel_id, create=True)
+        try:
+            result = await channel.start_stream(stream_url, rtmp_server, stream_key, station_name,
+                                                start_index=start_index, **options)
+        finally:
+            with self._lock:
+                self._starting[channel_id] -= 1
+                if not self._starting[channel_id]:
+                    del self._starting[channel_id]
+        channel.publish_status()
+        if "error" not in result:
+            state_store.want(channel_id, {"url": stream_url, "name": station_name, "rtmp_server": rtmp_server,
+                                          "key": stream_key, "options": options})
+        elif self._idle(channel):
+            # A channel that never came up is not kept around; stop the encoders it may have started
+            await channel.stop_stream()
+            self._drop_if_idle(channel)
+        return result
+
+    def _idle(self, channel: Channel) -> bool:
+        """Registered, stopped, unscheduled and with no start in progress"""
+        return (self._channels.get(channel.channel_id) is channel and channel.stopped()
+                and channel.channel_id not in self._starting and scheduler.get(channel.channel_id) is None)
+
+    def _drop_if_idle(self, channel: Channel) -> None:
+        """Unregister an idle channel, freeing its buffers"""
+        with self._lock:
+            if self._idle(channel):
+                del self._channels[channel.channel_id]
+
+    async def stop_stream(self, channel_id: str = DEFAULT_CHANNEL, forget: bool = True) -> Dict[str, str]:
+        """Stop a channel; forget=False keeps it in the saved state, to come back after a restart"""
+        if forget:
+            state_store.forget(channel_id)
+        channel = self.get_channel(channel_id)
+        if channel is None:
+            return {"status": "stopped"}
+        result = await channel.stop_stream()
+        channel.publish_status()
+        if forget:
+            self._drop_if_idle(channel)
+        return result
+
+    async def resume(self, channels: Dict[str, Dict[str, Any]], started: float) -> Dict[str, Optional[float]]:
+        """Start saved channels in parallel; returns the seconds from started until each was on air (None if not)"""
+
+        async def resume_one(channel_id: str, request: Dict[str, Any]) -> Optional[float]:
+            try:
+                result = await self.start_stream(request["url"], request.get("rtmp_server", ""), request.get("key", ""),
+                                                 request.get("name"), channel_id=channel_id,
+                                                 **request.get("options", {}))
+            except Exception as e:
+                result = {"error": str(e)}
+            if "error" in result:
+                logger.error(f"[{channel_id}] Could not resume: {result['error']}")
+                return None
+            channel = self.get_channel(channel_id)
+            deadline = time.monotonic() + RESUME_ON_AIR_TIMEOUT
+            while channel.output_at is None and time.monotonic() < deadline:
+                await event_bus.wait(deadline - time.monotonic())
+            if channel.output_at is None:
+                logger.error(f"[{channel_id}] Resumed, but no audio after {RESUME_ON_AIR_TIMEOUT:g}s")
+                return None
+            on_air = channel.output_at - started
+            logger.info(f"[{channel_id}] Back on air {on_air:.2f}s after startup")
+            return on_air
+
+        logger.info(f"Resuming {len(channels)} channels")
+        results = await asyncio.gather(*(resume_one(cid, request) for cid, request in channels.items()))
+        self.resumed = dict(zip(channels, results))
+        on_air = [seconds for seconds in results if seconds is not None]
+        logger.info(f"Resumed {len(on_air)}/{len(channels)} channels" +
+                    (f", the last back on air {max(on_air):.2f}s after startup" if on_air else ""))
+        return self.resumed
+
+    async def stop_all(self, forget: bool = True) -> None:
+        await asyncio.gather(*(self.stop_stream(channel.channel_id, forget) for channel in self.channels()))
+        # Nothing is coming back, so do not wait out the feeds' grace period
+        await source_pool.close()
+
+    def snapshot(self) -> List[Dict[str, object]]:
+        """Summaries of all channels, as last sent to /api/events"""
+        for channel in self.channels():
+            # Picks up what changed without an event, e.g. a circuit that closed after enough uptime
+            channel.publish_status()
+        return [channel.snapshot for channel in self.channels()]
+
+    def get_status(self, channel_id: str = DEFAULT_CHANNEL) -> Dict[str, Optional[str]]:
+        channel = self.get_channel(channel_id)
+        if channel is None:
+            return {"channel": channel_id, "running": False, "state": "stopped", "name": None, "url": None,
+                    "feed_running": False, "destinations": []}
+        return channel.get_status()
+
+
+SCHEDULES_PATH = Path(os.environ.get("SCHEDULES_PATH", BASE_DIR / "schedules.json"))
+SCHEDULE_MAX_SLEEP = 60.0  # Re-check the wall clock at least this often, in case it was adjusted
+SLOT_TIME_RE = re.compile(r"^([01]\d|2[0-3]):([0-5]\d)$")
+
+
+def write_private_json(path: Path, data) -> None:
+    """Write JSON readable only by the owner to a temporary file, then rename it over path"""
+    tmp = path.with_name(path.name + ".tmp")
+    fd = os.open(tmp, os.O_WRONLY | os.O_CREAT | os.O_TRUNC, 0o600)
+    with os.fdopen(fd, "w", encoding="utf-8") as f:
+        json.dump(data, f, ensure_ascii=False, indent=2)
+        f.flush()
+        os.fsync(f.fileno())
+    os.replace(tmp, path)
+
+
+def _slot_seconds(at: str) -> int:
+    """Seconds after midnight of an "HH:MM" slot time"""
+    hours, minutes = at.split(":")
+    return int(hours) * 3600 + int(minutes) * 60
+
+
+def schedule_position(schedule: Dict[str, Any], t: float) -> tuple:
+    """(station that should be playing at wall-clock time t, time of the next change)
+
+    A rotation changes station every every_minutes, counted from the epoch, so
+    its slots are the same however often this is called. A timetable's slots
+    are "HH:MM" local times, each playing until the next one (the last one
+    runs past midnight up to the first).
+    """
+    rotate = schedule.get("rotate")
+    if rotate:
+        period = rotate["every_minutes"] * 60
+        n = int(t // period)
+        stations = rotate["stations"]
+        return stations[n % len(stations)], (n + 1) * period
+    slots = schedule["slots"]
+    offsets = [_slot_seconds(slot["at"]) for slot in slots]
+    lt = time.localtime(t)
+    i = bisect.bisect_right(offsets, lt.tm_hour * 3600 + lt.tm_min * 60 + lt.tm_sec)
+    current = slots[i - 1]  # Before the first slot of the day, yesterday's last one is still on
+    next_offset, day = (offsets[i], 0) if i < len(slots) else (offsets[0], 1)
+    hours, minutes = divmod(next_offset // 60, 60)
+    # mktime normalises the day overflow and picks the right DST offset
+    due = time.mktime((lt.tm_year, lt.tm_mon, lt.tm_mday + day, hours, minutes, 0, 0, 0, -1))
+    return current["station"], max(due, t + 1)
+
+
+class Scheduler:
+    """Plays each channel's schedule (a daily timetable or a rotation) by switching it through StreamManager.
+
+    Only the next change of each channel is kept, in a heap ordered by time,
+    and a single loop timer is armed for the earliest one, so hundreds of
+    slots over many channels cost one timer. Change times are absolute and
+    recomputed from the schedule after each change instead of adding up
+    sleeps, so they do not drift; the timer never sleeps longer than
+    SCHEDULE_MAX_SLEEP, so a wall clock adjustment is picked up too.
+
+    clock (wall-clock seconds) and apply (the coroutine that switches a
+    channel) are injectable; run_due() can be driven directly in tests.
+    Schedules are saved to path (atomically) and loaded by start().
+    """
+
+    def __init__(self, path: Optional[Path], apply, clock=time.time) -> None:
+        self._path = path
+        self._apply = apply
+        self._clock = clock
+        self._schedules: Dict[str, Dict[str, Any]] = {}
+        self._heap: List[tuple] = []  # (due, channel id, version); stale versions are skipped
+        self._versions: Dict[str, int] = {}
+        self._timer: Optional[asyncio.TimerHandle] = None
+        self._loop: Optional[asyncio.AbstractEventLoop] = None
+        self._tasks: Set[asyncio.Task] = set()  # Switches under way
+
+    def start(self) -> None:
+        """Load the saved schedules, put every channel on its current slot and arm the timer"""
+        self._loop = asyncio.get_running_loop()
+        if self._path is not None and self._path.exists():
+            try:
+                self._schedules = json.loads(self._path.read_text(encoding="utf-8"))
+                logger.info(f"Loaded {len(self._schedules)} schedules from {self._path.name}")
+            except (OSError, ValueError) as e:
+                logger.error(f"Failed to read schedules from {self._path}: {e}")
+        now = self._clock()
+        for channel_id in self._schedules:
+            self._apply_now(channel_id, now)
+        self._arm()
+
+    def stop(self) -> None:
+        """Disarm the timer and cancel the switches under way"""
+        if self._timer is not None:
+            self._timer.cancel()
+            self._timer = None
+        for task in self._tasks:
+            task.cancel()
+
+    def get(self, channel_id: str) -> Optional[Dict[str, Any]]:
+        schedule = self._schedules.get(channel_id)
+        if schedule is None:
+            return None
+        station, next_at = schedule_position(schedule, self._clock())
+        upcoming, _ = schedule_position(schedule, next_at)
+        return {**schedule, "now": station, "next_at": next_at, "next": upcoming}
+
+    def schedules(self) -> Dict[str, Dict[str, Any]]:
+        return {channel_id: self.get(channel_id) for channel_id in self._schedules}
+
+    def set(self, channel_id: str, schedule: Dict[str, Any]) -> None:
+        """Replace a channel's schedule and switch the channel to its current slot"""
+        self._schedules[channel_id] = schedule
+        self._save()
+        if self._loop is not None:
+            self._apply_now(channel_id, self._clock())
+            self._arm()
+        else:
+            self._plan(channel_id, self._clock())
+
+    def remove(self, channel_id: str) -> bool:
+        """Drop a channel's schedule; the channel keeps playing whatever it plays now"""
+        if self._schedules.pop(channel_id, None) is None:
+            return False
+        self._versions[channel_id] = self._versions.get(channel_id, 0) + 1
+        self._save()
+        return True
+
+    def run_due(self, now: Optional[float] = None) -> List[tuple]:
+        """Take every change due by now; returns (channel id, schedule, station) to switch to, in time order"""
+        now = self._clock() if now is None else now
+        due = []
+        while self._heap and self._heap[0][0] <= now:
+            _, channel_id, version = heapq.heappop(self._heap)
+            schedule = self._schedules.get(channel_id)
+            if schedule is None or version != self._versions.get(channel_id):
+                continue
+            due.append((channel_id, schedule, self._plan(channel_id, now)))
+        return due
+
+    def _plan(self, channel_id: str, now: float) -> Dict[str, str]:
+        """Queue the channel's next change; returns the station it should be playing now"""
+        version = self._versions.get(channel_id, 0) + 1
+        self._versions[channel_id] = version
+        station, next_at = schedule_position(self._schedules[channel_id], now)
+        heapq.heappush(self._heap, (next_at, channel_id, version))
+        return station
+
+    def _apply_now(self, channel_id: str, now: float) -> None:
+        station = self._plan(channel_id, now)
+        self._start_switch(channel_id, self._schedules[channel_id], station)
+
+    def _start_switch(self, channel_id: str, schedule: Dict[str, Any], station: Dict[str, str]) -> None:
+        # Keep a reference, or the loop may collect the task halfway through the switch
+        task = self._loop.create_task(self._switch(channel_id, schedule, station))
+        self._tasks.add(task)
+        task.add_done_callback(self._tasks.discard)
+
+    async def _switch(self, channel_id: str, schedule: Dict[str, Any], station: Dict[str, str]) -> None:
+        try:
+            await self._apply(channel_id, schedule, station)
+        except Exception as e:
+            logger.error(f"[{channel_id}] Scheduled switch to {station['name']} failed: {e}")
+
+    def _arm(self) -> None:
+        if self._timer is not None:
+            self._timer.cancel()
+            self._timer = None
+        if self._loop is None or not self._heap:
+            return
+        delay = min(max(0.0, self._heap[0][0] - self._clock()), SCHEDULE_MAX_SLEEP)
+        self._timer = self._loop.call_later(delay, self._on_timer)
+
+    def _on_timer(self) -> None:
+        self._timer = None
+        for channel_id, schedule, station in self.run_due():
+            self._start_switch(channel_id, schedule, station)
+        self._arm()
+
+    def _save(self) -> None:
+        """Write the schedules to a temporary file and rename it over the old one"""
+        if self._path is None:
+            return
+        try:
+            # Schedules hold stream keys, so only the owner may read them
+            write_private_json(self._path, self._schedules)
+        except OSError as e:
+            logger.error(f"Failed to save schedules to {self._path}: {e}")
+
+
+async def play_scheduled(channel_id: str, schedule: Dict[str, Any], station: Dict[str, str]) -> None:
+    """Switch a channel to a scheduled station, unless it already plays it"""
+    manager = StreamManager()
+    channel = manager.get_channel(channel_id)
+    if channel is not None and channel.requested_url() == station["url"] and channel.get_status()["state"] != "stopped":
+        return
+    logger.info(f"[{channel_id}] Schedule: switching to {station['name']}")
+    result = await manager.start_stream(
+        station["url"], schedule.get("rtmp_server", ""), schedule.get("key", ""), station["name"],
+        channel_id=channel_id, targets=schedule.get("targets") or [],
+        switch_mode=schedule.get("switch", SWITCH_GAPLESS), crossfade_ms=schedule.get("crossfade_ms", 0),
+        profile=schedule.get("profile"),
+    )
+    if "error" in result:
+        logger.error(f"[{channel_id}] Scheduled switch to {station['name']} failed: {result['error']}")
+
+
+scheduler = Scheduler(SCHEDULES_PATH, play_scheduled)
+
+
+# Channels to bring back after a restart or deploy (see StateStore)
+STATE_PATH = Path(os.environ.get("STATE_PATH", BASE_DIR / "state.json"))
+STATE_SAVE_DELAY = 0.5  # PID changes within this window are written together
+RESUME_ON_AIR_TIMEOUT = 60.0  # A resumed channel without audio after this long counts as not back
+
+
+class StateStore:
+    """What should be on air, kept in a JSON file so that a restart or deploy can bring it back.
+
+    It records each channel's last successful start request, dropped when
+    the channel is stopped (but not when the server shuts down), and the PID
+    and start time of every FFmpeg this server runs, so the next run can
+    tell which of them it left behind. Nothing is written until load() has
+    read the previous run's file, so scripts that drive StreamManager
+    directly (bench.py) leave it alone. Channel changes are written at once
+    and PID changes batched; each write replaces the file atomically.
+    """
+
+    def __init__(self, path: Optional[Path]) -> None:
+        self._path = path
+        self._channels: Dict[str, Dict[str, Any]] = {}
+        self._processes: Dict[int, Optional[int]] = {}  # PID -> start time in clock ticks since boot
+        self._loaded = False
+        self._save_handle: Optional[asyncio.TimerHandle] = None
+
+    def load(self) -> tuple:
+        """Take over from the previous run; returns (channels it had on air, {PID: start ticks} it left)"""
+        state: Dict[str, Any] = {}
+        if self._path is not None and self._path.exists():
+            try:
+                state = json.loads(self._path.read_text(encoding="utf-8"))
+            except (OSError, ValueError) as e:
+                logger.error(f"Failed to read state from {self._path}: {e}")
+        self._channels = dict(state.get("channels") or {})
+        left = {int(pid): ticks for pid, ticks in (state.get("processes") or {}).items()}
+        self._loaded = True
+        self._save()
+        return dict(self._channels), left
+
+    def want(self, channel_id: str, request: Dict[str, Any]) -> None:
+        self._channels[channel_id] = request
+        self._save()
+
+    def forget(self, channel_id: str) -> None:
+        if self._channels.pop(channel_id, None) is not None:
+            self._save()
+
+    def track(self, pid: int) -> None:
+        usage = process_usage(pid)
+        self._processes[pid] = usage["start_ticks"] if usage is not None else None
+        self._save_soon()
+
+    def untrack(self, pid: int) -> None:
+        if self._processes.pop(pid, False) is not False:
+            self._save_soon()
+
+    def _save_soon(self) -> None:
+        if self._loaded and self._save_handle is None:
+            self._save_handle = asyncio.get_running_loop().call_later(STATE_SAVE_DELAY, self._save)
+
+    def _save(self) -> None:
+        if self._save_handle is not None:
+            self._save_handle.cancel()
+            self._save_handle = None
+        if not self._loaded or self._path is None:
+            return
+        state = {"channels": self._channels, "processes": {str(pid): t for pid, t in self._processes.items()}}
+        try:
+            # Start requests hold stream keys, so only the owner may read them
+            write_private_json(self._path, state)
+        except OSError as e:
+            logger.error(f"Failed to save state to {self._path}: {e}")
+
+    def flush(self) -> None:
+        """Write pending PID changes now (on shutdown)"""
+        self._save()
+
+
+state_store = StateStore(STATE_PATH)
+
+
+def kill_orphans(processes: Dict[int, Optional[int]]) -> int:
+    """Kill the FFmpegs a previous run left behind (e.g. it was killed); returns how many.
+
+    They cannot be taken over, since their pipes ended with that run, and
+    one still holding an RTMP session would keep its stream key busy. A PID
+    is only killed if it still names an ffmpeg started at the recorded time,
+    which needs /proc (Linux); elsewhere nothing is killed.
+    """
+    killed = 0
+    for pid, start_ticks in processes.items():
+        usage = process_usage(pid)
+        if usage is None or start_ticks is None or usage["start_ticks"] != start_ticks:
+            continue  # Gone, or the PID now belongs to another process
+        try:
+            with open(f"/proc/{pid}/comm") as f:
+                if f.read().strip() != "ffmpeg":
+                    continue
+            os.kill(pid, signal.SIGKILL)
+        except OSError:
+            continue
+        logger.warning(f"Killed FFmpeg (PID: {pid}) left behind by the previous run")
+        killed += 1
+    return killed
+
+
+def _process_started() -> float:
+    """Monotonic time this process started (from /proc on Linux, else now), to time a resume from"""
+    usage = process_usage(os.getpid())
+    try:
+        with open("/proc/uptime") as f:
+            uptime = float(f.read().split()[0])
+    except (OSError, ValueError):
+        return time.monotonic()
+    if usage is None:
+        return time.monotonic()
+    return time.monotonic() - max(0.0, uptime - usage["start_ticks"] / _CLK_TCK)
+
+
+PROCESS_STARTED = _process_started()
+STARTUP_SECONDS: Dict[str, float] = {}  # Startup phase -> seconds after the process started that it was reached
+
+
+def startup_mark(phase: str) -> None:
+    """Record and log the first time a startup phase (app_start, ready, first_request, first_output) is reached"""
+    if phase not in STARTUP_SECONDS:
+        STARTUP_SECONDS[phase] = seconds = time.monotonic() - PROCESS_STARTED
+        logger.info(f"Startup: {phase.replace('_', ' ')} {seconds:.2f}s after the process started")
+
+
+# Metrics families in exposition order: name -> (type, help)
+_METRICS = {
+    "quranstream_channels": ("gauge", "Channels known to the server"),
+    "quranstream_startup_seconds": ("gauge", "Seconds from process start until each startup phase was reached"),
+    "quranstream_resume_seconds": ("gauge", "Seconds from server start until a channel resumed from saved state was on air"),
+    "quranstream_channel_up": ("gauge", "1 while the channel's feed and at least one encoder are running"),
+    "quranstream_feed_up": ("gauge", "1 while the channel's feed process is running"),
+    "quranstream_feeds": ("gauge", "Feed processes, each shared by every channel playing its station"),
+    "quranstream_feeds_idle": ("gauge", "Feed processes no channel uses, kept for SOURCE_GRACE_S"),
+    "quranstream_relay_bytes_in_total": ("counter", "PCM bytes read from the feed"),
+    "quranstream_relay_bytes_out_total": ("counter", "PCM bytes written per encoder, including filler"),
+    "quranstream_relay_buffer_fill_bytes": ("gauge", "PCM buffered between the feed and the encoders"),
+    "quranstream_relay_buffer_size_bytes": ("gauge", "Relay ring buffer size"),
+    "quranstream_relay_underruns_total": ("counter", "Times the feed ran dry and filler was sent"),
+    "quranstream_relay_underrun_seconds_total": ("counter", "Time spent sending filler"),
+    "quranstream_relay_dropped_bytes_total": ("counter", "Buffered PCM dropped to stay near live"),
+    "quranstream_relay_read_stalls_total": ("counter", "Times the feed found the buffer full and older audio was dropped"),
+    "quranstream_relay_write_stalls_total": ("counter", "Writes that found an encoder's pipe full or took over 100 ms"),
+    "quranstream_relay_clock_resets_total": ("counter", "Relay clock restarts after the loop was held up"),
+    "quranstream_loudness_lufs": ("gauge", "Loudness of the channel's audio before normalization, by window"),
+    "quranstream_loudness_gain_db": ("gauge", "Gain the loudness normalizer applies"),
+    "quranstream_limiter_gain_db": ("gauge", "Gain the limiter applies right now (0 when it is not limiting)"),
+    "quranstream_output_peak_dbfs": ("gauge", "Sample peak of the last tick sent to the encoders"),
+    "quranstream_output_rms_dbfs": ("gauge", "RMS level of the last tick sent to the encoders"),
+    "quranstream_loudness_load": ("gauge", "Seconds spent normalizing per second of audio"),
+    "quranstream_destination_up": ("gauge", "1 while the destination's encoder is running"),
+    "quranstream_destination_bytes_total": ("counter", "PCM bytes delivered to the destination's encoder"),
+    "quranstream_destination_dropped_bytes_total": ("counter", "PCM bytes the destination's encoder missed"),
+    "quranstream_process_restarts_total": ("counter", "Automatic restarts of a feed, main or direct FFmpeg"),
+    "quranstream_process_circuit_open": ("gauge", "1 while restarts are suspended after repeated failures"),
+    "quranstream_process_speed": ("gauge", "Processing speed from FFmpeg -progress (1.0 = real time)"),
+    "quranstream_process_drift_seconds": ("gauge", "How far the process has fallen behind real time since it started"),
+    "quranstream_process_cpu_seconds_total": ("counter", "CPU time of a running process"),
+    "quranstream_process_resident_memory_bytes": ("gauge", "Resident memory of a running process"),
+    "quranstream_http_listeners": ("gauge", "Connected HTTP listeners"),
+    "quranstream_http_dropped_listeners_total": ("counter", "HTTP listeners disconnected for being too slow"),
+}
+
+
+def render_metrics() -> str:
+    """Current state of every channel in the Prometheus text exposition format"""
+    samples: Dict[str, List[tuple]] = {name: [] for name in _METRICS}
+
+    def add(name: str, labels: Dict[str, object], value) -> None:
+        if value is not None:
+            samples[name].append((labels, value))
+
+    def add_progress(labels: Dict[str, object], progress: Optional[Dict[str, object]]) -> None:
+        if progress is not None:
+            add("quranstream_process_speed", labels, progress["speed"])
+            add("quranstream_process_drift_seconds", labels, progress["drift_s"])
+
+    def add_process(labels: Dict[str, object], pid: int) -> None:
+        usage = process_usage(pid)
+        if usage is not None:
+            add("quranstream_process_cpu_seconds_total", {**labels, "pid": pid}, usage["cpu"])
+            add("quranstream_process_resident_memory_bytes", {**labels, "pid": pid}, usage["rss"])
+
+    manager = StreamManager()
+    channels = manager.channels()
+    add("quranstream_channels", {}, len(channels))
+    for phase, seconds in STARTUP_SECONDS.items():
+        add("quranstream_startup_seconds", {"phase": phase}, round(seconds, 3))
+    for channel_id, seconds in manager.resumed.items():
+        add("quranstream_resume_seconds", {"channel": channel_id}, round(seconds, 3) if seconds is not None else None)
+    add_process({"channel": "", "role": "app", "destination": ""}, os.getpid())
+    feeds = [feed for feed in source_pool.feeds() if feed.running()]
+    add("quranstream_feeds", {}, len(feeds))
+    add("quranstream_feeds_idle", {}, sum(1 for feed in feeds if not feed.refs))
+    for feed in feeds:
+        # A shared feed is counted once, not under each of its channels
+        add_process({"channel": "", "role": "feed", "destination": ""}, feed.process.pid)
+    for channel in channels:
+        status = channel.get_status()
+        ch = {"channel": channel.channel_id}
+        relay = status["relay"]
+        add("quranstream_channel_up", ch, int(status["running"]))
+        add("quranstream_feed_up", ch, int(status["feed_running"]))
+        add("quranstream_relay_bytes_in_total", ch, relay["bytes_in"])
+        add("quranstream_relay_bytes_out_total", ch, relay["bytes_out"])
+        add("quranstream_relay_buffer_fill_bytes", ch, relay["buffer_fill"])
+        add("quranstream_relay_buffer_size_bytes", ch, relay["buffer_size"])
+        add("quranstream_relay_underruns_total", ch, relay["underruns"])
+        add("quranstream_relay_underrun_seconds_total", ch, relay["underrun_ms"] / 1000)
+        add("quranstream_relay_dropped_bytes_total", ch, relay["dropped_bytes"])
+        add("quranstream_relay_read_stalls_total", ch, relay["read_stalls"])
+        add("quranstream_relay_write_stalls_total", ch, relay["write_stalls"])
+        add("quranstream_relay_clock_resets_total", ch, relay["clock_resets"])
+        loudness = relay["loudness"]
+        if loudness is not None:
+            for window in ("momentary", "short_term", "integrated"):
+                add("quranstream_loudness_lufs", {**ch, "window": window}, loudness[f"{window}_lufs"])
+            add("quranstream_loudness_gain_db", ch, loudness["gain_db"])
+            add("quranstream_limiter_gain_db", ch, loudness["limiter_db"])
+            add("quranstream_output_peak_dbfs", ch, loudness["peak_dbfs"])
+            add("quranstream_output_rms_dbfs", ch, loudness["rms_dbfs"])
+            add("quranstream_loudness_load", ch, loudness["load"])
+        feed = {**ch, "role": "feed", "destination": ""}
+        add("quranstream_process_restarts_total", feed, status["feed"]["restarts"])
+        add("quranstream_process_circuit_open", feed, int(status["feed"]["circuit"] == RestartPolicy.OPEN))
+        add_progress(feed, status["feed"]["progress"])
+        # Destinations are labelled by position: their RTMP URLs contain stream keys
+        for i, dest in enumerate(status["destinations"]):
+            labels = {**ch, "destination": str(i)}
+            add("quranstream_destination_up", labels, int(dest["running"]))
+            add("quranstream_destination_bytes_total", labels, dest["bytes"])
+            add("quranstream_destination_dropped_bytes_total", labels, dest["dropped_bytes"])
+            main_labels = {**ch, "role": dest["role"], "destination": str(i)}
+            add("quranstream_process_restarts_total", main_labels, dest["restarts"])
+            add("quranstream_process_circuit_open", main_labels, int(dest["circuit"] == RestartPolicy.OPEN))
+            add_progress(main_labels, dest["progress"])
+        for role, destination, pid in channel.processes():
+            add_process({**ch, "role": role, "destination": destination}, pid)
+        add("quranstream_http_listeners", ch, status["http"]["listeners"])
+        add("quranstream_http_dropped_listeners_total", ch, status["http"]["dropped_listeners"])
+
+    lines: List[str] = []
+    for name, (kind, help_text) in _METRICS.items():
+        lines.append(f"# HELP {name} {help_text}")
+        lines.append(f"# TYPE {name} {kind}")
+        for labels, value in samples[name]:
+            lines.append(f"{name}{_prom_labels(labels)} {value}")
+    for histogram in (RELAY_WRITE_SECONDS, SWITCH_SECONDS, API_REQUEST_SECONDS):
+        histogram.render(lines)
+    return "\n".join(lines) + "\n"
+
+
+@app.middleware("http")
+async def time_api_requests(request: Request, call_next):
+    """Record control API latency per route"""
+    if not request.url.path.startswith("/api/"):
+        return await call_next(request)
+    started = time.perf_counter()
+    response = await call_next(request)
+    route = request.scope.get("route")
+    API_REQUEST_SECONDS.observe(time.perf_counter() - started, request.method,
+                                getattr(route, "path", "unmatched"), str(response.status_code))
+    return response
+
+
+@app.get("/metrics")
+async def metrics():
+    return Response(content=render_metrics(), media_type="text/plain; version=0.0.4; charset=utf-8")
+
+
+_index_page: Optional[tuple] = None  # (template mtime_ns, rendered page)
+
+
+def index_page() -> bytes:
+    """The web UI, rendered once and again only when its template changes"""
+    global _index_page
+    stamp = (TEMPLATES_DIR / "index.html").stat().st_mtime_ns
+    if _index_page is None or _index_page[0] != stamp:
+        from fastapi.templating import Jinja2Templates  # Pulls in Jinja2, which nothing else needs
+        page = Jinja2Templates(directory=str(TEMPLATES_DIR)).get_template("index.html").render()
+        _index_page = (stamp, page.encode("utf-8"))
+    return _index_page[1]
+
+
+@app.get("/", response_class=HTMLResponse)
+async def index():
+    return HTMLResponse(index_page())
+
+
+_station_bodies: Dict[tuple, tuple] = {}  # (sort, reachable) -> (catalog ETag, probe version, body, ETag)
+
+
+def _latency_rank(station: Dict) -> tuple:
+    """Reachable stations by time to first byte, then unprobed ones, then those that are down"""
+    health = station["health"]
+    if health is None:
+        return (1, 0.0)
+    if not health["ok"]:
+        return (2, 0.0)
+    return (0, health["ttfb_ms"])
+
+
+def stations_body(sort: Optional[str] = None, reachable: bool = False) -> tuple:
+    """The station list with each station's latest probe result, and its ETag; re-serialized only on change"""
+    catalog_etag = station_catalog.json_body()[1]
+    cached = _station_bodies.get((sort, reachable))
+    if cached is not None and cached[:2] == (catalog_etag, source_prober.version):
+        return cached[2:]
+    stations = [{**s, "health": source_prober.result(s["url"])} for s in station_catalog.stations()]
+    if reachable:
+        stations = [s for s in stations if s["health"] is not None and s["health"]["ok"]]
+    if sort == "latency":
+        stations.sort(key=_latency_rank)
+    body = json.dumps(stations, ensure_ascii=False, separators=(",", ":")).encode("utf-8")
+    etag = '"%s"' % hashlib.sha1(body).hexdigest()[:20]
+    _station_bodies[(sort, reachable)] = (catalog_etag, source_prober.version, body, etag)
+    return body, etag
+
+
+@app.get("/api/stations")
+async def get_stations(request: Request, sort: Optional[str] = None, reachable: bool = False):
+    if sort not in (None, "latency"):
+        return JSONResponse(status_code=400, content={"error": "sort must be 'latency'"})
+    try:
+        body, etag = stations_body(sort, reachable)
+    except Exception as e:
+        return JSONResponse(status_code=500, content={"error": f"Failed to read M3U file: {e}"})
+    headers = {"ETag": etag, "Cache-Control": "no-cache"}
+    if etag_matches(request.headers.get("if-none-match"), etag):
+        return Response(status_code=304, headers=headers)
+    return Response(content=body, media_type="application/json", headers=headers)
+
+
+def _parse_targets(raw: Any) -> Optional[List[str]]:
+    """Extra RTMP destinations from a start request, as full URLs; None if malformed"""
+    if raw is None:
+        return []
+    if not isinstance(raw, list):
+        return None
+    targets = []
+    for target in raw:
+        if isinstance(target, str) and target.strip():
+            targets.append(target.strip())
+        elif isinstance(target, dict) and target.get("rtmp_server") and target.get("key"):
+            targets.append(build_rtmp_url(str(target["rtmp_server"]), str(target["key"])))
+        else:
+            return None
+    return targets
+
+
+def _resolve_station(item: Any) -> Optional[Dict[str, str]]:
+    """{"url", "name"} of a catalog station id or a stream URL; None if it is neither"""
+    if isinstance(item, int) and not isinstance(item, bool):
+        station = station_catalog.get_by_id(item)
+    elif isinstance(item, str) and item.strip():
+        station = station_catalog.get_by_url(item.strip()) or {"url": item.strip(), "name": item.strip()}
+    else:
+        station = None
+    return {"url": station["url"], "name": station["name"]} if station else None
+
+
+def _parse_fallbacks(raw: Any) -> Optional[List[Dict[str, str]]]:
+    """Fallback stations from a start request (station ids or URLs), in order; None if malformed"""
+    if raw is None:
+        return []
+    if not isinstance(raw, list):
+        return None
+    fallbacks = [_resolve_station(item) for item in raw]
+    return None if None in fallbacks else fallbacks
+
+
+def _parse_crossfade(raw: Any) -> Optional[int]:
+    """Crossfade length in ms (0-MAX_CROSSFADE_MS), or None if invalid; a start and a schedule accept the same"""
+    if raw is None:
+        return 0
+    if not isinstance(raw, int) or isinstance(raw, bool) or not 0 <= raw <= MAX_CROSSFADE_MS:
+        return None
+    return raw
+
+
+def _parse_profile(raw: Any) -> tuple:
+    """(encoder profile, None) from a preset name or {"preset", "bitrate_kbps", "sample_rate", "mono", "codec"},
+    or (None, error message); no profile given means ENCODER_PROFILE"""
+    if raw is None:
+        raw = ENCODER_PROFILE
+    if isinstance(raw, str):
+        raw = {"preset": raw}
+    if not isinstance(raw, dict):
+        return None, "profile must be a preset name or an object"
+    preset = raw.get("preset", ENCODER_PROFILE)
+    if preset not in ENCODER_PROFILES:
+        return None, f"profile preset must be one of {', '.join(ENCODER_PROFILES)}"
+    unknown = set(raw) - {"preset", *ENCODER_PROFILES[preset]}
+    if unknown:
+        return None, f"unknown profile fields: {', '.join(sorted(unknown))}"
+    profile = {"preset": preset, **ENCODER_PROFILES[preset], **raw}
+    if profile["codec"] not in ENCODER_CODECS:
+        return None, f"codec must be one of {', '.join(ENCODER_CODECS)}"
+    if profile["codec"] == "copy":
+        return {"preset": preset, **ENCODER_PROFILES["passthrough"], "codec": "copy"}, None
+    kbps, rate, mono = profile["bitrate_kbps"], profile["sample_rate"], profile["mono"]
+    if not isinstance(kbps, int) or isinstance(kbps, bool) or not 8 <= kbps <= ENCODER_MAX_KBPS:
+        return None, f"bitrate_kbps must be 8-{ENCODER_MAX_KBPS}"
+    if rate not in ENCODER_SAMPLE_RATES:
+        return None, f"sample_rate must be one of {', '.join(map(str, ENCODER_SAMPLE_RATES))}"
+    if not isinstance(mono, bool):
+        return None, "mono must be true or false"
+    if mono and profile["codec"] == "he-aac-v2":
+        return None, "he-aac-v2 needs stereo"
+    return profile, None
+
+
+def _parse_schedule(payload: Dict[str, Any]) -> tuple:
+    """(schedule, None) from a schedule request, or (None, error message)"""
+    targets = _parse_targets(payload.get("targets"))
+    if targets is None:
+        return None, "targets must be a list of RTMP URLs or {rtmp_server, key} objects"
+    rtmp_server, key = payload.get("rtmp_server", ""), payload.get("key", "")
+    if not targets and (not rtmp_server or not key):
+        return None, "Missing rtmp_server or key"
+    switch_mode = payload.get("switch", SWITCH_GAPLESS)
+    if switch_mode not in (SWITCH_GAPLESS, SWITCH_HARD):
+        return None, "switch must be 'gapless' or 'hard'"
+    crossfade_ms = _parse_crossfade(payload.get("crossfade_ms"))
+    if crossfade_ms is None:
+        return None, f"crossfade_ms must be 0-{MAX_CROSSFADE_MS}"
+    profile, error = _parse_profile(payload.get("profile"))
+    if error:
+        return None, error
+    if profile["codec"] == "copy":
+        return None, "the passthrough profile needs direct mode, which schedules do not use"
+    schedule = {"rtmp_server": rtmp_server, "key": key, "targets": targets, "switch": switch_mode,
+                "crossfade_ms": crossfade_ms, "profile": profile}
+    slots, rotate = payload.get("slots"), payload.get("rotate")
+    if (slots is None) == (rotate is None):
+        return None, "give either slots or rotate"
+    if slots is not None:
+        if not isinstance(slots, list) or not slots:
+            return None, "slots must be a non-empty list of {at: 'HH:MM', station}"
+        parsed = []
+        for slot in slots:
+            at = slot.get("at") if isinstance(slot, dict) else None
+            station = _resolve_station(slot.get("station")) if isinstance(slot, dict) else None
+            if not isinstance(at, str) or not SLOT_TIME_RE.match(at) or station is None:
+                return None, "slots must be a non-empty list of {at: 'HH:MM', station}"
+            parsed.append({"at": at, "station": station})
+        parsed.sort(key=lambda slot: slot["at"])
+        if len({slot["at"] for slot in parsed}) < len(parsed):
+            return None, "two slots start at the same time"
+        schedule["slots"] = parsed
+    else:
+        stations = rotate.get("stations") if isinstance(rotate, dict) else None
+        every = rotate.get("every_minutes") if isinstance(rotate, dict) else None
+        resolved = [_resolve_station(item) for item in stations] if isinstance(stations, list) else []
+        if not resolved or None in resolved or not isinstance(every, int) or isinstance(every, bool) or every < 1:
+            return None, "rotate needs a list of stations and every_minutes >= 1"
+        schedule["rotate"] = {"stations": resolved, "every_minutes": every}
+    return schedule, None
+
+
+async def _start_channel(channel_id: str, payload: Dict[str, Any]):
+    url = payload.get("url")
+    rtmp_server = payload.get("rtmp_server", "")
+    key = payload.get("key", "")
+    targets = _parse_targets(payload.get("targets"))
+    if targets is None:
+        return JSONResponse(status_code=400, content={"error": "targets must be a list of RTMP URLs or {rtmp_server, key} objects"})
+    if not url or (not targets and (not rtmp_server or not key)):
+        return JSONResponse(status_code=400, content={"error": "Missing url, rtmp_server, or key"})
+    switch_mode = payload.get("switch", SWITCH_GAPLESS)
+    if switch_mode not in (SWITCH_GAPLESS, SWITCH_HARD):
+        return JSONResponse(status_code=400, content={"error": "switch must be 'gapless' or 'hard'"})
+    crossfade_ms = _parse_crossfade(payload.get("crossfade_ms"))
+    if crossfade_ms is None:
+        return JSONResponse(status_code=400, content={"error": f"crossfade_ms must be 0-{MAX_CROSSFADE_MS}"})
+    fallbacks = _parse_fallbacks(payload.get("fallbacks"))
+    if fallbacks is None:
+        return JSONResponse(status_code=400, content={"error": "fallbacks must be a list of station ids or URLs"})
+    mode = payload.get("mode", MODE_RELAY)
+    if mode not in (MODE_RELAY, MODE_DIRECT):
+        return JSONResponse(status_code=400, content={"error": "mode must be 'relay' or 'direct'"})
+    if mode == MODE_DIRECT and fallbacks:
+        return JSONResponse(status_code=400, content={"error": "direct mode does not support fallbacks"})
+    profile, error = _parse_profile(payload.get("profile"))
+    if error:
+        return JSONResponse(status_code=400, content={"error": error})
+    if profile["codec"] == "copy" and mode != MODE_DIRECT:
+        return JSONResponse(status_code=400, content={"error": "the passthrough profile needs direct mode"})
+    error = await ffmpeg_missing(profile)
+    if error:
+        # Fail before probing the station; a missing FFmpeg is the server's fault, not the request's
+        return JSONResponse(status_code=500 if error == FFMPEG_NOT_FOUND else 400, content={"error": error})
+
+    # Find station name by URL (optional)
+    station_name: Optional[str] = None
+    try:
+        match = station_catalog.get_by_url(url)
+        station_name = match["name"] if match else None
+    except Exception:
+        station_name = None
+
+    result = await StreamManager().start_stream(
+        url, rtmp_server, key, station_name,
+        channel_id=channel_id, targets=targets, switch_mode=switch_mode, crossfade_ms=crossfade_ms,
+        fallbacks=fallbacks, mode=mode, profile=profile,
+    )
+    if "error" in result:
+        return JSONResponse(status_code=500, content=result)
+    return result
+
+
+async def _stop_channel(channel_id: str):
+    return await StreamManager().stop_stream(channel_id)
+
+
+def _get_schedule(channel_id: str):
+    schedule = scheduler.get(channel_id)
+    if schedule is None:
+        return JSONResponse(status_code=404, content={"error": "No schedule for this channel"})
+    return schedule
+
+
+def _set_schedule(channel_id: str, payload: Dict[str, Any]):
+    schedule, error = _parse_schedule(payload)
+    if error:
+        return JSONResponse(status_code=400, content={"error": error})
+    scheduler.set(channel_id, schedule)
+    return scheduler.get(channel_id)
+
+
+def _delete_schedule(channel_id: str):
+    if not scheduler.remove(channel_id):
+        return JSONResponse(status_code=404, content={"error": "No schedule for this channel"})
+    return {"status": "removed"}
+
+
+PROGRESS_STREAM_HEARTBEAT = 5.0  # Seconds between lines while nothing reports progress
+
+
+def _progress_stream(channel_id: str):
+    """Newline-delimited JSON: a channel's progress, one line per -progress update"""
+    channel = StreamManager().get_channel(channel_id)
+    if channel is None:
+        return JSONResponse(status_code=404, content={"error": "Unknown channel"})
+
+    async def lines():
+        while True:
+            yield json.dumps(channel.progress()).encode("utf-8") + b"\n"
+            if await channel.progress_updates.wait(PROGRESS_STREAM_HEARTBEAT):
+                # The channel's other processes report at about the same time; send them in one line
+                await asyncio.sleep(0.05)
+
+    return StreamingResponse(lines(), media_type="application/x-ndjson", headers={"Cache-Control": "no-cache"})
+
+
+LOGS_STREAM_HEARTBEAT = 15.0  # Seconds between empty lines on a quiet followed log
+LOGS_MAX_TAIL = 1000
+
+
+def _logs(channel_id: str, tail: int, since: int, level: str, follow: bool):
+    """A channel's FFmpeg stderr lines, oldest first; with follow, newline-delimited JSON that keeps going"""
+    if not 0 <= tail <= LOGS_MAX_TAIL:
+        return JSONResponse(status_code=400, content={"error": f"tail must be 0-{LOGS_MAX_TAIL}"})
+    if level not in LOG_LEVELS:
+        return JSONResponse(status_code=400, content={"error": f"level must be one of {', '.join(LOG_LEVELS)}"})
+    channel = StreamManager().get_channel(channel_id)
+    if channel is None:
+        return JSONResponse(status_code=404, content={"error": "Unknown channel"})
+    # Pass seq back as since to get only what came after this response
+    seq = max(since, channel.logs.seq)
+    lines = channel.logs.lines(since, level, tail)
+    if not follow:
+        return {"channel": channel_id, "seq": seq, "lines": lines}
+
+    async def stream(lines, seq):
+        while True:
+            for line in lines:
+                yield json.dumps(line).encode("utf-8") + b"\n"
+            seq = max(seq, lines[-1]["seq"]) if lines else seq
+            lines = channel.logs.lines(seq, level)
+            if not lines:
+                if not await channel.logs.updates.wait(LOGS_STREAM_HEARTBEAT):
+                    yield b"\n"
+                lines = channel.logs.lines(seq, level)
+
+    return StreamingResponse(stream(lines, seq), media_type="application/x-ndjson",
+                             headers={"Cache-Control": "no-cache", "X-Accel-Buffering": "no"})
+
+
+EVENTS_HEARTBEAT = 15.0  # Seconds between keep-alive comments on an idle /api/events stream
+
+
+def _sse(seq: int, kind: str, data: object) -> bytes:
+    return f"id: {seq}\nevent: {kind}\ndata: {json.dumps(data)}\n\n".encode("utf-8")
+
+
+async def _event_stream(last_event_id: Optional[str]):
+    """Server-sent events: a snapshot of every channel, then status, restart and switch events as they happen"""
+    seq = int(last_event_id) if last_event_id and last_event_id.isdigit() else -1
+    pending = event_bus.since(seq) if seq >= 0 else None
+    while True:
+        if pending is None:
+            # New subscriber, or one that missed events: start over from the current state
+            snapshot = StreamManager().snapshot()
+            seq = event_bus.seq
+            yield _sse(seq, "snapshot", snapshot)
+            pending = []
+        for seq, kind, data in pending:
+            yield _sse(seq, kind, data)
+        if event_bus.seq == seq and not await event_bus.wait(EVENTS_HEARTBEAT):
+            yield b": keep-alive\n\n"
+        pending = event_bus.since(seq)
+
+
+def _invalid_channel(channel_id: str) -> Optional[JSONResponse]:
+    if CHANNEL_ID_RE.match(channel_id):
+        return None
+    return JSONResponse(status_code=400, content={"error": "Invalid channel id"})
+
+
+@app.post("/api/start")
+async def api_start(payload: Dict[str, Any]):
+    return await _start_channel(DEFAULT_CHANNEL, payload)
+
+
+@app.post("/api/stop")
+async def api_stop():
+    return await _stop_channel(DEFAULT_CHANNEL)
+
+
+@app.get("/api/status")
+async def api_status():
+    status = StreamManager().get_status()
+    return status
+
+
+@app.get("/api/events")
+async def api_events(request: Request):
+    return StreamingResponse(
+        _event_stream(request.headers.get("last-event-id")),
+        media_type="text/event-stream",
+        headers={"Cache-Control": "no-cache", "X-Accel-Buffering": "no"},
+    )
+
+
+@app.get("/api/progress")
+async def api_progress():
+    return _progress_stream(DEFAULT_CHANNEL)
+
+
+@app.get("/api/logs")
+async def api_logs(tail: int = 100, since: int = 0, level: str = "debug", follow: bool = False):
+    return _logs(DEFAULT_CHANNEL, tail, since, level, follow)
+
+
+@app.get("/api/channels")
+async def api_channels():
+    return [channel.get_status() for channel in StreamManager().channels()]
+
+
+@app.post("/api/channels/{channel_id}/start")
+async def api_channel_start(channel_id: str, payload: Dict[str, Any]):
+    return _invalid_channel(channel_id) or await _start_channel(channel_id, payload)
+
+
+@app.post("/api/channels/{channel_id}/stop")
+async def api_channel_stop(channel_id: str):
+    return _invalid_channel(channel_id) or await _stop_channel(channel_id)
+
+
+@app.get("/api/channels/{channel_id}/status")
+async def api_channel_status(channel_id: str):
+    return _invalid_channel(channel_id) or StreamManager().get_status(channel_id)
+
+
+@app.get("/api/channels/{channel_id}/progress")
+async def api_channel_progress(channel_id: str):
+    return _invalid_channel(channel_id) or _progress_stream(channel_id)
+
+
+@app.get("/api/channels/{channel_id}/logs")
+async def api_channel_logs(channel_id: str, tail: int = 100, since: int = 0, level: str = "debug",
+                           follow: bool = False):
+    return _invalid_channel(channel_id) or _logs(channel_id, tail, since, level, follow)
+
+
+@app.get("/api/schedules")
+async def api_schedules():
+    return scheduler.schedules()
+
+
+@app.get("/api/channels/{channel_id}/schedule")
+async def api_channel_schedule(channel_id: str):
+    return _invalid_channel(channel_id) or _get_schedule(channel_id)
+
+
+@app.put("/api/channels/{channel_id}/schedule")
+async def api_set_channel_schedule(channel_id: str, payload: Dict[str, Any]):
+    return _invalid_channel(channel_id) or _set_schedule(channel_id, payload)
+
+
+@app.delete("/api/channels/{channel_id}/schedule")
+async def api_delete_channel_schedule(channel_id: str):
+    return _invalid_channel(channel_id) or _delete_schedule(channel_id)
+
+
+FFMPEG_WARMUP = os.environ.get("FFMPEG_WARMUP", "1") != "0"  # Run a short test encode at startup
+
+
+async def warm_up() -> None:
+    """Check FFmpeg once and run a short encode through the default profile.
+
+    A missing FFmpeg or encoder shows up in the log right away instead of on
+    the first start, and the binary and its codecs are in the page cache
+    before the first channel needs them.
+    """
+    info = await ffmpeg_info()
+    if info["path"] is None:
+        logger.error(f"{FFMPEG_NOT_FOUND}; channels cannot start")
+        return
+    profile = ENCODER_PROFILES[ENCODER_PROFILE]
+    logger.info(f"FFmpeg {info['version']} at {info['path']}, {len(info['encoders'])} audio encoders" +
+                ("" if "libfdk_aac" in info["encoders"] else ", no libfdk_aac (HE-AAC profiles unavailable)"))
+    error = await ffmpeg_missing(profile)
+    if error:
+        logger.error(f"{error}; channels cannot start with the {ENCODER_PROFILE} profile")
+        return
+    if not FFMPEG_WARMUP:
+        return
+    t0 = time.monotonic()
+    cmd = ["ffmpeg", "-hide_banner", "-loglevel", "error", "-nostats", "-f", "s16le", "-ar", "44100", "-ac", "2",
+           "-probesize", "32", "-analyzeduration", "0", "-t", "0.5", "-i", "/dev/zero"] + encoder_args(profile)
+    cmd += ["-map", "0:a", "-f", "tee", "[f=flv]/dev/null|[f=adts]/dev/null"]
+    try:
+        proc = await asyncio.create_subprocess_exec(*cmd, stdin=subprocess.DEVNULL, stdout=subprocess.DEVNULL,
+                                                    stderr=subprocess.PIPE)
+        _, err = await proc.communicate()
+    except OSError as e:
+        logger.error(f"FFmpeg warm-up failed: {e}")
+        return
+    if proc.returncode != 0:
+        lines = err.decode("utf-8", errors="replace").strip().splitlines()
+        logger.error(f"FFmpeg warm-up encode failed with code {proc.returncode}: {lines[-1] if lines else ''}")
+        return
+    logger.info(f"FFmpeg warm-up encode took {(time.monotonic() - t0) * 1000:.0f} ms")
+
+
+class FirstRequestTimer:
+    """ASGI middleware that marks when the first HTTP request came in"""
+
+    def __init__(self, app) -> None:
+        self.app = app
+        self.seen = False
+
+    async def __call__(self, scope, receive, send):
+        if not self.seen and scope["type"] == "http":
+            self.seen = True
+            startup_mark("first_request")
+        await self.app(scope, receive, send)
+
+
+app.add_middleware(FirstRequestTimer)
+
+
+@app.on_event("startup")
+async def startup_event():
+    startup_mark("app_start")
+    app.state.warmup_task = asyncio.create_task(warm_up())
+    # Parse the catalog and render the pages now rather than in the first requests
+    station_catalog.stations()
+    stations_body("latency", False)
+    index_page()
+    channels, left = state_store.load()
+    if left:
+        kill_orphans(left)
+    scheduler.start()
+    # Scheduled channels are brought back by the scheduler, on whatever is due now
+    channels = {cid: request for cid, request in channels.items() if scheduler.get(cid) is None}
+    if channels:
+        app.state.resume_task = asyncio.create_task(StreamManager().resume(channels, PROCESS_STARTED))
+    if PROBE_INTERVAL > 0:
+        app.state.prober_task = asyncio.create_task(
+            source_prober.run(lambda: [s["url"] for s in station_catalog.stations()])
+        )
+    startup_mark("ready")
 
 
 @app.on_event("shutdown")
 async def shutdown_event():
     """Cleanup on shutdown"""
     logger.info("Shutting down, stopping streams...")
-    StreamManager().stop_stream()
+    scheduler.stop()
+    for name in ("resume_task", "warmup_task"):
+        if getattr(app.state, name, None) is not None:
+            getattr(app.state, name).cancel()
+    # Channels stay in the saved state, so the next start brings them back
+    await StreamManager().stop_all(forget=False)
+    state_store.flush()
+    if getattr(app.state, "prober_task", None) is not None:
+        app.state.prober_task.cancel()
+    source_prober.close()
     
     # Shutdown HTTP server
     global http_server
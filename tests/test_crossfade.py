@@ -0,0 +1,60 @@
+import array
+import sys
+
+import pytest
+
+import main
+
+pytest.importorskip("numpy")
+
+
+def pcm(*samples: int) -> bytearray:
+    data = array.array("h", samples)
+    if sys.byteorder == "big":
+        data.byteswap()
+    return bytearray(data.tobytes())
+
+
+def samples(data) -> list:
+    data = array.array("h", bytes(data))
+    if sys.byteorder == "big":
+        data.byteswap()
+    return list(data)
+
+
+def test_weights_are_linear_per_frame_from_old_to_new():
+    # 4-frame fade from full scale (old) to silence (new), both channels alike
+    new = pcm(*[0] * 8)
+    main.crossfade_pcm(bytes(pcm(*[20000, -20000] * 4)), memoryview(new), 0, 4)
+    assert samples(new) == [20000, -20000, 15000, -15000, 10000, -10000, 5000, -5000]
+
+
+def test_fade_applied_a_chunk_at_a_time_matches_one_pass():
+    frames = 5  # Odd, and split 3 + 2 like two ticks would
+    old = bytes(pcm(*range(1000, 1000 + 2 * frames)))
+    whole = pcm(*range(-5000, -5000 + 2 * frames))
+    parts = bytearray(whole)
+    main.crossfade_pcm(old, memoryview(whole), 0, frames)
+    view = memoryview(parts)
+    main.crossfade_pcm(old[:12], view[:12], 0, frames)
+    main.crossfade_pcm(old[12:], view[12:], 3, frames)
+    assert parts == whole
+
+
+def test_endpoints_of_an_odd_length_tail():
+    frames = 7
+    old = bytes(pcm(*[14000, 7000] * frames))
+    new = pcm(*[-7000, 0] * frames)
+    main.crossfade_pcm(old, memoryview(new), 0, frames)
+    result = samples(new)
+    # The first frame is all old; the last is one step short of all new
+    assert result[:2] == [14000, 7000]
+    assert result[-2:] == [round(14000 / 7 - 7000 * 6 / 7), round(7000 / 7)]
+    left = result[0::2]
+    assert left == sorted(left, reverse=True)
+
+
+def test_mix_is_clipped_to_16_bits():
+    new = pcm(32767, -32768, 32767, -32768)
+    main.crossfade_pcm(bytes(pcm(32767, -32768, 32767, -32768)), memoryview(new), 0, 2)
+    assert samples(new) == [32767, -32768, 32767, -32768]
@@ -0,0 +1,54 @@
+import main
+
+READ = main.HUB_READ_SIZE
+SIZE = 8 * READ
+
+
+def listen_while_producing(advance_to):
+    """Run one listener on a hub whose producer moves head to advance_to(cursor) during the first send.
+
+    Returns (bytes sent per write, hub stats).
+    """
+    hub = main.BroadcastHub("test", SIZE)
+    hub._head = 4 * READ  # The listener starts 4 reads back, at 0
+    sent = []
+
+    def write(data):
+        if not sent:
+            hub._head = advance_to(0)
+        else:
+            hub.close()
+        sent.append(len(data))
+
+    hub.listen(write, "127.0.0.1:1")
+    return sent, hub.stats()
+
+
+def test_listener_exactly_at_the_boundary_is_kept():
+    # One read short of a full lap: nothing the listener was sent can have been overwritten yet
+    sent, stats = listen_while_producing(lambda cursor: cursor + SIZE - READ)
+    assert sent == [4 * READ, 3 * READ]
+    assert stats["dropped_listeners"] == 0
+
+
+def test_listener_lapped_by_the_read_in_progress_is_dropped():
+    # The producer's next read (up to READ bytes past head) would overwrite the start of what went out
+    sent, stats = listen_while_producing(lambda cursor: cursor + SIZE - READ + 1)
+    assert sent == [4 * READ]
+    assert stats["dropped_listeners"] == 1
+    assert stats["listeners"] == 0
+
+
+def test_new_listener_starts_on_a_frame_header():
+    hub = main.BroadcastHub("test", SIZE)
+    data = bytes(100) + b"\xff\xf1\x50\x80" + bytes(400)
+    hub._buf[:len(data)] = data
+    hub._head = len(data)
+    sent = []
+
+    def write(chunk):
+        sent.append(bytes(chunk))
+        hub.close()
+
+    hub.listen(write, "127.0.0.1:1")
+    assert sent == [data[100:]]
@@ -0,0 +1,77 @@
+import asyncio
+import subprocess
+import sys
+import types
+
+import main
+
+
+def test_level_tag_first_or_after_the_component():
+    assert main._ffmpeg_level(b"[error] Connection refused\n") == ("error", 0, 8)
+    line = b"[aac @ 0x55d1] [warning] Queue input is backward in time\n"
+    level, start, end = main._ffmpeg_level(line)
+    assert level == "warning"
+    entry = main.ProcessLog("test").append(line)
+    assert main.ProcessLog.message(entry) == "[aac @ 0x55d1] Queue input is backward in time"
+    assert main._ffmpeg_level(b"[panic] out of memory\n")[0] == "fatal"
+    assert main._ffmpeg_level(b"no tag at all\n") == ("info", 0, 0)
+
+
+def test_keeps_only_the_last_lines():
+    log = main.ProcessLog("test", size=3)
+    for i in range(5):
+        log.append(b"[info] line %d\n" % i)
+    kept = log.since(0)
+    assert [log.message(entry) for entry in kept] == ["line 2", "line 3", "line 4"]
+    assert log.seq == kept[-1][0]
+    assert [log.message(entry) for entry in log.since(kept[0][0])] == ["line 3", "line 4"]
+    assert log.since(log.seq) == []
+
+
+def test_errors_are_the_last_error_and_fatal_messages():
+    log = main.ProcessLog("test")
+    for line in (b"[error] one\n", b"[warning] skipped\n", b"[error] two\n", b"[fatal] three\n"):
+        log.append(line)
+    assert log.errors() == ["one", "two", "three"]
+    assert log.errors(2) == ["two", "three"]
+
+
+def test_logbook_keeps_the_last_processes_and_merges_their_lines():
+    book = main.LogBook(processes=2)
+    first = book.open("encoder")
+    first.append(b"[info] first\n")
+    second = book.open("feed")
+    second.append(b"[error] second\n")
+    first.append(b"[warning] third\n")
+    assert [line["message"] for line in book.lines()] == ["first", "second", "third"]
+    assert [line["message"] for line in book.lines(level="warning")] == ["second", "third"]
+    assert [line["message"] for line in book.lines(tail=1)] == ["third"]
+    third = book.open("encoder")
+    third.append(b"[info] fourth\n")
+    assert [line["message"] for line in book.lines()] == ["second", "fourth"]
+    assert book.seq == third.seq
+
+
+def test_overlong_stderr_lines_are_cut_and_reading_goes_on():
+    script = (
+        "import sys\n"
+        "w = sys.stderr.buffer.write\n"
+        "w(b'[info] short\\n')\n"
+        "w(b'[error] ' + b'x' * 200000 + b'\\n')\n"  # Past the stream's 64 KiB buffer
+        "w(b'[error] ' + b'y' * 10000 + b'\\n')\n"  # Fits the buffer, past LOG_LINE_MAX
+        "w(b'[fatal] last without a newline')\n"
+    )
+
+    async def run():
+        proc = await asyncio.create_subprocess_exec(sys.executable, "-c", script, stderr=subprocess.PIPE)
+        ff = types.SimpleNamespace(proc=proc, pid=proc.pid, log=main.ProcessLog("test"))
+        exit_code, errors = await asyncio.wait_for(main.watch_process(ff, "test", "Test"), 10)
+        return exit_code, errors, ff.log.since(0)
+
+    exit_code, errors, kept = asyncio.run(run())
+    assert exit_code == 0
+    assert [(entry[2], len(entry[3])) for entry in kept] == [
+        ("info", 13), ("error", main.LOG_LINE_MAX), ("error", main.LOG_LINE_MAX), ("fatal", 30)]
+    assert kept[1][3].startswith(b"[error] xxx")
+    assert kept[2][3].startswith(b"[error] yyy")
+    assert errors[-1] == "last without a newline"
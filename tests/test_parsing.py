@@ -0,0 +1,49 @@
+import main
+
+
+def test_targets_are_built_like_the_main_destination():
+    targets = main._parse_targets([
+        " rtmp://a.example/live/key1 ",
+        {"rtmp_server": "rtmp://b.example/live", "key": "key2"},
+        {"rtmp_server": "rtmp://c.example/live/ ", "key": " key3"},
+    ])
+    assert targets == ["rtmp://a.example/live/key1", "rtmp://b.example/live/key2", "rtmp://c.example/live/key3"]
+    assert targets[1] == main.build_rtmp_url("rtmp://b.example/live", "key2")
+
+
+def test_malformed_targets_are_rejected():
+    assert main._parse_targets(None) == []
+    assert main._parse_targets("rtmp://a.example/live/key") is None
+    assert main._parse_targets([{"rtmp_server": "rtmp://a.example/live"}]) is None
+    assert main._parse_targets([" "]) is None
+
+
+def test_profiles_from_a_preset_or_overrides():
+    assert main._parse_profile(None)[0] == {"preset": main.ENCODER_PROFILE, **main.ENCODER_PROFILES[main.ENCODER_PROFILE]}
+    assert main._parse_profile("voice") == ({"preset": "voice", **main.ENCODER_PROFILES["voice"]}, None)
+    profile, error = main._parse_profile({"preset": "low", "bitrate_kbps": 96, "sample_rate": 48000})
+    assert error is None
+    assert profile == {"preset": "low", "codec": "aac", "bitrate_kbps": 96, "sample_rate": 48000, "mono": False}
+    assert main._parse_profile({"bitrate_kbps": 8})[0]["bitrate_kbps"] == 8
+    assert main._parse_profile({"bitrate_kbps": main.ENCODER_MAX_KBPS})[0]["bitrate_kbps"] == main.ENCODER_MAX_KBPS
+    assert main._parse_profile({"codec": "copy", "bitrate_kbps": 999}) == (
+        {"preset": main.ENCODER_PROFILE, **main.ENCODER_PROFILES["passthrough"]}, None)
+
+
+def test_unknown_profiles_and_bad_values_are_rejected():
+    def error(raw):
+        profile, error = main._parse_profile(raw)
+        assert profile is None
+        return error
+
+    assert error(["standard"]) == "profile must be a preset name or an object"
+    assert error("ultra").startswith("profile preset must be one of ")
+    assert error({"preset": "ultra"}).startswith("profile preset must be one of ")
+    assert error({"bitrate": 128}) == "unknown profile fields: bitrate"
+    assert error({"codec": "opus"}).startswith("codec must be one of ")
+    for kbps in (0, 7, main.ENCODER_MAX_KBPS + 1, 128.0, "128", True, None):
+        assert error({"bitrate_kbps": kbps}) == f"bitrate_kbps must be 8-{main.ENCODER_MAX_KBPS}"
+    for rate in (8000, "44100", None):
+        assert error({"sample_rate": rate}).startswith("sample_rate must be one of ")
+    assert error({"mono": 1}) == "mono must be true or false"
+    assert error({"preset": "he-aac-v2", "mono": True}) == "he-aac-v2 needs stereo"
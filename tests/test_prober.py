@@ -0,0 +1,212 @@
+import asyncio
+
+import main
+
+
+def mpeg_frames(header: bytes, length: int, count: int = 12) -> bytes:
+    """count MPEG audio frames of length bytes with the given 4-byte header and a silent body"""
+    return (header + bytes(length - 4)) * count
+
+
+MP3_128K = mpeg_frames(b"\xff\xfb\x90\x00", 417)  # MPEG-1 layer III, 128 kbps, 44.1 kHz
+MP3_64K_MPEG2 = mpeg_frames(b"\xff\xf3\x80\x00", 208)  # MPEG-2 layer III, 64 kbps, 22.05 kHz
+ID3_TAG = b"ID3\x04\x00\x00\x00\x00\x00\x14" + bytes(20)  # A tag with a 20-byte body
+
+
+class StubStation:
+    """A local HTTP server that answers like a radio station and records what each connection was asked"""
+
+    def __init__(self) -> None:
+        self.connections = []  # Paths requested, one list per accepted connection
+        self.down = False  # /toggle answers 404 while set
+        self.server = None
+        self.port = None
+
+    async def __aenter__(self) -> "StubStation":
+        self.server = await asyncio.start_server(self._serve, "127.0.0.1", 0)
+        self.port = self.server.sockets[0].getsockname()[1]
+        return self
+
+    async def __aexit__(self, *exc) -> None:
+        self.server.close()
+        await self.server.wait_closed()
+
+    def url(self, path: str, host: str = "127.0.0.1") -> str:
+        return f"http://{host}:{self.port}{path}"
+
+    async def _serve(self, reader, writer) -> None:
+        requests = []
+        self.connections.append(requests)
+        try:
+            while True:
+                try:
+                    head = await reader.readuntil(b"\r\n\r\n")
+                except (asyncio.IncompleteReadError, ConnectionError):
+                    return
+                path = head.split(b" ")[1].decode("latin-1")
+                requests.append(path)
+                keep_alive = await self._respond(path, writer)
+                await writer.drain()
+                if not keep_alive:
+                    return
+        finally:
+            writer.close()
+
+    async def _respond(self, path: str, writer) -> bool:
+        redirects = {
+            "/redirect": ("/hop", b""),
+            "/hop": ("/icy", b"moved"),
+            "/away": (self.url("/mp3", "localhost"), b""),
+            "/away-then-close": (self.url("/mp3", "localhost"), b""),
+            "/loop": ("/loop", b""),
+        }
+        if path in redirects:
+            location, body = redirects[path]
+            writer.write(b"HTTP/1.1 302 Found\r\nLocation: %s\r\nContent-Length: %d\r\n\r\n%s"
+                         % (location.encode(), len(body), body))
+            return path != "/away-then-close"
+        if path == "/icy":
+            writer.write(b"ICY 200 OK\r\nContent-Type: audio/mpeg\r\nicy-br: 96,96\r\n\r\n" + MP3_128K)
+        elif path == "/mp3":
+            writer.write(b"HTTP/1.0 200 OK\r\nContent-Type: audio/mpeg\r\n\r\n" + MP3_128K)
+        elif path == "/mpeg2":
+            writer.write(b"HTTP/1.0 200 OK\r\nContent-Type: audio/mpeg\r\n\r\n" + ID3_TAG + MP3_64K_MPEG2)
+        elif path == "/text":
+            writer.write(b"HTTP/1.0 200 OK\r\nContent-Type: text/html; charset=utf-8\r\n\r\n<html></html>")
+        elif path == "/hang":
+            writer.write(b"HTTP/1.0 200 OK\r\nContent-Type: audio/mpeg\r\n\r\n")
+            await asyncio.sleep(30)
+        elif path == "/toggle" and not self.down:
+            writer.write(b"HTTP/1.0 200 OK\r\nContent-Type: audio/mpeg\r\n\r\n" + MP3_128K)
+        else:
+            writer.write(b"HTTP/1.0 404 Not Found\r\nContent-Length: 0\r\n\r\n")
+        return False
+
+
+def run(scenario):
+    async def wrapped():
+        async with StubStation() as station:
+            prober = main.SourceProber(timeout=2.0)
+            try:
+                await scenario(station, prober)
+            finally:
+                prober.close()
+
+    asyncio.run(wrapped())
+
+
+def test_follows_redirects_over_a_kept_alive_connection():
+    async def scenario(station, prober):
+        result = await prober.probe(station.url("/redirect"))
+        assert result["ok"], result
+        assert result["redirects"] == 2
+        assert result["status"] == 200
+        assert result["content_type"] == "audio/mpeg"
+        assert result["ttfb_ms"] is not None
+        # Both hops and the stream went over the first connection
+        assert station.connections == [["/redirect", "/hop", "/icy"]]
+
+    run(scenario)
+
+
+def test_reuses_idle_connections_across_probes():
+    async def scenario(station, prober):
+        for _ in range(2):
+            result = await prober.probe(station.url("/away"))
+            assert result["ok"], result
+            assert result["redirects"] == 1
+        # The redirect's connection was parked and used again; each stream had its own
+        assert sorted(station.connections) == [["/away", "/away"], ["/mp3"], ["/mp3"]]
+
+    run(scenario)
+
+
+def test_retries_when_an_idle_connection_was_closed():
+    async def scenario(station, prober):
+        for _ in range(2):
+            result = await prober.probe(station.url("/away-then-close"))
+            assert result["ok"], result
+        assert sorted(station.connections) == [["/away-then-close"], ["/away-then-close"], ["/mp3"], ["/mp3"]]
+
+    run(scenario)
+
+
+def test_bitrate_from_icy_br_header():
+    async def scenario(station, prober):
+        # icy-br wins over the frames (128 kbps)
+        assert (await prober.probe(station.url("/icy")))["bitrate_kbps"] == 96
+
+    run(scenario)
+
+
+def test_bitrate_from_mpeg_frame_header():
+    async def scenario(station, prober):
+        assert (await prober.probe(station.url("/mp3")))["bitrate_kbps"] == 128
+        # MPEG-2 frames after an ID3 tag
+        assert (await prober.probe(station.url("/mpeg2")))["bitrate_kbps"] == 64
+
+    run(scenario)
+
+
+def test_mp3_bitrate_needs_two_frames_in_a_row():
+    assert main.mp3_bitrate(MP3_128K[:417 + 4]) == 128
+    assert main.mp3_bitrate(b"\xff\xfb\x90\x00" + bytes(500)) is None
+    assert main.mp3_bitrate(b"not audio" * 100) is None
+
+
+def test_reports_why_a_station_is_down():
+    async def scenario(station, prober):
+        assert (await prober.probe(station.url("/missing")))["error"] == "HTTP 404"
+        assert (await prober.probe(station.url("/text")))["error"] == "not audio (text/html)"
+        assert (await prober.probe(station.url("/loop")))["error"] == "too many redirects"
+        prober.timeout = 0.3
+        result = await prober.probe(station.url("/hang"))
+        assert not result["ok"]
+        assert result["error"] == "no audio within 0.3s"
+
+    run(scenario)
+
+
+def test_results_expire_after_the_ttl():
+    async def scenario(station, prober):
+        prober.ttl = 0.2
+        url = station.url("/mp3")
+        assert prober.result(url) is None
+        assert (await prober.check(url))["ok"]
+        assert prober.result(url)["ok"]
+        await asyncio.sleep(0.3)
+        assert prober.result(url) is None
+        version = prober.version
+        prober.expire()
+        assert url not in prober._results
+        assert prober.version == version + 1
+
+    run(scenario)
+
+
+def test_usable_probes_again_only_a_station_known_to_be_down():
+    async def scenario(station, prober):
+        url = station.url("/toggle")
+        requests = lambda: sum(paths.count("/toggle") for paths in station.connections)
+
+        # Never probed: assumed usable, without a probe
+        assert await prober.usable(url)
+        assert requests() == 0
+
+        station.down = True
+        assert not (await prober.check(url))["ok"]
+        # Known down and still down
+        assert not await prober.usable(url)
+        assert requests() == 2
+
+        # Back up: the new probe says so and replaces the cached failure
+        station.down = False
+        assert await prober.usable(url)
+        assert requests() == 3
+        assert prober.result(url)["ok"]
+
+        # Known up: no probe needed
+        assert await prober.usable(url)
+        assert requests() == 3
+
+    run(scenario)
@@ -0,0 +1,81 @@
+import main
+
+BLOCK = (b"bitrate= 128.0kbits/s\ntotal_size=16000\nout_time_us=1000000\nout_time=00:00:01.000000\n"
+         b"dup_frames=1\ndrop_frames=0\nspeed=1.01x\nprogress=continue\n")
+
+
+class FakeClock:
+    def __init__(self) -> None:
+        self.now = 1000.0
+
+    def __call__(self) -> float:
+        return self.now
+
+
+def progress():
+    updates = []
+    return main.FFmpegProgress("test", "main", on_update=lambda: updates.append(1)), updates
+
+
+def test_a_block_is_parsed_when_its_progress_line_arrives():
+    parsed, updates = progress()
+    parsed.feed(BLOCK)
+    assert updates == [1]
+    assert parsed.snapshot()["out_time_s"] == 1.0
+    assert parsed.speed == 1.01
+    assert parsed.bitrate_kbps == 128.0
+    assert parsed.total_size == 16000
+    assert parsed.dup_frames == 1
+    assert not parsed.ended
+
+
+def test_blocks_split_anywhere_are_put_back_together():
+    parsed, updates = progress()
+    data = BLOCK + BLOCK.replace(b"progress=continue", b"progress=end").replace(b"out_time_us=1000000",
+                                                                             b"out_time_us=2500000")
+    for i in range(0, len(data), 7):
+        parsed.feed(data[i:i + 7])
+    assert len(updates) == 2
+    assert parsed.out_time == 2.5
+    assert parsed.ended
+
+
+def test_nothing_is_reported_until_the_block_is_complete():
+    parsed, updates = progress()
+    parsed.feed(BLOCK[:-len(b"progress=continue\n")] + b"progress=cont")
+    assert updates == []
+    assert parsed.out_time is None
+    parsed.feed(b"inue\n")
+    assert updates == [1]
+
+
+def test_na_values_keep_the_last_known_ones():
+    parsed, updates = progress()
+    parsed.feed(BLOCK)
+    parsed.feed(b"bitrate=N/A\ntotal_size=N/A\nout_time_us=N/A\ndup_frames=N/A\nspeed=N/A\nprogress=continue\n")
+    assert len(updates) == 2
+    assert parsed.out_time == 1.0
+    assert parsed.total_size == 16000
+    assert parsed.speed is None
+    assert parsed.bitrate_kbps is None
+    assert parsed.dup_frames == 0
+
+
+def test_progress_numbers():
+    assert main._progress_number("1.02x", "x") == 1.02
+    assert main._progress_number("128.0kbits/s", "kbits/s") == 128.0
+    assert main._progress_number("N/A", "x") is None
+    assert main._progress_number("") is None
+    assert main._progress_number(None) is None
+
+
+def test_drift_grows_while_slower_than_real_time(monkeypatch):
+    clock = FakeClock()
+    monkeypatch.setattr(main.time, "monotonic", clock)
+    parsed, _ = progress()
+    for second in range(6):
+        # Only half a second of output per second of wall clock
+        parsed.feed(b"out_time_us=%d\nspeed=0.5x\nprogress=continue\n" % (second * 500000))
+        clock.now += 1.0
+    assert parsed.drift == 2.5
+    assert parsed.lagging == (2.5 > main.PROGRESS_MAX_DRIFT)
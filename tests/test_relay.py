@@ -0,0 +1,177 @@
+import os
+import struct
+
+import pytest
+
+import main
+
+RATE = main.PCM_SAMPLE_RATE
+FRAME = main.PCM_FRAME_BYTES
+
+
+class FakeLoop:
+    """Just enough of an event loop for PcmRelay's clock: time stands still until the test moves it"""
+
+    def __init__(self) -> None:
+        self.now = 1000.0
+        self.next_at = None
+
+    def time(self) -> float:
+        return self.now
+
+    def call_at(self, when, callback):
+        self.next_at = when
+        return self
+
+    def cancel(self) -> None:
+        pass
+
+
+def frames(start: int, count: int) -> bytes:
+    """count frames, each holding its own number, so the order of the output can be checked"""
+    return struct.pack(f"<{count}I", *range(start, start + count))
+
+
+def numbers(data: bytes) -> list:
+    return list(struct.unpack(f"<{len(data) // FRAME}I", data))
+
+
+class Harness:
+    """A PcmRelay with one sink (a pipe we read back) on a FakeLoop"""
+
+    def __init__(self, buffer_size: int = 64 * 1024) -> None:
+        self.relay = main.PcmRelay("test", buffer_size=buffer_size, batch_size=4096, use_splice=False,
+                                   loudness_target=None)
+        self.loop = FakeLoop()
+        self.relay._loop = self.loop
+        self.source = main._FeedSource(None, "test", now=self.loop.now)
+        self.relay._source = self.source
+        self.read_fd, write_fd = os.pipe()
+        os.set_blocking(write_fd, False)
+        self.write_fd = write_fd
+        self.relay._sinks["sink"] = main._Sink(write_fd)
+        self.tick_frames = self.relay._tick_bytes // FRAME
+        self.pushed = 0  # Frames pushed so far
+
+    def close(self) -> None:
+        os.close(self.read_fd)
+        os.close(self.write_fd)
+
+    def push(self, count: int) -> None:
+        self.relay._push(self.source, memoryview(frames(self.pushed, count)))
+        self.pushed += count
+
+    def tick(self, late: float = 0.0) -> bytes:
+        """Run the tick that is due (late seconds after it is due) and return what it wrote"""
+        if self.loop.next_at is not None:
+            # A hair past the due time, so float rounding never makes the tick a frame short
+            self.loop.now = self.loop.next_at + late + 1e-7
+        self.relay._tick()
+        return os.read(self.read_fd, 1 << 20)
+
+
+@pytest.fixture
+def harness():
+    harness = Harness()
+    yield harness
+    harness.close()
+
+
+def test_ring_wraps_without_losing_or_reordering_audio(harness):
+    relay = harness.relay
+    # Prime the jitter buffer, then keep one tick in, one tick out for a few laps of the ring
+    harness.push(relay._jitter_bytes // FRAME)
+    out = b""
+    while harness.pushed * FRAME < 4 * relay._size:
+        harness.push(harness.tick_frames)
+        out += harness.tick()
+    assert relay._head > 3 * relay._size
+    assert numbers(out) == list(range(len(out) // FRAME))
+    assert len(out) // FRAME >= harness.pushed - relay._jitter_bytes // FRAME - harness.tick_frames
+    stats = relay.stats()
+    assert stats["underruns"] == 0
+    assert stats["dropped_bytes"] == 0
+
+
+def test_full_ring_drops_the_oldest_audio(harness):
+    relay = harness.relay
+    size_frames = relay._size // FRAME
+    # The encoder takes nothing while the feed pushes a ring and a half
+    for _ in range(3):
+        harness.push(size_frames // 2)
+    assert relay._head - relay._tail == relay._size
+    stats = relay.stats()
+    assert stats["dropped_bytes"] == harness.pushed * FRAME - relay._size
+    assert stats["read_stalls"] == 1
+    # What is left is the newest ring's worth, in order
+    out = harness.tick()
+    first = numbers(out)[0]
+    assert numbers(out) == list(range(first, first + len(out) // FRAME))
+    assert first >= harness.pushed - size_frames
+
+
+def test_backlog_beyond_max_latency_is_cut_to_the_jitter_buffer(harness):
+    relay = harness.relay
+    harness.push(relay._max_fill // FRAME + harness.tick_frames)
+    out = harness.tick()
+    # Playback jumps to the newest audio, keeping only the jitter buffer ahead of it
+    assert numbers(out)[0] == harness.pushed - relay._jitter_bytes // FRAME
+    assert relay.stats()["dropped_bytes"] > 0
+
+
+def test_put_larger_than_the_ring_keeps_the_newest_frames(harness):
+    relay = harness.relay
+    size_frames = relay._size // FRAME
+    relay._put(frames(0, size_frames + 10))
+    assert relay._head == relay._size
+    start = relay._tail % relay._size
+    assert numbers(bytes(relay._view[start:start + 4 * FRAME])) == [10, 11, 12, 13]
+
+
+def test_every_tick_writes_a_full_tick_of_filler_before_any_audio(harness):
+    for _ in range(3):
+        assert harness.tick() == bytes(harness.relay._tick_bytes)
+    stats = harness.relay.stats()
+    # Not an underrun yet: the encoder is only waiting for the station's first audio
+    assert stats["underruns"] == 0
+    assert stats["filler_bytes"] == 3 * harness.relay._tick_bytes
+
+
+def test_underrun_is_padded_with_silence_and_recovers(harness):
+    relay = harness.relay
+    tick = relay._tick_bytes
+    harness.push(relay._jitter_bytes // FRAME)
+    played = b""
+    while relay._head - relay._tail >= tick:
+        played += harness.tick()
+    # Less than a tick left: that goes out, the rest of the tick is silence
+    left = relay._head - relay._tail
+    out = harness.tick()
+    assert len(out) == tick
+    assert numbers(played + out[:left]) == list(range(harness.pushed))
+    assert out[left:] == bytes(tick - left)
+    stats = relay.stats()
+    assert stats["in_underrun"]
+    assert stats["underruns"] == 1
+
+    # The feed is dead: the clock keeps going on silence, and it is still one underrun
+    assert harness.tick() == bytes(tick)
+    assert relay.stats()["underruns"] == 1
+
+    # Audio is back: it waits for the jitter buffer again, then plays
+    harness.push(harness.tick_frames)
+    assert harness.tick() == bytes(tick)
+    harness.push(relay._jitter_bytes // FRAME)
+    out = harness.tick()
+    assert numbers(out)[0] == harness.pushed - relay._jitter_bytes // FRAME - harness.tick_frames
+    stats = relay.stats()
+    assert not stats["in_underrun"]
+    assert stats["underruns"] == 1
+    assert stats["filler_bytes"] == 3 * tick - left
+
+
+def test_clock_restarts_instead_of_bursting_after_a_long_stall(harness):
+    relay = harness.relay
+    harness.tick()
+    assert len(harness.tick(late=5.0)) == relay._tick_bytes
+    assert relay.stats()["clock_resets"] == 1
@@ -0,0 +1,89 @@
+import pytest
+
+import main
+
+Policy = main.RestartPolicy
+
+
+class FakeClock:
+    def __init__(self) -> None:
+        self.now = 1000.0
+
+    def __call__(self) -> float:
+        return self.now
+
+
+@pytest.fixture
+def clock(monkeypatch):
+    clock = FakeClock()
+    monkeypatch.setattr(main.time, "monotonic", clock)
+    return clock
+
+
+def crash(policy, clock, uptime: float = 1.0):
+    """Start, run for uptime seconds, exit with an error; returns the delay the policy asks for"""
+    policy.started()
+    clock.now += uptime
+    return policy.exited(1, "boom")
+
+
+def test_backoff_doubles_up_to_the_cap(clock):
+    policy = Policy(max_retries=10, base_delay=1.0, max_delay=10.0, jitter=0.0)
+    delays = [crash(policy, clock) for _ in range(6)]
+    assert delays == [1.0, 2.0, 4.0, 8.0, 10.0, 10.0]
+    assert policy.failures == 6
+    assert policy.circuit == Policy.CLOSED
+
+
+def test_jitter_stays_within_its_bounds(clock):
+    policy = Policy(max_retries=100, base_delay=4.0, max_delay=4.0, jitter=0.25)
+    delays = [crash(policy, clock) for _ in range(100)]
+    assert all(3.0 <= delay <= 5.0 for delay in delays)
+    assert len(set(delays)) > 1
+
+
+def test_long_uptime_starts_the_backoff_over(clock):
+    policy = Policy(max_retries=10, base_delay=1.0, jitter=0.0, healthy_after=30.0)
+    crash(policy, clock)
+    crash(policy, clock)
+    assert crash(policy, clock) == 4.0
+    assert crash(policy, clock, uptime=30.0) == 1.0
+    assert policy.failures == 1
+
+
+def test_circuit_opens_after_too_many_failures_and_half_opens_after_the_cooldown(clock):
+    policy = Policy(max_retries=3, base_delay=1.0, jitter=0.0, healthy_after=30.0, cooldown=300.0)
+    assert [crash(policy, clock) for _ in range(3)] == [1.0, 2.0, 4.0]
+    assert crash(policy, clock) == 300.0
+    assert policy.circuit == Policy.OPEN
+    assert policy.status(False)["next_restart_s"] == 300.0
+
+    # The trial restart fails quickly: open again for another cooldown
+    policy.attempt()
+    assert policy.circuit == Policy.HALF_OPEN
+    assert crash(policy, clock) == 300.0
+    assert policy.circuit == Policy.OPEN
+
+    # The next trial stays up: the circuit closes as soon as the status sees it healthy
+    policy.attempt()
+    policy.started()
+    clock.now += 30.0
+    status = policy.status(True)
+    assert status["circuit"] == Policy.CLOSED
+    assert status["failures"] == 0
+    assert status["restarts"] == 2
+
+
+def test_no_cooldown_means_giving_up_until_a_manual_start(clock):
+    policy = Policy(max_retries=1, jitter=0.0, cooldown=0)
+    assert crash(policy, clock) is not None
+    assert crash(policy, clock) is None
+    assert policy.circuit == Policy.OPEN
+    assert policy.status(False)["next_restart_s"] is None
+
+    policy.attempt()
+    policy.reset()
+    assert policy.circuit == Policy.CLOSED
+    assert policy.failures == 0
+    assert policy.restarts == 1
+    assert policy.last_error == "boom"
@@ -0,0 +1,205 @@
+import asyncio
+import os
+import time
+
+import pytest
+
+import main
+
+A = {"name": "A", "url": "http://example.com/a"}
+B = {"name": "B", "url": "http://example.com/b"}
+C = {"name": "C", "url": "http://example.com/c"}
+
+
+class FakeClock:
+    def __init__(self, now: float) -> None:
+        self.now = now
+
+    def __call__(self) -> float:
+        return self.now
+
+
+@pytest.fixture
+def london():
+    """Run in a time zone with DST (GMT/BST)"""
+    old = os.environ.get("TZ")
+    os.environ["TZ"] = "Europe/London"
+    time.tzset()
+    yield
+    if old is None:
+        del os.environ["TZ"]
+    else:
+        os.environ["TZ"] = old
+    time.tzset()
+
+
+def local(*fields) -> float:
+    """Wall-clock time of a local date and time (year, month, day, hour, minute)"""
+    year, month, day, hour, minute = fields
+    return time.mktime((year, month, day, hour, minute, 0, 0, 0, -1))
+
+
+def scheduler_at(now: float, channel_id: str, schedule) -> tuple:
+    clock = FakeClock(now)
+    scheduler = main.Scheduler(None, None, clock)
+    scheduler.set(channel_id, schedule)
+    return scheduler, clock
+
+
+def test_rotation_changes_on_epoch_aligned_boundaries():
+    period = 10 * 60
+    start = 1_800_000_000  # A multiple of the period
+    schedule = {"rotate": {"stations": [A, B, C], "every_minutes": 10}}
+    scheduler, clock = scheduler_at(start + 123, "ch", schedule)
+    assert scheduler.get("ch")["next_at"] == start + period
+
+    assert scheduler.run_due(start + period - 1) == []
+    played = []
+    for n in range(1, 7):
+        clock.now = start + n * period
+        due = scheduler.run_due()
+        assert [(channel_id, station) for channel_id, _, station in due] == [
+            ("ch", [A, B, C][(start // period + n) % 3])]
+        played.append(due[0][2])
+        # Each change is handed out once
+        assert scheduler.run_due() == []
+    assert played[:3] == played[3:]
+
+
+def test_rotation_catches_up_after_a_late_timer():
+    schedule = {"rotate": {"stations": [A, B], "every_minutes": 1}}
+    scheduler, clock = scheduler_at(1_800_000_000, "ch", schedule)
+    # Woken 2.5 periods late: one switch, straight to the station that should be on now
+    clock.now = 1_800_000_000 + 150
+    due = scheduler.run_due()
+    assert [station for _, _, station in due] == [[A, B][(1_800_000_000 // 60 + 2) % 2]]
+    assert scheduler.get("ch")["next_at"] == 1_800_000_000 + 180
+
+
+def test_timetable_rolls_over_past_midnight(london):
+    schedule = {"slots": [{"at": "06:00", "station": A}, {"at": "22:00", "station": B}]}
+    scheduler, clock = scheduler_at(local(2026, 6, 10, 23, 0), "ch", schedule)
+    status = scheduler.get("ch")
+    assert status["now"] == B
+    assert status["next"] == A
+    assert status["next_at"] == local(2026, 6, 11, 6, 0)
+
+    # After midnight, before the first slot, yesterday's last one is still on
+    clock.now = local(2026, 6, 11, 3, 0)
+    assert scheduler.run_due() == []
+    assert scheduler.get("ch")["now"] == B
+
+    clock.now = local(2026, 6, 11, 6, 0)
+    due = scheduler.run_due()
+    assert [station for _, _, station in due] == [A]
+    assert scheduler.get("ch")["next_at"] == local(2026, 6, 11, 22, 0)
+
+
+def test_timetable_across_month_end(london):
+    schedule = {"slots": [{"at": "00:30", "station": A}, {"at": "12:00", "station": B}]}
+    scheduler, clock = scheduler_at(local(2026, 6, 30, 13, 0), "ch", schedule)
+    assert scheduler.get("ch")["next_at"] == local(2026, 7, 1, 0, 30)
+
+
+@pytest.mark.parametrize("day, hours", [
+    ((2026, 3, 28), 7),  # Clocks go forward at 01:00 on the 29th: the night is an hour short
+    ((2026, 10, 24), 9),  # Clocks go back at 02:00 on the 25th: the night is an hour long
+])
+def test_timetable_across_dst_change(london, day, hours):
+    schedule = {"slots": [{"at": "06:00", "station": A}, {"at": "22:00", "station": B}]}
+    evening = local(*day, 22, 0)
+    scheduler, clock = scheduler_at(evening, "ch", schedule)
+    next_at = scheduler.get("ch")["next_at"]
+    assert next_at - evening == hours * 3600
+    assert time.localtime(next_at)[3:5] == (6, 0)
+
+    assert scheduler.run_due(next_at - 1) == []
+    assert [station for _, _, station in scheduler.run_due(next_at)] == [A]
+
+
+def test_removed_schedule_is_not_played():
+    schedule = {"rotate": {"stations": [A, B], "every_minutes": 1}}
+    scheduler, clock = scheduler_at(1_800_000_000, "ch", schedule)
+    assert scheduler.remove("ch")
+    assert scheduler.run_due(1_800_000_000 + 600) == []
+    assert scheduler.get("ch") is None
+
+
+class FakeChannel:
+    def __init__(self, url, state="live") -> None:
+        self.url = url
+        self.state = state
+
+    def requested_url(self):
+        return self.url
+
+    def get_status(self):
+        return {"state": self.state}
+
+
+@pytest.fixture
+def manager(monkeypatch):
+    """StreamManager with one fake channel; records the starts play_scheduled asks for"""
+    manager = main.StreamManager()
+    channels = {}
+    starts = []
+
+    async def start_stream(url, rtmp_server, key, name, channel_id, **options):
+        starts.append((channel_id, url))
+        return {"status": "switched"}
+
+    monkeypatch.setattr(manager, "get_channel", lambda channel_id, create=False: channels.get(channel_id))
+    monkeypatch.setattr(manager, "start_stream", start_stream)
+    manager.fake_channels = channels
+    manager.starts = starts
+    yield manager
+    del manager.fake_channels, manager.starts
+
+
+def play(scheduler, now):
+    for channel_id, schedule, station in scheduler.run_due(now):
+        asyncio.run(main.play_scheduled(channel_id, schedule, station))
+
+
+def test_switch_is_skipped_when_the_station_already_plays(manager):
+    schedule = {"rotate": {"stations": [A, B], "every_minutes": 1}, "rtmp_server": "rtmp://x/live", "key": "k"}
+    start = 1_800_000_000 - 1_800_000_000 % 120  # A plays in even minutes, B in odd ones
+    scheduler, clock = scheduler_at(start, "ch", schedule)
+
+    manager.fake_channels["ch"] = FakeChannel(B["url"])
+    play(scheduler, start + 60)
+    assert manager.starts == []
+
+    play(scheduler, start + 120)
+    assert manager.starts == [("ch", A["url"])]
+
+
+def test_stopped_channel_is_started_even_on_its_station(manager):
+    schedule = {"rotate": {"stations": [A, B], "every_minutes": 1}, "rtmp_server": "rtmp://x/live", "key": "k"}
+    start = 1_800_000_000 - 1_800_000_000 % 120
+    scheduler, clock = scheduler_at(start, "ch", schedule)
+    manager.fake_channels["ch"] = FakeChannel(B["url"], state="stopped")
+    play(scheduler, start + 60)
+    assert manager.starts == [("ch", B["url"])]
+
+
+def test_switches_under_way_are_kept_and_cancelled_on_stop():
+    async def scenario():
+        started = asyncio.Event()
+
+        async def apply(channel_id, schedule, station):
+            started.set()
+            await asyncio.sleep(3600)
+
+        scheduler = main.Scheduler(None, apply, FakeClock(1_800_000_000))
+        scheduler.start()
+        scheduler.set("ch", {"rotate": {"stations": [A, B], "every_minutes": 1}})
+        await started.wait()
+        tasks = list(scheduler._tasks)
+        assert len(tasks) == 1
+        scheduler.stop()
+        await asyncio.gather(*tasks, return_exceptions=True)
+        assert tasks[0].cancelled()
+        assert not scheduler._tasks
+
+    asyncio.run(scenario())
@@ -0,0 +1,58 @@
+from fastapi.testclient import TestClient
+
+import main
+
+PLAYLIST = "https://example.com/radio/abdulbasit\n#comment\n\nhttps://example.com/radio/minshawi\n"
+
+
+def catalog(tmp_path, monkeypatch, content=PLAYLIST):
+    path = tmp_path / "stations.m3u"
+    path.write_text(content, encoding="utf-8")
+    stations = main.StationCatalog(path)
+    monkeypatch.setattr(main, "station_catalog", stations)
+    monkeypatch.setattr(main, "_station_bodies", {})
+    return path, stations
+
+
+def test_etag_matches():
+    etag = '"abc"'
+    assert main.etag_matches('"abc"', etag)
+    assert main.etag_matches('W/"abc"', etag)
+    assert main.etag_matches(' * ', etag)
+    assert main.etag_matches('"old", W/"abc"', etag)
+    assert not main.etag_matches('"old", "older"', etag)
+    assert not main.etag_matches('abc', etag)
+    assert not main.etag_matches('', etag)
+    assert not main.etag_matches(None, etag)
+
+
+def test_catalog_reloads_only_when_the_file_changes(tmp_path, monkeypatch):
+    path, stations = catalog(tmp_path, monkeypatch)
+    body, etag = stations.json_body()
+    assert [s["url"] for s in stations.stations()] == ["https://example.com/radio/abdulbasit",
+                                                        "https://example.com/radio/minshawi"]
+    assert stations.get_by_id(2)["url"] == "https://example.com/radio/minshawi"
+    assert stations.json_body()[0] is body
+    path.write_text(PLAYLIST + "https://example.com/radio/husary\n", encoding="utf-8")
+    assert stations.json_body()[1] != etag
+    assert stations.get_by_url("https://example.com/radio/husary")["id"] == 3
+
+
+def test_stations_answer_304_to_a_matching_etag(tmp_path, monkeypatch):
+    path, _ = catalog(tmp_path, monkeypatch)
+    client = TestClient(main.app)
+    first = client.get("/api/stations")
+    assert first.status_code == 200
+    etag = first.headers["etag"]
+    assert len(first.json()) == 2
+    for header in (etag, "W/" + etag, '"old", ' + etag, "*"):
+        again = client.get("/api/stations", headers={"If-None-Match": header})
+        assert again.status_code == 304
+        assert again.headers["etag"] == etag
+        assert again.content == b""
+    assert client.get("/api/stations", headers={"If-None-Match": '"old"'}).status_code == 200
+    path.write_text(PLAYLIST + "https://example.com/radio/husary\n", encoding="utf-8")
+    changed = client.get("/api/stations", headers={"If-None-Match": etag})
+    assert changed.status_code == 200
+    assert changed.headers["etag"] != etag
+    assert len(changed.json()) == 3